@@ -5,6 +5,8 @@ parser = argparse.ArgumentParser(description='Generate the qubit topology for a
 parser.add_argument('n', metavar='N', type=int, help='size of the surface code (number of rows and columns of data qubits)')
 parser.add_argument('topology_file', nargs='?', default='qec_topology.json', help='name of the output json file')
 parser.add_argument('header_file', nargs='?', default='qec.h', help='name of the output header file containing constant macros (such as the number of qubits in each group)')
+parser.add_argument('detector_file', nargs='?', default='qec_detectors.json', help='name of the output json file describing detectors and logical observables')
+parser.add_argument('--ancilla-reset', action='store_true', help='assume ancilla qubits are reset after each measurement (qmemory_experiment does not reset them)')
 parser.add_argument('-v', '--visualize', action='store_true', help='visualize the layout of gates')
 
 args = parser.parse_args()
@@ -112,3 +114,35 @@ with open(args.topology_file, 'w') as fout:
 
 with open(args.header_file, 'w') as fout:
     fout.writelines(f'#define {k} {v}\n' for k, v in macros)
+
+
+def data_neighbors(qubit):
+    return [(qubit[0] + dx, qubit[1] + dy) for dx in (-1, 1) for dy in (-1, 1)
+            if (qubit[0] + dx, qubit[1] + dy) in data_qubit_coords]
+
+
+# A detector compares measurements of the same ancilla qubit, which are
+# identified by how many measurements of that qubit ago they happened. Without
+# reset, the outcome of an ancilla accumulates the stabilizer values of all
+# rounds, so a detector compares a measurement with the one 2 rounds before.
+lookback = [0, 1] if args.ancilla_reset else [0, 2]
+detectors = [{'type': basis,
+              'qubits': [qubit_index[q] for g in groups for q in qubit_groups[g]],
+              'lookback': lookback}
+             for basis, groups in (('X', ('X1', 'X2')), ('Z', ('Z1', 'Z2')))]
+
+# Logical operators run along the first row or the first column of data
+# qubits; the Z logical is the one commuting with all X stabilizers
+row = [(0, y * 2) for y in range(n)]
+column = [(x * 2, 0) for x in range(n)]
+x_stabilizers = [data_neighbors(q) for g in ('X1', 'X2') for q in qubit_groups[g]]
+if all(len(set(row) & set(s)) % 2 == 0 for s in x_stabilizers):
+    logical_z, logical_x = row, column
+else:
+    logical_z, logical_x = column, row
+observables = [{'type': 'Z', 'qubits': [qubit_index[q] for q in logical_z]},
+               {'type': 'X', 'qubits': [qubit_index[q] for q in logical_x]}]
+
+with open(args.detector_file, 'w') as fout:
+    json.dump({'qubit_coords': [list(q) for q in sorted(qubit_index, key=qubit_index.get)],
+               'detectors': detectors, 'observables': observables}, fout)
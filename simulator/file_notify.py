@@ -0,0 +1,137 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Event-driven waiting for files produced by other processes.
+
+Files such as `exit_code.txt` are written by the RISC-V simulator plugin to
+signal completion. Instead of repeatedly checking for their existence with a
+fixed sleep interval, `wait_for_file()` blocks on an `inotify` watch of the
+parent directory, and returns as soon as the file has been written and
+closed. On platforms without `inotify`, it falls back to polling with a short
+interval.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+_EVENT_HEADER = struct.Struct('iIII')
+_POLL_INTERVAL_MIN = 1e-4
+_POLL_INTERVAL_MAX = 1e-2
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    return libc
+
+
+class _Inotify():
+    """Process-wide inotify instance.
+
+    The instance and its watches are kept open across waits, since tearing
+    down an inotify instance may block for several milliseconds in the kernel.
+    """
+
+    def __init__(self, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        self.watches = set()
+
+    def watch(self, directory):
+        if directory not in self.watches:
+            if self.libc.inotify_add_watch(self.fd, directory.encode(),
+                                           IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+                return False
+            self.watches.add(directory)
+        return True
+
+    def read_names(self, timeout=None):
+        """Read pending event names, waiting up to `timeout` seconds if none."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            buf = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(buf):
+            _, _, _, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            names.append(buf[offset:offset + length].rstrip(b'\0').decode())
+            offset += length
+        return names
+
+
+_libc = _load_libc()
+_inotify = None
+
+
+def wait_for_file(path, timeout=None):
+    """
+    Block until a file exists at the given path.
+
+    The file is considered ready once it has been closed after writing, or
+    moved into place. If the file already exists, returns immediately.
+
+    Args:
+        path (str): path of the file to wait for.
+        timeout (float, optional): maximum time to wait in seconds. Waits
+        indefinitely if `None`.
+
+    Returns:
+        bool: `True` if the file exists, `False` upon timeout.
+    """
+    global _inotify  # pylint: disable=global-statement
+    deadline = None if timeout is None else time.monotonic() + timeout
+    if _inotify is None and _libc is not None:
+        _inotify = _Inotify(_libc)
+    directory, name = os.path.split(os.path.abspath(path))
+    if _inotify is None or _inotify.fd < 0 or not _inotify.watch(directory):
+        return _poll_for_file(path, deadline)
+    # Discard events left over from previous waits
+    while _inotify.read_names(0):
+        pass
+    # The file may have been written before the watch was added
+    if os.path.exists(path):
+        return True
+    while True:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return False
+        # The file may have been removed again since the event
+        if name in _inotify.read_names(remaining) and os.path.exists(path):
+            return True
+
+
+def _poll_for_file(path, deadline):
+    interval = _POLL_INTERVAL_MIN
+    while not os.path.exists(path):
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+        interval = min(interval * 2, _POLL_INTERVAL_MAX)
+    return True
@@ -24,18 +24,35 @@ A pulse configuration file is a '.json' file and consists of the following:
     - 'waveforms': a dictionary of waveform informations indexed by pulse
     indices. A waveform is played on the corresponding channel upon indicating
     the corresponding waveform index.
+- 'qec' (optional): description of QEC detectors and logical observables, as
+generated by 'programs/util/qec_gen.py', used by the 'stim' backend.
+
+Unless '--inline-waveforms' is given, the waveforms are written in the compact
+form of 'waveform_store.py': channels share deduplicated 'waveform_sets', and
+envelopes are stored once in a binary waveform library next to the pulse
+configuration file, with the same name and the '.wfm' extension. The type of
+each channel is also written to the channel index of 'waveform_overlay.py',
+with the '.channels' extension.
 """
 
 import argparse
 import json
+import os
 import numpy as np
 
+from waveform_overlay import channel_index_path, overlay_path, write_channel_index
+from waveform_store import compact_config, write_library
+
 parser = argparse.ArgumentParser(
     description='Generate pulse configuration file for the pulse simulator backend.')
 parser.add_argument('topology_file', nargs='?', default='topology.json',
                     help='the json file describing the qubit topology')
 parser.add_argument('pulse_file', nargs='?', default='pulse.json',
                     help='the output pulse configuration file')
+parser.add_argument('--detectors', metavar='DETECTOR_FILE',
+                    help='the json file describing QEC detectors and observables')
+parser.add_argument('--inline-waveforms', action='store_true',
+                    help='write the waveforms of each channel into the pulse configuration file')
 args = parser.parse_args()
 
 # Read topology file for qubit connectivity
@@ -102,5 +119,19 @@ for i in qubit_topology:
     channel_config.update({index: tq_channel_config})
     index += 1
 
+pulse_config = {"qubits": qubit_config, "channels": channel_config}
+if args.detectors:
+    with open(args.detectors, 'r') as fin:
+        pulse_config["qec"] = json.load(fin)
+
+if not args.inline_waveforms:
+    library_file = os.path.splitext(args.pulse_file)[0] + '.wfm'
+    pulse_config, waveforms = compact_config(pulse_config, os.path.basename(library_file))
+    write_library(library_file, waveforms)
+
 with open(args.pulse_file, 'w') as f:
-    json.dump({"qubits": qubit_config, "channels": channel_config}, f)
+    json.dump(pulse_config, f)
+write_channel_index(channel_index_path(args.pulse_file), pulse_config)
+# Envelopes transmitted at run time apply to the replaced configuration only
+if os.path.exists(overlay_path(args.pulse_file)):
+    os.remove(overlay_path(args.pulse_file))
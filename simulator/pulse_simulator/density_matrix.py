@@ -0,0 +1,98 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Density matrix engine for time-sliced pulse-level simulation.
+
+The density matrix of `n` qubits is kept as a NumPy array of shape
+`(2,) * 2n`, where axis `k` corresponds to the row index of qubit `k`, and
+axis `n + k` to its column index. Evolutions acting on a subset of the qubits
+are applied by contracting their superoperators with the corresponding axes,
+and the decay of idle qubits is applied in closed form.
+"""
+
+import numpy as np
+
+
+class DensityMatrix():
+    """Mixed state of a register of qubits, initialized to |0...0><0...0|.
+
+    Args:
+        num_qubits (int): Number of qubits.
+    """
+
+    def __init__(self, num_qubits):
+        self.num_qubits = num_qubits
+        self.rho = np.zeros((2,) * (2 * num_qubits), dtype=complex)
+        self.rho[(0,) * (2 * num_qubits)] = 1
+
+    def matrix(self):
+        """The density matrix as a 2D array."""
+        dim = 2 ** self.num_qubits
+        return self.rho.reshape(dim, dim)
+
+    def set_matrix(self, matrix):
+        """Replace the state by a density matrix given as a 2D array."""
+        self.rho = np.asarray(matrix, dtype=complex).reshape((2,) * (2 * self.num_qubits))
+
+    def apply_superoperator(self, superop, qubits):
+        """Apply a linear map acting on a subset of the qubits.
+
+        Args:
+            superop (numpy.ndarray): Matrix of the map acting on column-stacked
+            density matrices of 'qubits' (the convention of
+            'qutip.operator_to_vector'), where the first qubit corresponds to
+            the most significant bit of row and column indices.
+            qubits (List[int]): Qubits the map acts on.
+        """
+        k = len(qubits)
+        n = self.num_qubits
+        superop = superop.reshape((2,) * (4 * k))
+        # Input axes of the map are ordered as (columns, rows)
+        in_axes = list(range(2 * k, 4 * k))
+        rho_axes = [n + q for q in qubits] + list(qubits)
+        res = np.tensordot(superop, self.rho, axes=(in_axes, rho_axes))
+        self.rho = np.moveaxis(res, list(range(2 * k)), rho_axes)
+
+    def relax(self, qubit, duration, t1=None, t2=None):
+        """Apply amplitude damping and dephasing of an idle qubit.
+
+        Matches the relaxation model of 'qutip_qip', where populations decay
+        with 't1' and coherences with 't2' in total.
+
+        Args:
+            qubit (int): Idle qubit.
+            duration (double): Idle time.
+            t1 (Optional[double]): T1 of the qubit. No amplitude damping if
+            'None'.
+            t2 (Optional[double]): T2 of the qubit. If 'None', coherences only
+            decay because of amplitude damping.
+        """
+        n = self.num_qubits
+        decay = 1 if t1 is None else np.exp(-duration / t1)
+        coherence = np.sqrt(decay) if t2 is None else np.exp(-duration / t2)
+        rho = np.moveaxis(self.rho, [qubit, n + qubit], [0, 1])
+        rho[0, 0] += (1 - decay) * rho[1, 1]
+        rho[1, 1] *= decay
+        rho[0, 1] *= coherence
+        rho[1, 0] *= coherence
+
+    def probabilities(self):
+        """Probability distribution over the computational basis.
+
+        Returns:
+            numpy.ndarray: Probabilities indexed by basis states, where qubit 0
+            corresponds to the most significant bit.
+        """
+        return np.real(np.diagonal(self.matrix())).copy()
@@ -36,48 +36,92 @@ the pulse sequence.
     will raise exit code 1, whereas storing a pulse sequence to a non-reserved
     index overwrites the previous pulse information stored at this index.
 
+Alternatively, `input_file` can be binary, starting with the magic `b'YQEN'`
+followed by `channel`, `index` and `length` as little-endian uint32, and by
+`length` little-endian int16 samples.
+
 Currently only supports 1Q gate pulse transmissions.
     * In the case the channel is an `xy_channel`, the pulse sequence is complex,
     with real and imaginary components written on lines `[1 : length // 2 + 1]`
     and `[length // 2 + 1 : length // 2]`.
+
+The pulse configuration file is left untouched: the pulse sequence is appended
+to its overlay (see `waveform_overlay.py`), such that the cost of a
+transmission does not grow with the size of the configuration, and a running
+pulse simulator only reads the new pulse sequence. Likewise, the channel is
+checked against the channel index written by `config_gen.py` rather than the
+configuration itself, which is only read for configurations without an index.
+A pulse sequence whose number of samples differs from `length` raises exit
+code 1.
 """
 
+import array
 import json
+import struct
 import sys
 
+from waveform_overlay import append_record, channel_index_path, overlay_path, read_channel_index
+
 # Reserved indices; overwriting such indices will cause error
 RESERVED_INDICES = [0, 1, 2, 3, 64, 65] + list(range(127, 256))
+BINARY_MAGIC = b'YQEN'
+BINARY_HEADER = struct.Struct('<4sIII')
+
+
+def read_envelope(input_file):
+    """Read a pulse sequence in the text or binary format.
+
+    Returns:
+        str, str, int, List[int]: Channel, index, length and samples.
+    """
+    with open(input_file, "rb") as f:
+        data = f.read()
+    if data.startswith(BINARY_MAGIC):
+        _, channel, index, length = BINARY_HEADER.unpack_from(data)
+        envelope = array.array('h')
+        envelope.frombytes(data[BINARY_HEADER.size:BINARY_HEADER.size + 2 * length])
+        if sys.byteorder == 'big':
+            envelope.byteswap()
+        return str(channel), str(index), length, envelope.tolist()
+    k = data.decode().split('\n')
+    info = k[0].split(' ')
+    envelope = [int(i) for i in k[1:] if len(i.strip()) > 0]
+    return info[0], info[1], int(info[2]), envelope
+
+
+def read_channel_types(config_file):
+    """Read the types of the channels of a pulse configuration, from its
+    channel index, or from the configuration itself if it has no index.
+
+    Returns:
+        Dict[str, str]: Type of each channel.
+    """
+    channel_types = read_channel_index(channel_index_path(config_file))
+    if channel_types is None:
+        with open(config_file, "r") as f:
+            channel_types = {channel: config["type"]
+                             for channel, config in json.load(f)['channels'].items()}
+    return channel_types
 
 
 def envelope_transmission(input_file, output_file):
-    with open(input_file, "r") as f:
-        k = f.readlines()
-        info = k[0].split(' ')
-        channel = info[0]
-        index = info[1]
-        length = int(info[2])
-        envelope = [int(i) for i in k[1:] if len(i) > 0]
-    with open(output_file, "r") as f:
-        pulse_json = json.load(f)
-    if channel not in pulse_json['channels']:
+    channel, index, length, envelope = read_envelope(input_file)
+    channel_types = read_channel_types(output_file)
+    if len(envelope) != length:
+        print(f"Pulse sequence of {len(envelope)} samples instead of {length}")
+        exit(1)
+    elif channel not in channel_types:
         print("Channel non-existent")
         exit(1)
-    elif pulse_json['channels'][channel]["type"] != "1Q":
+    elif channel_types[channel] != "1Q":
         print("Multi-qubit channel envelope transmission not yet supported")
         exit(1)
-    else:
-        if int(index) in RESERVED_INDICES:
-            print("Pulse index reserved and cannot be modified")
-            exit(1)
-        elif int(index) < 64:  # xy pulse
-            xy_len = length // 2
-            pulse_json["channels"][channel]["waveforms"][index] = [
-                "xy_waveform", [envelope[:xy_len], envelope[xy_len:]]]
-        else:  # z pulse
-            pulse_json['channels'][channel]["waveforms"][index] = [
-                "z_waveform", envelope]
-    with open(output_file, "w") as f:
-        json.dump(pulse_json, f)
+    elif int(index) in RESERVED_INDICES:
+        print("Pulse index reserved and cannot be modified")
+        exit(1)
+    # The quadratures of an xy pulse are the two halves of its record
+    kind = b'x' if int(index) < 64 else b'z'
+    append_record(overlay_path(output_file), int(channel), int(index), kind, envelope)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Gate fusion pass for gate-level simulation.
+
+Programs such as randomized benchmarking emit long runs of single-qubit
+pulses on the same qubit. Before simulation, the gate sequence is rewritten
+such that:
+    * consecutive single-qubit gates on the same qubit are multiplied into one
+    2x2 matrix;
+    * single-qubit gates right before or after a two-qubit gate on the same
+    qubit are absorbed into the 4x4 matrix of the two-qubit gate;
+    * consecutive two-qubit gates on the same pair of qubits are multiplied
+    into one 4x4 matrix.
+
+Absorbing a single-qubit gate into a two-qubit gate always pays off for dense
+simulation, since applying a 4x4 matrix costs a single pass over the state.
+
+Gates are given as '(targets, matrix)' tuples, where 'targets' is a tuple of
+one or two qubits, and the first target corresponds to the more significant
+bit of the row and column indices of 'matrix'.
+"""
+
+import numpy as np
+
+_SWAP = np.eye(4)[[0, 2, 1, 3]]
+
+
+def _embed(matrix, position):
+    """Embed a single-qubit gate acting on target 'position' of a pair."""
+    if position == 0:
+        return np.kron(matrix, np.eye(2))
+    return np.kron(np.eye(2), matrix)
+
+
+def fuse_gates(gates):
+    """Fuse a sequence of one- and two-qubit gates.
+
+    Args:
+        gates (List[Tuple[Tuple[int], numpy.ndarray]]): Gates in the order of
+        application.
+
+    Returns:
+        List[Tuple[Tuple[int], numpy.ndarray]]: Equivalent sequence of fused
+        gates.
+    """
+    fused = []
+    # Single-qubit gates not yet emitted, by qubit
+    pending = {}
+    # Index in 'fused' of the last gate acting on each qubit
+    last = {}
+    for targets, matrix in gates:
+        if len(targets) == 1:
+            qubit = targets[0]
+            if qubit in pending:
+                pending[qubit] = matrix @ pending[qubit]
+            elif qubit in last:
+                # Nothing acted on the qubit since that two-qubit gate
+                pair, pair_matrix = fused[last[qubit]]
+                fused[last[qubit]] = pair, _embed(matrix, pair.index(qubit)) @ pair_matrix
+            else:
+                pending[qubit] = matrix
+            continue
+        targets = tuple(targets)
+        for position, qubit in enumerate(targets):
+            if qubit in pending:
+                matrix = matrix @ _embed(pending.pop(qubit), position)
+        previous = last.get(targets[0])
+        if previous is not None and previous == last.get(targets[1]):
+            pair, pair_matrix = fused[previous]
+            if pair != targets:
+                pair_matrix = _SWAP @ pair_matrix @ _SWAP
+            fused[previous] = targets, matrix @ pair_matrix
+            continue
+        last[targets[0]] = last[targets[1]] = len(fused)
+        fused.append((targets, matrix))
+    # Single-qubit gates before any two-qubit gate commute with all of the
+    # gates emitted so far
+    for qubit in sorted(pending):
+        fused.append(((qubit,), pending[qubit]))
+    return fused
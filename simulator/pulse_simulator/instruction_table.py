@@ -0,0 +1,106 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Columnar representation of pulse instructions.
+
+The pulse instructions of a trigger are held in a structured array of
+'INSTRUCTION_DTYPE', the layout also used by the shared-memory rings of
+'shm_ring.py': one row per line of `pulses.txt`, with the fields `delay`,
+`channel`, `index` and `params` (the four configurable parameters). The lines
+are parsed in bulk by 'parse_lines()', and the rising and falling edges of
+square pulses are matched by 'pair_edges()' with array operations.
+"""
+
+import itertools
+
+import numpy as np
+
+from shm_ring import INSTRUCTION_DTYPE
+
+FIELDS = 7
+
+
+def parse_lines(lines):
+    """Parse lines of `pulses.txt` into a structured array of
+    'INSTRUCTION_DTYPE'.
+
+    Args:
+        lines (List[str]): Pulse instructions, empty lines being skipped.
+        Missing trailing parameters default to `0`.
+
+    Returns:
+        numpy.ndarray: Pulse instructions, in the order of the lines.
+
+    Raises:
+        ValueError: Malformed instruction.
+    """
+    fields = [line.split() for line in lines if len(line) > 0]
+    if any(len(line_fields) != FIELDS for line_fields in fields):
+        # Lines with missing parameters are padded one by one
+        for i, line_fields in enumerate(fields):
+            if not 3 <= len(line_fields) <= FIELDS:
+                raise ValueError(f"Malformed pulse instruction: {' '.join(line_fields)}")
+            fields[i] = line_fields + ['0'] * (FIELDS - len(line_fields))
+    tokens = list(itertools.chain.from_iterable(fields))
+    res = np.empty(len(fields), dtype=INSTRUCTION_DTYPE)
+    try:
+        # Integer fields are parsed as such, such that e.g. '1.5' is rejected
+        # rather than truncated
+        for column, name in enumerate(('delay', 'channel', 'index')):
+            res[name] = np.array(tokens[column::FIELDS], dtype=np.int64)
+        for column in range(3, FIELDS):
+            res['params'][:, column - 3] = np.array(tokens[column::FIELDS], dtype=float)
+    except (ValueError, OverflowError) as err:
+        raise ValueError(f"Malformed pulse instruction: {err}") from err
+    return res
+
+
+def pair_edges(is_up, targets):
+    """Match the rising and falling edges of square pulses, each qubit being
+    raised until its next falling edge. A rising edge which is never
+    followed by a falling edge is ignored.
+
+    Args:
+        is_up (numpy.ndarray): Whether each edge is rising, in the order of the
+        instructions.
+        targets (numpy.ndarray): Target qubit of each edge.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray: Positions of the rising and of the
+        matching falling edges, in the order of the falling edges.
+
+    Raises:
+        IndexError: Rising edge on a raised qubit, or falling edge on a qubit
+        which is not raised.
+    """
+    if len(targets) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    # Edges grouped by qubit, each group in the order of the instructions
+    order = np.lexsort((np.arange(len(targets)), targets))
+    grouped = targets[order]
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(grouped)]))
+    rank = np.arange(len(grouped)) - group_start
+    bad = is_up[order] != (rank % 2 == 0)
+    if bad.any():
+        first = order[bad].min()
+        if is_up[first]:
+            raise IndexError("Raising edge applied on already raised qubit")
+        raise IndexError("Square pulse falling edge before raising edge")
+    falling = np.flatnonzero(rank % 2 == 1)
+    rising = order[falling - 1]
+    falling = order[falling]
+    sort = np.argsort(falling)
+    return rising[sort], falling[sort]
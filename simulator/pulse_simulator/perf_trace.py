@@ -0,0 +1,154 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Per-stage timings of the simulator pipeline.
+
+Each timed stage is recorded as a complete event of the Chrome trace-event
+format: `{"name", "cat", "ph": "X", "ts", "dur", "pid", "tid", "args"}`, where
+`ts` is the wall-clock start time and `dur` the duration, both in
+microseconds. Since `ts` is taken from the system clock, events written by
+different processes (`sim.py`, the simulator and the shell command of each
+trigger) line up in a single trace file.
+
+Events are appended to the trace file, one per line:
+    * in the 'jsonl' format, each line is one event;
+    * in the 'chrome' format, the file starts with `[` and each line is one
+    event followed by a comma. The closing `]` is optional in the JSON array
+    format of the trace-event specification, such that the file can be loaded
+    as is by `chrome://tracing` or Perfetto.
+
+The events of a trigger are written once it completes, with a single
+`write()` to a file opened in append mode, such that concurrent writers do not
+interleave their lines.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+TRACE_FORMATS = ('jsonl', 'chrome')
+
+
+def now_us():
+    """Wall-clock time in microseconds, as used for 'ts'."""
+    return time.time_ns() // 1000
+
+
+def process_start_us():
+    """Wall-clock start time of the current process in microseconds, with the
+    resolution of the clock ticks of the kernel, or 'None' if unknown (i.e.
+    outside Linux).
+    """
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # The command name may contain spaces, but is enclosed in brackets
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/stat', 'r') as f:
+            boot_time = next(int(line.split()[1]) for line in f
+                             if line.startswith('btime'))
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None
+    # 'starttime' is the 22nd field, the 20th after the command name
+    ticks = int(fields[19])
+    return boot_time * 10 ** 6 + ticks * 10 ** 6 // os.sysconf('SC_CLK_TCK')
+
+
+def start_trace(path, trace_format='jsonl'):
+    """Create an empty trace file, replacing any previous one.
+
+    Args:
+        path (str): Trace file.
+        trace_format (str): 'jsonl' or 'chrome'.
+
+    Raises:
+        ValueError: Unsupported format.
+    """
+    if trace_format not in TRACE_FORMATS:
+        raise ValueError(f"Unsupported trace format: {trace_format}")
+    with open(path, 'w') as f:
+        f.write('[\n' if trace_format == 'chrome' else '')
+
+
+def format_event(event, trace_format='jsonl'):
+    """Format an event as a line of the trace file."""
+    line = json.dumps(event, separators=(',', ':'))
+    return line + (',\n' if trace_format == 'chrome' else '\n')
+
+
+class PerfTrace():
+    """Recorder of timed stages, written to a trace file.
+
+    Args:
+        path (str, optional): Trace file, created by 'start_trace()' if it does
+        not exist. Events are discarded if not given, such that an untraced
+        run only pays for reading the clock.
+        trace_format (str): 'jsonl' or 'chrome'.
+        category (str): Category of the events.
+
+    Raises:
+        ValueError: Unsupported format.
+    """
+
+    def __init__(self, path=None, trace_format='jsonl', category='simulator'):
+        if trace_format not in TRACE_FORMATS:
+            raise ValueError(f"Unsupported trace format: {trace_format}")
+        self.path = path
+        self.trace_format = trace_format
+        self.category = category
+        self.events = []
+        if path is not None and not os.path.exists(path):
+            start_trace(path, trace_format)
+
+    @property
+    def enabled(self):
+        """Whether events are written."""
+        return self.path is not None
+
+    def record(self, name, ts, dur, **args):
+        """Record a stage.
+
+        Args:
+            name (str): Name of the stage.
+            ts (int): Wall-clock start time in microseconds, see 'now_us()'.
+            dur (int): Duration in microseconds.
+            args: Additional fields of the event.
+        """
+        if self.path is None:
+            return
+        self.events.append({'name': name, 'cat': self.category, 'ph': 'X',
+                            'ts': ts, 'dur': dur, 'pid': os.getpid(),
+                            'tid': threading.get_ident(), 'args': args})
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """Context recording the enclosed code as a stage. Fields can be added
+        to 'args' of the event from within the context."""
+        ts = now_us()
+        start = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            self.record(name, ts, (time.perf_counter_ns() - start) // 1000, **args)
+
+    def flush(self):
+        """Append the recorded events to the trace file."""
+        if not self.events:
+            return
+        with open(self.path, 'a') as f:
+            f.write(''.join(format_event(event, self.trace_format)
+                            for event in self.events))
+        self.events = []
@@ -0,0 +1,211 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Content-addressed caches of compiled pulse programs and simulation results.
+
+Calibration loops re-issue identical pulse sequences across triggers. When the
+pulse simulator is kept alive across triggers (see `pulse_server.py`), parsed
+instructions and compiled backend artifacts are looked up in a `ProgramCache`
+by a digest of the instruction stream and of the device configuration it
+depends on, such that repeated triggers skip compilation.
+
+Final-state probabilities, which only depend on the program, are memoized in a
+`StateStore`, which can also be persisted on disk such that re-runs of the
+same programs only need to resample.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from subsystems import ProductDistribution
+
+
+def digest(*chunks):
+    """Digest of a sequence of strings or bytes-like objects, used as a cache
+    key."""
+    h = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        h.update(chunk.encode() if isinstance(chunk, str) else chunk)
+        h.update(b'\0')
+    return h.digest()
+
+
+def config_digest(config):
+    """Digest of a JSON-serializable configuration entry."""
+    return digest(json.dumps(config, sort_keys=True))
+
+
+class ProgramCache():
+    """LRU cache of compiled pulse programs.
+
+    Each entry is a dictionary of compilation artifacts, which the backends
+    fill in upon their first use of the entry.
+
+    Args:
+        maxsize (int): Maximum number of entries. A size of 0 disables caching.
+
+    Attributes:
+        hits (int): Number of lookups finding an entry.
+        misses (int): Number of lookups not finding an entry.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """Look up the entry of the given key, creating an empty one if absent.
+
+        Args:
+            key (bytes): Digest of the program.
+
+        Returns:
+            dict, bool: The entry, and whether it was found in the cache.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry, True
+        self.misses += 1
+        entry = {}
+        if self.maxsize > 0:
+            self.entries[key] = entry
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return entry, False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return (f"ProgramCache(size={len(self)}/{self.maxsize}, "
+                f"hits={self.hits}, misses={self.misses})")
+
+
+class StateStore():
+    """Bounded store of final-state probability distributions.
+
+    Distributions are given as arrays over the whole register, or as
+    'ProductDistribution's. Entries are kept in memory with LRU eviction, and
+    optionally persisted as '.npz' files in a directory shared across runs,
+    where the least recently written files are removed beyond the size bound.
+
+    Args:
+        maxsize (int): Maximum number of entries, in memory and on disk. A size
+        of 0 disables the store.
+        directory (str, optional): Directory for persisted entries. Entries are
+        only kept in memory if not given.
+
+    Attributes:
+        hits (int): Number of lookups finding an entry.
+        misses (int): Number of lookups not finding an entry.
+    """
+
+    def __init__(self, maxsize, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.hex() + '.npz')
+
+    def get(self, key):
+        """Look up the entry of the given key.
+
+        Args:
+            key (bytes): Digest of the program.
+
+        Returns:
+            Optional[Tuple[Union[numpy.ndarray, ProductDistribution],
+            numpy.ndarray]]: Probability distribution and measured qubits, or
+            'None' if absent.
+        """
+        entry = self.entries.get(key)
+        if entry is None and self.directory is not None and self.maxsize > 0:
+            try:
+                with np.load(self._path(key)) as data:
+                    prob = data['prob']
+                    if 'factor_sizes' in data:
+                        prob = ProductDistribution.from_arrays(
+                            prob, data['factor_qubits'], data['factor_sizes'])
+                    entry = prob, data['measure_qubits']
+                self._remember(key, entry)
+            except (OSError, KeyError, ValueError):
+                # Missing, or being written by another process
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, prob, measure_qubits):
+        """Store an entry.
+
+        Args:
+            key (bytes): Digest of the program.
+            prob (Union[numpy.ndarray, ProductDistribution]): Probability
+            distribution of the final state.
+            measure_qubits (List[int]): Measured qubits.
+        """
+        if self.maxsize <= 0:
+            return
+        if not isinstance(prob, ProductDistribution):
+            prob = np.asarray(prob)
+        entry = prob, np.asarray(measure_qubits, dtype=int)
+        self._remember(key, entry)
+        if self.directory is None:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            if isinstance(prob, ProductDistribution):
+                prob, factor_qubits, factor_sizes = prob.to_arrays()
+                np.savez(f, prob=prob, factor_qubits=factor_qubits,
+                         factor_sizes=factor_sizes, measure_qubits=entry[1])
+            else:
+                np.savez(f, prob=prob, measure_qubits=entry[1])
+        os.replace(tmp_path, path)
+        files = [os.path.join(self.directory, name)
+                 for name in os.listdir(self.directory) if name.endswith('.npz')]
+        if len(files) > self.maxsize:
+            files.sort(key=os.path.getmtime)
+            for old_path in files[:len(files) - self.maxsize]:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __repr__(self):
+        return (f"StateStore(size={len(self.entries)}/{self.maxsize}, "
+                f"hits={self.hits}, misses={self.misses})")
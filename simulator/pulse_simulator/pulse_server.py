@@ -0,0 +1,327 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Persistent server mode of the pulse simulator backend.
+
+Instead of starting one Python process per trigger, `sim.py` starts this
+server once per run. The server keeps the imported backends and the loaded
+device configuration alive, and handles each trigger as a request.
+
+Requests and responses are exchanged over two named pipes (FIFOs), so that
+the client side is a plain shell command which can be issued by the QEMU
+plugin through `system()` without starting a Python interpreter:
+    * The client writes one line `<input_file>\t<output_file>` to the request
+    FIFO, with absolute paths to the '.qsim' input and the output file,
+    separated by a tab such that they may contain spaces. Paths separated by
+    spaces are still accepted if they contain none.
+    * The server simulates the input, writes the output file, and writes one
+    line containing the exit code (`0` on success, `1` on failure) to the
+    response FIFO.
+
+Both FIFOs are to be created (see `sim.py`) before the server and the
+client are started, such that a client never writes to a regular file by
+accident. The device configuration is reloaded whenever the config file
+changes, e.g. upon a runtime envelope transmission.
+
+With `--shm NAME`, the server additionally creates the shared-memory rings
+described in `shm_ring.py`. A client then writes the pulse instructions of a
+trigger into the request ring and sends the line `shm` as its request; the
+server answers with the measurement results in the response ring, and the exit
+code in the response FIFO as above.
+
+Requests written to the request FIFO before it is closed form a batch. With
+`--workers N`, the requests of a batch are simulated in parallel by `N` worker
+processes and answered in order, one response FIFO write each. The server
+process then only dispatches requests, and does not load a simulator of its
+own. Workers are only useful for clients which issue several triggers before
+reading any result; `sim.py` does not start them, since the YQE plugin waits
+for the result of each trigger. With backend
+parameter `seed`, each trigger is sampled with its own random generator
+derived from the seed and the trigger index, such that results do not depend
+on the number of workers.
+
+With `--ready-fd FD`, the server writes the line `ready` to the inherited file
+descriptor `FD` and closes it once it serves requests, such that the process
+starting it can tell a server which failed to start from a busy one.
+
+Typical usage example (in command line):
+    > python pulse_server.py [--shm NAME] [--workers N] [--ready-fd FD] config_file request_fifo response_fifo [backend] [backend_params ...]
+"""
+
+import argparse
+import os
+import signal
+import sys
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from pulse_simulator import PulseSimulator, parse_backend_params
+from shm_ring import Ring, ring_paths, decode_request, encode_response
+
+# Simulator of the current process, either the server itself or one of its
+# workers, see 'init_simulator()'
+_simulator = None
+
+
+def init_simulator(config_file, backend, backend_params):
+    """Create the simulator of the current process.
+
+    Args:
+        config_file (str): A '.json' file containing the descriptions of the
+        quantum device.
+        backend (str): Backend software used in simulation.
+        backend_params (List[str]): Additional backend parameters, as passed to
+        'PulseSimulator'.
+    """
+    global _simulator  # pylint: disable=global-statement
+    _simulator = PulseSimulator(config_file, None, None, backend, *backend_params)
+
+
+def handle_request(request, trigger=None):
+    """Simulate a single trigger.
+
+    Args:
+        request (str): Request line `<input_file>\t<output_file>`, or
+        `<input_file> <output_file>` for paths without spaces.
+        trigger (int, optional): Trigger index, see 'PulseSimulator.simulate()'.
+
+    Returns:
+        int: Exit code of the simulation, `0` on success and `1` on failure.
+    """
+    try:
+        input_file, output_file = request.split('\t') if '\t' in request else request.split()
+        _simulator.reload_config_if_changed()
+        _simulator.load_input(input_file, output_file)
+        _simulator.execute(trigger)
+    except Exception:  # pylint: disable=broad-except
+        # A failing trigger is reported to the client but does not bring down
+        # the server.
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stderr.flush()
+    return 0
+
+
+def simulate_instructions(shots, instructions, trigger=None):
+    """Simulate a single trigger given as pulse instructions.
+
+    Args:
+        shots (int): Number of repetitions.
+        instructions (numpy.ndarray): Pulse instructions, as a structured array
+        of 'shm_ring.INSTRUCTION_DTYPE'.
+        trigger (int, optional): Trigger index, see 'PulseSimulator.simulate()'.
+
+    Returns:
+        Optional[Tuple[numpy.ndarray, Optional[numpy.ndarray]]]: Measured bits
+        and IQ data as returned by 'PulseSimulator.simulate()', or 'None' on
+        failure.
+    """
+    try:
+        _simulator.reload_config_if_changed()
+        _simulator.load_instructions(shots, instructions)
+        return _simulator.simulate(trigger)
+    except Exception:  # pylint: disable=broad-except
+        traceback.print_exc()
+        return None
+    finally:
+        sys.stderr.flush()
+
+
+def read_shm_request(request_ring):
+    """Take the oldest trigger out of the request ring.
+
+    Returns:
+        int, Optional[Tuple[int, numpy.ndarray]]: Trigger index, and the
+        number of repetitions and a copy of the pulse instructions, or 'None'
+        if the request is missing or malformed.
+    """
+    payload = request_ring.peek()
+    if payload is None:
+        print("No request in the shared-memory ring", file=sys.stderr)
+        return 0, None
+    trigger = 0
+    try:
+        trigger, shots, instructions = decode_request(payload)
+        return trigger, (shots, instructions.copy())
+    except Exception:  # pylint: disable=broad-except
+        traceback.print_exc()
+        return trigger, None
+    finally:
+        # The request is copied out of the ring, such that its slot can be
+        # reused by the client while the simulation runs
+        request_ring.release()
+
+
+def write_shm_response(response_ring, trigger, result, iq_dtype='float64'):
+    """Answer a trigger in the response ring.
+
+    Args:
+        response_ring (shm_ring.Ring): Ring of measurement results.
+        trigger (int): Trigger index.
+        result (Optional[tuple]): Result of 'simulate_instructions()'.
+        iq_dtype (str, optional): Data type of the IQ data, see backend
+        parameter 'iq_dtype'.
+
+    Returns:
+        int: Exit code of the simulation, `0` on success and `1` on failure.
+    """
+    if result is not None:
+        try:
+            response = encode_response(trigger, 0, *result, iq_dtype)
+            if response_ring.put(response):
+                return 0
+            print("Shared-memory response ring is full", file=sys.stderr)
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc()
+    response_ring.put(encode_response(trigger, 1))
+    return 1
+
+
+def _completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _worker_ready():
+    """Whether the simulator of the current worker is loaded."""
+    return _simulator is not None
+
+
+def _terminate(signum, frame):  # pylint: disable=unused-argument
+    # Unwind 'serve()' on SIGTERM, such that the worker pool is shut down
+    # rather than left behind
+    sys.exit(128 + signum)
+
+
+def _submit(pool, fn, *args):
+    """Run 'fn' in the worker pool, or right away without a pool."""
+    if pool is not None:
+        return pool.submit(fn, *args)
+    return _completed(fn(*args))
+
+
+def serve(config_file, request_fifo, response_fifo, backend='qutip', *backend_params,
+          shm_name=None, shm_slots=4, shm_slot_size=1 << 22, workers=0, ready_fd=None):
+    """Serve simulation requests until the process is terminated.
+
+    All requests written to the request FIFO before it is closed by the
+    client(s) form a batch. With 'workers' > 0, the requests of a batch are
+    simulated in parallel by a pool of worker processes, each with its own
+    'PulseSimulator', and answered in the order they were received. This is
+    only useful for clients which issue several triggers before reading any
+    result, i.e. programs which do not branch on measurement results. The
+    server process itself then only dispatches the requests.
+
+    Triggers are numbered by the trigger index of `shm` requests, or by the
+    number of requests received before otherwise, offset by backend
+    parameter 'first_trigger', such that seeded results do not depend on
+    'workers'.
+
+    Args:
+        config_file (str): A '.json' file containing the descriptions of the
+        quantum device.
+        request_fifo (str): Named pipe where requests are read from.
+        response_fifo (str): Named pipe where exit codes are written to.
+        backend (str, optional): Backend software used in simulation. Defaults
+        to 'qutip'.
+        backend_params (str): Additional backend parameters, as passed to
+        'PulseSimulator'.
+        shm_name (str, optional): If given, create shared-memory rings with
+        this name for `shm` requests.
+        shm_slots (int, optional): Number of slots in each ring.
+        shm_slot_size (int, optional): Size of each slot in bytes.
+        workers (int, optional): Number of worker processes. Requests are
+        simulated by the server process itself if 0.
+        ready_fd (int, optional): File descriptor to write `ready` to once
+        requests are served.
+    """
+    params = parse_backend_params(backend_params)
+    pool = None
+    if workers > 0:
+        pool = ProcessPoolExecutor(workers, initializer=init_simulator,
+                                   initargs=(config_file, backend, backend_params))
+    else:
+        init_simulator(config_file, backend, backend_params)
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        if pool is not None and not pool.submit(_worker_ready).result():
+            raise RuntimeError("Worker failed to start")
+        if shm_name is not None:
+            request_path, response_path = ring_paths(shm_name)
+            request_ring = Ring(request_path, shm_slots, shm_slot_size)
+            response_ring = Ring(response_path, shm_slots, shm_slot_size)
+        num_requests = int(params['first_trigger'])
+        if ready_fd is not None:
+            os.write(ready_fd, b'ready\n')
+            os.close(ready_fd)
+        while True:
+            # Opening a FIFO blocks until the other end is opened, so an idle
+            # server does not consume any CPU time.
+            with open(request_fifo, 'r') as f:
+                requests = [request for request in f.read().split('\n') if len(request) > 0]
+            pending = []
+            for request in requests:
+                if request == 'shm' and shm_name is not None:
+                    trigger, instructions = read_shm_request(request_ring)
+                    if instructions is None:
+                        pending.append((trigger, _completed(None)))
+                    else:
+                        pending.append((trigger, _submit(pool, simulate_instructions,
+                                                         *instructions, trigger)))
+                else:
+                    pending.append((None, _submit(pool, handle_request, request,
+                                                  num_requests)))
+                num_requests += 1
+            for trigger, future in pending:
+                if trigger is None:
+                    exit_code = future.result()
+                else:
+                    exit_code = write_shm_response(response_ring, trigger, future.result(),
+                                                   params['iq_dtype'])
+                sys.stderr.flush()
+                with open(response_fifo, 'w') as f:
+                    f.write(f"{exit_code}\n")
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Serve pulse simulation requests over named pipes.')
+    parser.add_argument('config_file', help='pulse configuration file')
+    parser.add_argument('request_fifo', help='named pipe for incoming requests')
+    parser.add_argument('response_fifo', help='named pipe for outgoing exit codes')
+    parser.add_argument('backend', nargs='?', default='qutip',
+                        help='backend used in simulation')
+    parser.add_argument('backend_params', nargs='*',
+                        help='additional backend parameters')
+    parser.add_argument('--shm', dest='shm_name', default=None,
+                        help='name of the shared-memory rings under /dev/shm')
+    parser.add_argument('--shm-slots', type=int, default=4,
+                        help='number of slots in each shared-memory ring')
+    parser.add_argument('--shm-slot-size', type=int, default=1 << 22,
+                        help='size of each shared-memory ring slot in bytes')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of worker processes for batched requests')
+    parser.add_argument('--ready-fd', type=int, default=None,
+                        help='file descriptor to write "ready" to once requests are served')
+    args = parser.parse_args()
+    serve(args.config_file, args.request_fifo, args.response_fifo,
+          args.backend, *args.backend_params, shm_name=args.shm_name,
+          shm_slots=args.shm_slots, shm_slot_size=args.shm_slot_size,
+          workers=args.workers, ready_fd=args.ready_fd)
@@ -21,34 +21,185 @@ YAQCS toolchain as a mock backend supporting validation and verification
 of pulse-level instructions generated from upper levels.
 
 Typical usage example (in command line):
-    > python -m pulse_simulator.py config_file input_file output_file [backend]
+    > python -m pulse_simulator.py config_file input_file output_file [backend] [key=value ...]
 """
 
+import contextlib
+import functools
+import os
+import resource
 import sys
+import time
 import warnings
 import json
 
+from perf_trace import PerfTrace, now_us, process_start_us
+
+# Start of the imports below, traced as the 'imports' stage
+_IMPORTS_TS = now_us()
+
 import numpy as np
 
-with warnings.catch_warnings():
-    warnings.filterwarnings('ignore',
-                            message='matplotlib not found',
-                            module='qutip')
-    from qutip import ket2dm, Options, basis
-    from qutip.operators import sigmay, sigmax, sigmaz, Qobj
-    from qutip.tensor import tensor
-    from qutip_qip.device import Processor
-    from qutip_qip.pulse import Pulse
-    from qutip_qip.qubits import qubit_states
-    from qutip_qip.circuit import QubitCircuit
-import stim
-
-_ISWAP_HAM = (tensor(sigmax(), sigmax()) + tensor(sigmay(), sigmay())) / 2
-_CPHASE_HAM = Qobj(np.diag([0, 0, 0, 1]))
-_CPHASE_HAM.dims = [[2, 2], [2, 2]]
+
+from program_cache import ProgramCache, StateStore, config_digest, digest
+from density_matrix import DensityMatrix
+from gate_fusion import fuse_gates
+from instruction_table import pair_edges, parse_lines
+from result_format import PackedBits, write_results
+from statevector import StateVector
+from subsystems import ProductDistribution, qubit_components
+from waveform_overlay import overlay_path, read_records
+from waveform_store import WaveformLibrary, channel_waveform, library_path
+
+_IMPORTS_DUR = now_us() - _IMPORTS_TS
+# Backend imports since the last traced trigger, as '(ts, dur, modules)'
+_backend_imports = []
+
 _DEFAULT_AMP = np.pi / 200
 _DEFAULT_RANGE = 0x4000
+# Kinds of pulse instructions, by type of their waveform
+_INSTR_KINDS = {'xy_waveform': 0, 'xy_square_up': 1, 'xy_square_down': 2,
+                'z_square_up': 3, 'z_square_down': 4, 'reset': 5, 'measure': 6,
+                '2q_waveform': 7}
+# Kinds emitting a PulseInstruction at their own line
+_INSTR_PLAYED = [_INSTR_KINDS[kind] for kind in ('xy_waveform', 'reset', 'measure',
+                                                 '2q_waveform')]
 _DEFAULT_LEN = 100
+# Version of the simulation results kept in a 'StateStore'. To be increased
+# whenever a change of the simulation alters its results, such that results
+# persisted by an older version are not reused.
+_STATE_STORE_VERSION = '2'
+# Backend parameters, given as 'key=value' in 'quantum_backend_params'
+_DEFAULT_BACKEND_PARAMS = {
+    'output_format': 'text',
+    'iq_dtype': 'float64',
+    'program_cache_size': '64',
+    'state_cache_size': '64',
+    'state_cache_dir': '',
+    'qutip_qip_engine': 'circuit',
+    'gate_fusion': '0',
+    'subsystem_decomposition': '0',
+    # Error model of the 'stim' backend, all disabled by default
+    'stim_depolarize1': '0',
+    'stim_depolarize2': '0',
+    'stim_readout_error': '0',
+    'stim_idle_noise': '0',
+    # 'measurements' or 'detectors', the latter requiring a QEC description
+    'stim_output': 'measurements',
+    'qutip_solver': 'full',
+    # Seed of the run, sampling is not reproducible if empty
+    'seed': '',
+    # Index of the first trigger simulated, for seeding
+    'first_trigger': '0',
+    # Per-stage timings, see 'perf_trace.py', not recorded if empty
+    'trace_file': '',
+    'trace_format': 'jsonl',
+}
+
+
+def parse_backend_params(backend_params):
+    """
+    Parse backend parameters given as 'key=value' strings, and fill in the
+    default values for parameters not given.
+
+    Args:
+        backend_params (List[str]): List of 'key=value' strings.
+
+    Returns:
+        dict: Backend parameters, with keys from '_DEFAULT_BACKEND_PARAMS'.
+
+    Raises:
+        ValueError: Malformed or unknown backend parameter.
+    """
+    res = dict(_DEFAULT_BACKEND_PARAMS)
+    for param in backend_params:
+        key, sep, value = param.partition('=')
+        if not sep or key not in _DEFAULT_BACKEND_PARAMS:
+            raise ValueError(f"Unknown backend parameter: {param}")
+        res[key] = value
+    return res
+
+
+def trigger_rng(seed, trigger):
+    """
+    Random generator of a trigger, which only depends on the seed of the run
+    and on the trigger index, such that results do not depend on the process
+    simulating the trigger, nor on the triggers simulated before.
+
+    Args:
+        seed (int): Seed of the run.
+        trigger (int): Trigger index.
+
+    Returns:
+        numpy.random.Generator: Random generator for sampling the trigger.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(trigger,)))
+
+
+@contextlib.contextmanager
+def _backend_import():
+    """
+    Context for importing backend modules. Backends are only imported once
+    dispatched to, since importing qutip and qutip_qip dominates the start-up
+    time of the simulator, and is not needed by e.g. the 'stim' backend.
+    Imports which load new modules are kept in '_backend_imports' for tracing.
+    """
+    ts = now_us()
+    start = time.perf_counter_ns()
+    num_modules = len(sys.modules)
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore',
+                                message='matplotlib not found',
+                                module='qutip')
+        yield
+    if len(sys.modules) > num_modules:
+        _backend_imports.append((ts, (time.perf_counter_ns() - start) // 1000,
+                                 len(sys.modules) - num_modules))
+
+
+@functools.lru_cache(maxsize=None)
+def _two_qubit_hamiltonian(index):
+    """
+    Hamiltonian of the 2Q channel waveform with the given index: CPHASE for
+    index "0", and iSWAP otherwise.
+    """
+    with _backend_import():
+        from qutip.operators import sigmay, sigmax, Qobj
+        from qutip.tensor import tensor
+    if index == "0":
+        ham = Qobj(np.diag([0, 0, 0, 1]))
+        ham.dims = [[2, 2], [2, 2]]
+        return ham
+    return (tensor(sigmax(), sigmax()) + tensor(sigmay(), sigmay())) / 2
+
+
+def _readonly(array):
+    """Mark an array shared between instructions as read-only."""
+    array.setflags(write=False)
+    return array
+
+
+@functools.lru_cache(maxsize=None)
+def _timesteps(length):
+    """Timesteps of a waveform of 'length' samples, one per nanosecond."""
+    return _readonly(np.linspace(0, length - 1, length))
+
+
+@functools.lru_cache(maxsize=256)
+def _square_pulse(width, z_line):
+    """
+    Timesteps and coefficients of a square pulse of the given width, on the
+    XY line (two quadratures) or on the Z line (one envelope).
+    """
+    tlist = _timesteps(width + 1)
+    if z_line:
+        return tlist, _readonly(np.array([0] + [1] * (width - 1) + [0], dtype=float))
+    coeff_x = _readonly(np.array([0] + [_DEFAULT_AMP * width / (width - 1)] * (width - 1) + [0]))
+    return tlist, (coeff_x, _readonly(np.zeros(width + 1)))
+
+
+_PAULIS = [np.eye(2), 1j * np.diag([1, -1]), 1j *
+           np.eye(2)[::-1], np.diag([-1, 1])[::-1]]
 
 
 def single_qubit_gate(params):
@@ -62,8 +213,23 @@ def single_qubit_gate(params):
     Returns:
         numpy.array: Compiled single qubit gate as a 2x2 unitary matrix.
     """
-    Paulis = [np.eye(2), 1j * np.diag([1, -1]), 1j *
-              np.eye(2)[::-1], np.diag([-1, 1])[::-1]]
+    with _backend_import():
+        from qutip.operators import Qobj
+    return Qobj(single_qubit_matrix(tuple(params)), dims=[[2], [2]])
+
+
+@functools.lru_cache(maxsize=4096)
+def single_qubit_matrix(params):
+    """
+    Generate single qubit gates from pulse parameters as NumPy arrays.
+    Memoized, since calibration programs repeat the same parameters.
+
+    Args:
+        params(Tuple[double]): Tuple of parameters specifying a 1q gate operation.
+
+    Returns:
+        numpy.array: Compiled single qubit gate as a 2x2 unitary matrix.
+    """
     xangle = np.pi / 2 * params[2]
     if params[-1] == 1:
         xangle /= 2
@@ -80,8 +246,8 @@ def single_qubit_gate(params):
         np.sin(freq_angle) * xangle / freq *
         np.sin(params[0] + _DEFAULT_LEN * params[1]),
     ]
-    res = Qobj(np.sum([coeffs[i] * Paulis[i]
-               for i in range(4)], axis=0), dims=[[2], [2]])
+    res = np.sum([coeffs[i] * _PAULIS[i] for i in range(4)], axis=0)
+    res.flags.writeable = False
     return res
 
 
@@ -93,6 +259,23 @@ def two_qubit_gate(params):
     Args:
         params(List[double]): List of parameters specifying a 2q gate operation.
 
+    Returns:
+        numpy.array: Compiled two qubit gate as a 4x4 unitary matrix.
+    """
+    with _backend_import():
+        from qutip.operators import Qobj
+    return Qobj(two_qubit_matrix(tuple(params)), dims=[[2, 2], [2, 2]])
+
+
+@functools.lru_cache(maxsize=4096)
+def two_qubit_matrix(params):
+    """
+    Generate two qubit gates from pulse parameters as NumPy arrays. Memoized,
+    since calibration programs repeat the same parameters.
+
+    Args:
+        params(Tuple[double]): Tuple of parameters specifying a 2q gate operation.
+
     Returns:
         numpy.array: Compiled two qubit gate as a 4x4 unitary matrix.
     """
@@ -101,7 +284,45 @@ def two_qubit_gate(params):
     else:
         res = np.array([[1, 0, 0, 0], [0, np.cos(params[1]/2), 1j * np.sin(params[1]  / 2), 0],
                         [0, 1j * np.sin(params[1]  / 2), np.cos(params[1]  / 2), 0], [0, 0, 0, 1]])
-    return Qobj(res, dims=[[2,2],[2,2]])
+    res = res.astype(complex)
+    res.flags.writeable = False
+    return res
+
+
+def unitary_gate(matrix):
+    """
+    Wrap a gate matrix into a 'Qobj'. Used in gate-level simulation with
+    `qutip_qip`, for gates given as matrices.
+
+    Args:
+        matrix(numpy.ndarray): 2x2 or 4x4 unitary matrix.
+
+    Returns:
+        qutip.Qobj: The gate acting on one or two qubits.
+    """
+    with _backend_import():
+        from qutip.operators import Qobj
+    dims = [2] * (len(matrix) // 2)
+    return Qobj(matrix, dims=[dims, dims])
+
+
+def idle_pauli_probabilities(duration, t1, t2):
+    """
+    Pauli-twirled approximation of amplitude damping and dephasing of an idle
+    qubit. Used for the error model of the 'stim' backend.
+
+    Args:
+        duration(double): Idle time.
+        t1(Optional[double]): T1 of the qubit, in the same unit as 'duration'.
+        No amplitude damping if 'None'.
+        t2(Optional[double]): T2 of the qubit. No dephasing if 'None'.
+
+    Returns:
+        Tuple[double]: Probabilities of X, Y and Z errors.
+    """
+    p_damp = 0 if t1 is None else 1 - np.exp(-duration / t1)
+    p_dephase = 0 if t2 is None else 1 - np.exp(-duration / t2)
+    return p_damp / 4, p_damp / 4, max(p_dephase / 2 - p_damp / 4, 0)
 
 
 def z_to_f(z):
@@ -131,18 +352,71 @@ class PulseSimulator():
     Args:
         config_file (str): A '.json' file containing the descriptions of the
         quantum device.
-        input_file (str): A '.qsim' file specifying the instructions to be
-        executed on the simulator.
-        output_file (str): Output file name for the simulation result.
+        input_file (str, optional): A '.qsim' file specifying the instructions to be
+        executed on the simulator. Can be omitted and later given through
+        'load_input()', e.g. when the simulator is kept alive across triggers.
+        output_file (str, optional): Output file name for the simulation result.
         backend (str, optional): Backend software used in simulation. Currently
         supports 'qutip', 'stim' and 'qutip_qip', planning to add 'acqdp'. Specifying
         'backend' to other values will not immediately but will raise a
         'ValueError' when '.execute()' is called. Defaults to 'qutip'.
+        backend_params (str): Additional 'key=value' parameters, see
+        '_DEFAULT_BACKEND_PARAMS'. 'output_format' selects the 'text' (default)
+        or 'binary' result format described in 'result_format.py', and
+        'iq_dtype' the data type of IQ data in the 'binary' format.
+        'program_cache_size' bounds the number of compiled programs kept in
+        'self.program_cache' across triggers. 'state_cache_size' bounds the
+        number of final states memoized in 'self.state_store', which are also
+        persisted in 'state_cache_dir' if given. If 'seed' is given, each
+        trigger is sampled with 'trigger_rng()', where triggers are numbered
+        from 'first_trigger' unless their index is given to 'simulate()'. If
+        'trace_file' is given, the timings of the stages of each trigger are
+        appended to it in 'trace_format', see 'perf_trace.py'.
     """
 
-    def __init__(self, config_file, input_file, output_file, backend='qutip'):
-        with open(config_file, 'r') as f:
+    # Whether the start-up of the process has been traced
+    _startup_traced = False
+
+    def __init__(self, config_file, input_file=None, output_file=None, backend='qutip',
+                 *backend_params):
+        self.config_file = config_file
+        self.backend = backend
+        self.backend_params = parse_backend_params(backend_params)
+        self.rng = np.random.default_rng()
+        self.seed = int(self.backend_params['seed']) if self.backend_params['seed'] else None
+        self.next_trigger = int(self.backend_params['first_trigger'])
+        self.trace = PerfTrace(self.backend_params['trace_file'] or None,
+                               self.backend_params['trace_format'])
+        if self.trace.enabled and not PulseSimulator._startup_traced:
+            PulseSimulator._startup_traced = True
+            process_ts = process_start_us()
+            if process_ts is not None:
+                self.trace.record('startup', process_ts, _IMPORTS_TS - process_ts)
+            self.trace.record('imports', _IMPORTS_TS, _IMPORTS_DUR)
+        # Number of gates removed by gate fusion, over all compiled programs
+        self.eliminated_gates = 0
+        self.program_cache = ProgramCache(
+            int(self.backend_params['program_cache_size']))
+        self.state_store = StateStore(
+            int(self.backend_params['state_cache_size']),
+            self.backend_params['state_cache_dir'] or None)
+        self.load_config()
+        if input_file is not None:
+            self.load_input(input_file, output_file)
+
+    def load_config(self):
+        """(Re)load the device description from 'self.config_file'."""
+        with self.trace.span('config_load'):
+            self._load_config()
+
+    def _load_config(self):
+        with open(self.config_file, 'r') as f:
             self.pulse_config = json.load(f)
+        self._config_stat = self._stat_config()
+        # Envelopes of a compact configuration are mapped from its waveform
+        # library, see 'waveform_store.py'
+        path = library_path(self.config_file, self.pulse_config)
+        self.waveform_library = WaveformLibrary(path) if path is not None else None
         self.num_qubits = len(self.pulse_config['qubits'])
 
         def get_noise(dic, key):
@@ -159,15 +433,125 @@ class PulseSimulator():
             get_noise(self.pulse_config['qubits'][i], 't2')
             for i in self.pulse_config['qubits']
         ]
-        self.center_list = [self.pulse_config['qubits'][i]
-                            ['readout_center'] for i in self.pulse_config['qubits']]
+        self._noise_digest = config_digest([self.t1_list, self.t2_list]).hex()
+        # Detectors and observables of QEC topologies, see 'config_gen.py'
+        self.qec_description = self.pulse_config.get('qec')
+        self._qec_digest = config_digest(self.qec_description).hex()
+        self._channel_digests = {}
+        # Readout centers indexed by (qubit, measurement outcome, I/Q)
+        self.readout_centers = np.array([
+            [self.pulse_config['qubits'][i]['readout_center'][outcome]
+             for outcome in ('0', '1')]
+            for i in self.pulse_config['qubits']
+        ], dtype=float).reshape(self.num_qubits, 2, 2)
+        # Envelopes transmitted at run time, see 'waveform_overlay.py'
+        self.overlay_file = overlay_path(self.config_file)
+        self._overlay_offset = 0
+        self.waveform_overlay = {}
+        self._overlay_digests = {}
+        self._waveform_table = {}
+        self._load_overlay()
+
+    def _load_overlay(self):
+        """Apply the records appended to the envelope overlay since it was
+        last read. Records on channels which do not exist or are not '1Q'
+        channels are ignored."""
+        records, self._overlay_offset = read_records(self.overlay_file, self._overlay_offset)
+        for channel, index, inst_type, code, data in records:
+            if self.pulse_config["channels"].get(channel, {}).get("type") != '1Q':
+                warnings.warn(f"Envelope on channel {channel} ignored, only existing 1Q "
+                              "channels support envelope transmission")
+                continue
+            envelope = np.frombuffer(data, dtype='<i2' if code == b'h' else '<i4')
+            if inst_type == 'xy_waveform':
+                envelope = [envelope[:len(envelope) // 2], envelope[len(envelope) // 2:]]
+            self.waveform_overlay[(channel, index)] = [inst_type, envelope]
+            self._overlay_digests.setdefault(channel, {})[index] = digest(
+                inst_type, data.hex()).hex()
+            self._channel_digests.pop(channel, None)
+            self._waveform_table.pop((channel, index), None)
+
+    def reload_config_if_changed(self):
+        """Reload the device description if the config file has been modified,
+        and read the envelopes transmitted at run time since the last call.
+
+        Returns:
+            bool: Whether the config or the envelopes have changed.
+        """
+        if self._stat_config() == self._config_stat:
+            try:
+                overlay_size = os.stat(self.overlay_file).st_size
+            except FileNotFoundError:
+                overlay_size = 0
+            if overlay_size == self._overlay_offset:
+                return False
+            if overlay_size > self._overlay_offset:
+                with self.trace.span('overlay_load'):
+                    self._load_overlay()
+                return True
+        # A regenerated config comes with a new overlay
+        self.load_config()
+        return True
+
+    def _stat_config(self):
+        stat = os.stat(self.config_file)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load_input(self, input_file, output_file):
+        """Load the '.qsim' instructions for the next call of 'execute()'.
+
+        Args:
+            input_file (str): A '.qsim' file specifying the instructions to be
+            executed on the simulator.
+            output_file (str): Output file name for the simulation result.
+        """
         self.input_file = input_file
         self.output_file = output_file
-        self.backend = backend
         with open(self.input_file, 'r') as f:
             self.instr_list = f.read().split("\n")
+        self.instr_table = None
         self.num_cycles = int(self.instr_list[0])
 
+    def _program_key(self):
+        """Cache key of the loaded instructions, depending on the instruction
+        stream, the configuration of the channels it uses, the noise model and
+        the QEC description.
+        """
+        if self.instr_table is not None:
+            channels = sorted(str(channel) for channel in
+                              np.unique(self.instr_table['channel']).tolist())
+            program = [self.instr_table.tobytes()]
+        else:
+            program = [line for line in self.instr_list[1:] if len(line) > 0]
+            channels = sorted({line.split(" ", 2)[1] for line in program})
+        for channel in channels:
+            if channel not in self._channel_digests:
+                channel_config = self.pulse_config["channels"][channel]
+                waveform_set = self.pulse_config.get("waveform_sets", {}).get(
+                    channel_config.get("waveform_set"))
+                self._channel_digests[channel] = config_digest(
+                    [channel_config, waveform_set,
+                     self.waveform_library and self.waveform_library.digest,
+                     self._overlay_digests.get(channel)]).hex()
+        return digest(self.backend, self._noise_digest, self._qec_digest,
+                      *[self._channel_digests[channel] for channel in channels],
+                      *program)
+
+    def load_instructions(self, num_cycles, instructions):
+        """Load pulse instructions given in memory for the next call of
+        'simulate()'.
+
+        Args:
+            num_cycles (int): Number of repetitions.
+            instructions (numpy.ndarray): Pulse instructions, as a structured
+            array of 'shm_ring.INSTRUCTION_DTYPE'.
+        """
+        self.input_file = None
+        self.output_file = None
+        self.instr_list = None
+        self.instr_table = instructions
+        self.num_cycles = num_cycles
+
     class PulseInstruction():
         """Class indicating pulse informations for one operation.
 
@@ -180,18 +564,23 @@ class PulseSimulator():
             targets (List[int]) : target qubits where the operation is acted upon.
             index (int) : waveform index of the operation. Index 128 is reserved
             for measurement.
-            tlist (Optional[List[double], None]]): Lists of timesteps of the
-            pulse coefficients. Only present when 'index' != 128.
-            coefs (Optional[List[List[double]], List[double], None]): Waveform
-            envelopes. For 1q gates the waveform contains two quadrants; for 2q
-            gates the waveform contains one envelope. For measurements the
-            waveform is 'None'.
-            params (Optional[List[double], None]): Other parameters in the
-            instruction. For 1q gates 'params' contains a relative phase
-            parameter, an intermediate frequency, and an amplitude multiplier.
-            delay (Optional[double, None]): Time delay of the operation.
+            tlist (Optional[numpy.ndarray]): Timesteps of the pulse
+            coefficients. Only present when 'index' != 128.
+            coefs (Optional[Tuple[numpy.ndarray, numpy.ndarray], numpy.ndarray]):
+            Waveform envelopes. For 1q gates the waveform contains two
+            quadrants; for 2q gates the waveform contains one envelope. For
+            measurements the waveform is 'None'. Both arrays are read-only, as
+            they are shared by all instructions playing the same waveform.
+            params (Optional[Tuple[float, float, float, float]]): The four
+            configurable parameters of the instruction: a relative phase, an
+            intermediate frequency, an amplitude multiplier, and a fourth
+            parameter holding the width of square pulses.
+            delay (Optional[int]): Time delay of the operation.
         """
 
+        # Large programs create one instruction per line of every trigger
+        __slots__ = ('pulse_type', 'targets', 'index', 'tlist', 'coefs', 'params', 'delay')
+
         def __init__(self,
                      pulse_type,
                      targets,
@@ -208,154 +597,292 @@ class PulseSimulator():
             self.params = params
             self.delay = delay
 
-    def execute(self):
-        """Execution entrance for simulation.
+    def execute(self, trigger=None):
+        """Execution entrance for simulation. Simulates the loaded instructions
+        and writes the results to 'self.output_file'.
+
+        Args:
+            trigger (int, optional): Trigger index, see 'simulate()'.
 
         Raises:
             ValueError: Unsupported backend, when 'self.backend' is not in
             '['qutip', 'stim', 'qutip_qip', 'qutip-qip' 'acqdp']'.
             'qutip-qip' and 'qutip_qip' can be used interchangeably.
         """
-        # Parse `.qsim` files to PulseInstructions
-        self._parse_instr(self.instr_list)
-
-        # Execute PulseInstructions with given backend
-        if self.backend == "qutip":
-            res = self._execute_qutip()
-        elif self.backend == "stim":
-            res = self._execute_stim()
-        elif self.backend == "acqdp":
-            res = self._execute_acqdp()
-        elif self.backend == "qutip_qip" or self.backend == "qutip-qip":
-            res = self._execute_qutip_qip()
-        else:
-            raise ValueError(f"Unsupported backend: {self.backend}")
-        with open(self.output_file, 'w') as f:
-            f.write("\n".join([" ".join(i) for i in res[0]]) + "\n")
-            f.write("\n".join(
-                ["\n".join([str(j[0]) + " " + str(j[1]) for j in i]) for i in res[1]]) + "\n")
+        res = self.simulate(trigger)
+        # Write to a temporary file and move it into place, such that a reader
+        # waiting for the output file never observes a partially written one
+        with self.trace.span('write', format=self.backend_params['output_format']):
+            tmp_file = self.output_file + ".tmp"
+            write_results(tmp_file, res[0], res[1],
+                          self.backend_params['output_format'],
+                          self.backend_params['iq_dtype'])
+            os.replace(tmp_file, self.output_file)
+        self.trace.flush()
+
+    def simulate(self, trigger=None):
+        """Simulate the loaded instructions.
+
+        Args:
+            trigger (int, optional): Trigger index, used for seeding. Defaults
+            to the index following the one of the last simulated trigger.
+
+        Returns:
+            numpy.ndarray or PackedBits, Optional[numpy.ndarray]: Measured bits
+            of shape '(self.num_cycles, number of measurements)', and IQ data of
+            shape '(self.num_cycles, number of measurements, 2)', or 'None' if
+            the backend does not generate IQ data.
+
+        Raises:
+            ValueError: Unsupported backend.
+        """
+        if trigger is None:
+            trigger = self.next_trigger
+        self.next_trigger = trigger + 1
+        if self.seed is not None:
+            self.rng = trigger_rng(self.seed, trigger)
+
+        cpu_start = time.process_time_ns()
+        with self.trace.span('trigger', trigger=trigger, backend=self.backend,
+                             shots=self.num_cycles) as trace_args:
+            # Parse `.qsim` files to PulseInstructions, unless the same program
+            # has been compiled before
+            self.program_key = self._program_key()
+            self.compiled, trace_args['program_cache_hit'] = self.program_cache.lookup(
+                self.program_key)
+            if 'pulse_instrs' not in self.compiled:
+                with self.trace.span('parse'):
+                    self.compiled['pulse_instrs'] = self._parse_instr(
+                        self.instr_list if self.instr_table is None else self.instr_table)
+            self.pulse_instrs = self.compiled['pulse_instrs']
+
+            # Execute PulseInstructions with given backend
+            if self.backend == "qutip":
+                res = self._execute_qutip()
+            elif self.backend == "stim":
+                res = self._execute_stim()
+            elif self.backend == "acqdp":
+                res = self._execute_acqdp()
+            elif self.backend == "qutip_qip" or self.backend == "qutip-qip":
+                res = self._execute_qutip_qip()
+            else:
+                raise ValueError(f"Unsupported backend: {self.backend}")
+            if self.trace.enabled:
+                trace_args['cpu_us'] = (time.process_time_ns() - cpu_start) // 1000
+                trace_args['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for ts, dur, num_modules in _backend_imports:
+            self.trace.record('backend_import', ts, dur, modules=num_modules)
+        _backend_imports.clear()
+        self.trace.flush()
+        return res
 
     def _parse_instr(self, instr_list):
         """Parse a list of '.qsim' instruction into a list of 'PulseInstruction'.
 
+        The instructions are parsed in bulk into the columns of
+        'instruction_table.py'; waveforms are looked up once per distinct
+        channel and index, and the edges of square pulses are paired with array
+        operations.
+
         Args:
-            instr_list (List[str]): A list of '.qsim' instructions
+            instr_list (List[str] or numpy.ndarray): A list of '.qsim'
+            instructions, or pulse instructions already in the columns of
+            'instruction_table.py', as loaded by 'load_instructions()'.
 
         Returns:
             List['PulseInstruction'] : Compiled 'PulseInstruction' obejcts for further
             incorporation into backends.
         """
+        if isinstance(instr_list, np.ndarray):
+            instrs = instr_list
+        else:
+            instrs = parse_lines(instr_list[1:])
+        # Distinct (channel, index) slots played by the instructions
+        keys = (instrs['channel'].astype(np.int64) << 32) | instrs['index'].astype(np.int64)
+        slots, slot_of = np.unique(keys, return_inverse=True)
+        slot_channels = [str(key >> 32) for key in slots.tolist()]
+        slot_indices = [str(key & 0xffffffff) for key in slots.tolist()]
+        configs = [self.pulse_config["channels"][channel] for channel in slot_channels]
+        waveforms = [self._waveform_arrays(channel, index)
+                     for channel, index in zip(slot_channels, slot_indices)]
+        kinds = np.array([_INSTR_KINDS.get(waveform[0], -1) for waveform in waveforms],
+                         dtype=int)[slot_of]
+
+        # Each PulseInstruction is emitted at the line of its instruction, or
+        # at the falling edge of a square pulse, from its rising edge
+        lines = [np.flatnonzero(np.isin(kinds, _INSTR_PLAYED))]
+        sources = [lines[0]]
+        slot_targets = np.array([config["target"] if config["type"] == '1Q' else -1
+                                 for config in configs], dtype=np.int64)
+        for up, down in ((_INSTR_KINDS['xy_square_up'], _INSTR_KINDS['xy_square_down']),
+                         (_INSTR_KINDS['z_square_up'], _INSTR_KINDS['z_square_down'])):
+            edges = np.flatnonzero((kinds == up) | (kinds == down))
+            rising, falling = pair_edges(kinds[edges] == up, slot_targets[slot_of[edges]])
+            lines.append(edges[falling])
+            sources.append(edges[rising])
+        lines = np.concatenate(lines)
+        order = np.argsort(lines)
+        sources = np.concatenate(sources)[order]
+        widths = instrs['delay'][lines[order]] - instrs['delay'][sources]
+
         res = []
-        square_dic_xy = {}
-        square_dic_z = {}
-        for instr in instr_list[1:]:
-            if len(instr) == 0:
-                continue
-            params = instr.split(" ")
-            delay = int(params[0])
-            channel = params[1]
-            channel_config = self.pulse_config["channels"][channel]
-            channel_type = channel_config["type"]
-            targets = channel_config["target"]
-            index = params[2]
-            if channel_type == '1Q':
-                inst_type = channel_config['waveforms'][index][0]
-                if inst_type == 'xy_waveform':  # 1 qubit drive line gates specified by pulse
-                    coefs = channel_config['waveforms'][index][1]
-                    coefs_x, coefs_y = coefs
-                    tlist = np.linspace(0, len(coefs_x) - 1, len(coefs_x))
-                    coefs = [list(np.array(coefs_x) * _DEFAULT_AMP / _DEFAULT_RANGE),
-                             list(np.array(coefs_y) * _DEFAULT_AMP / _DEFAULT_RANGE)]
-                    res.append(PulseSimulator.PulseInstruction('gate_1q', targets,
-                                                               index, tlist, coefs,
-                                                               params, delay=delay))
-                elif inst_type == 'xy_square_up':  # 1 qubit drive line square pulse raising edge
-                    if targets in square_dic_xy:
-                        raise IndexError(
-                            "Raising edge applied on already raised qubit")
-                    square_dic_xy[targets] = [index, params, delay]
-                elif inst_type == 'xy_square_down':  # 1 qubit drive line square pulse falling edge
-                    if targets in square_dic_xy:
-                        index_last, params, delay_last = square_dic_xy.pop(
-                            targets)
-                        params[6] = delay - delay_last
-                        tlist = np.linspace(
-                            0, delay - delay_last, delay - delay_last + 1)
-                        coeff_x = [
-                            0] + [_DEFAULT_AMP * (len(tlist) - 1) / (len(tlist) - 2)] * (len(tlist) - 2) + [0]
-                        coeff_y = [0] * len(tlist)
-                        res.append(PulseSimulator.PulseInstruction('gate_1q', targets,
-                                                                   index_last, tlist, [
-                                                                       coeff_x, coeff_y],
-                                                                   params, delay=delay_last))
-                    else:
-                        raise IndexError(
-                            "Square pulse falling edge before raising edge")
-                elif inst_type == 'z_square_up':  # 1 qubit drive line square pulse raising edge
-                    if targets in square_dic_z:
-                        raise IndexError(
-                            "Raising edge applied on already raised qubit")
-                    # 1 qubit drive line square pulse falling edge
-                    square_dic_z[targets] = [index, params, delay]
-                elif inst_type == 'z_square_down':
-                    if targets in square_dic_z:
-                        index_last, params, delay_last = square_dic_z.pop(
-                            targets)
-                        params[6] = delay - delay_last
-                        tlist = np.linspace(
-                            0, delay - delay_last, delay - delay_last + 1)
-                        coeff = [
-                            0] + [1] * (len(tlist) - 2) + [0]
-                        res.append(PulseSimulator.PulseInstruction('gate_1q_z', targets,
-                                                                   index_last, tlist, coeff,
-                                                                   params, delay=delay_last))
-                    else:
-                        raise IndexError(
-                            "Square pulse falling edge before raising edge")
-                elif inst_type == 'reset':  # special index reserved for state preparation
-                    res.append(PulseSimulator.PulseInstruction('reset', targets,
-                                                               index))
-                elif inst_type == 'measure':  # special index reserved for measurements
-                    res.append(PulseSimulator.PulseInstruction('measure',
-                                                               targets,
-                                                               index,
-                                                               delay=delay))
-            elif channel_type == '2Q':  # 2 qubit gates
-                coefs = channel_config['waveforms'][index][0]
-                tlist = np.linspace(0, len(coefs) - 1, len(coefs))
-                res.append(PulseSimulator.PulseInstruction('gate_2q', targets, index,
-                                                           tlist, coefs, params, delay=delay))
+        delays = instrs['delay'].tolist()
+        params = instrs['params'].tolist()
+        slot_of = slot_of.tolist()
+        kinds = kinds.tolist()
+        for line, width in zip(sources.tolist(), widths.tolist()):
+            slot = slot_of[line]
+            kind = kinds[line]
+            targets = configs[slot]["target"]
+            index = slot_indices[slot]
+            delay = delays[line]
+            instr_params = tuple(params[line])
+            if kind == _INSTR_KINDS['xy_waveform']:
+                _, tlist, coefs = waveforms[slot]
+                res.append(PulseSimulator.PulseInstruction('gate_1q', targets, index, tlist,
+                                                           coefs, instr_params, delay=delay))
+            elif kind in (_INSTR_KINDS['xy_square_up'], _INSTR_KINDS['z_square_up']):
+                z_line = kind == _INSTR_KINDS['z_square_up']
+                instr_params = instr_params[:3] + (width,)
+                tlist, coefs = _square_pulse(width, z_line)
+                res.append(PulseSimulator.PulseInstruction('gate_1q_z' if z_line else 'gate_1q',
+                                                           targets, index, tlist, coefs,
+                                                           instr_params, delay=delay))
+            elif kind == _INSTR_KINDS['reset']:  # special index reserved for state preparation
+                res.append(PulseSimulator.PulseInstruction('reset', targets, index))
+            elif kind == _INSTR_KINDS['measure']:  # special index reserved for measurements
+                res.append(PulseSimulator.PulseInstruction('measure', targets, index,
+                                                           delay=delay))
+            elif kind == _INSTR_KINDS['2q_waveform']:  # 2 qubit gates
+                _, tlist, coefs = waveforms[slot]
+                res.append(PulseSimulator.PulseInstruction('gate_2q', targets, index, tlist,
+                                                           coefs, instr_params, delay=delay))
 
         self.pulse_instrs = res
         return res
 
+    def _waveform_arrays(self, channel, index):
+        """Ready-to-use arrays of a waveform index on a channel, computed on
+        first use and kept in 'self._waveform_table' until the config is
+        reloaded or the envelope is transmitted again.
+
+        Returns:
+            Tuple: Waveform type, followed by the timesteps and the rescaled
+            quadratures for 'xy_waveform', and by the timesteps and the
+            coefficients for 2Q channels (with type '2q_waveform').
+        """
+        key = (channel, index)
+        if key not in self._waveform_table:
+            waveform = self._waveform(channel, index)
+            if self.pulse_config["channels"][channel]["type"] == '2Q':
+                coefs = _readonly(np.array(waveform[0], dtype=float))
+                entry = ('2q_waveform', _timesteps(len(coefs)), coefs)
+            elif waveform[0] == 'xy_waveform':
+                coefs = tuple(_readonly(np.asarray(quadrature) * _DEFAULT_AMP / _DEFAULT_RANGE)
+                              for quadrature in waveform[1])
+                entry = ('xy_waveform', _timesteps(len(coefs[0])), coefs)
+            else:
+                entry = (waveform[0],)
+            self._waveform_table[key] = entry
+        return self._waveform_table[key]
+
+    def _waveform(self, channel, index):
+        """Waveform entry of an index on a channel, with its envelopes read from
+        the envelope overlay or the waveform library if any."""
+        if (channel, index) in self.waveform_overlay:
+            return self.waveform_overlay[(channel, index)]
+        entry = channel_waveform(self.pulse_config, self.pulse_config["channels"][channel], index)
+        if self.waveform_library is None:
+            return entry
+        return self.waveform_library.resolve(entry)
+
+    def _qubit_components(self, pulse_instrs):
+        """Groups of qubits which can be simulated independently, i.e. the
+        connected components of the graph of 2Q pulses, with backend parameter
+        'subsystem_decomposition=1'. Otherwise, the whole register forms a
+        single group.
+
+        Args:
+            pulse_instrs (List[PulseSimulator.PulseInstruction]): List of PulseInstructions
+            parsed from input `.qsim` file.
+
+        Returns:
+            List[List[int]]: Sorted qubits of each group.
+        """
+        if not int(self.backend_params['subsystem_decomposition']):
+            return [list(range(self.num_qubits))]
+        return qubit_components(self.num_qubits,
+                                [pulse_instr.targets for pulse_instr in pulse_instrs
+                                 if pulse_instr.pulse_type == 'gate_2q'])
+
     def _execute_qutip(self):
         """Pulse-level simulation using 'qutip' backend.
 
+        By default, the master equation of the whole register is solved over
+        the whole program. With backend parameter 'qutip_solver=sliced', the
+        pulse timeline is split into segments by '_qutip_schedule()' instead,
+        such that the solver only runs while pulses are played, and only on the
+        qubits they act on, and groups of qubits which are never coupled can be
+        simulated separately, see '_qubit_components()'.
+
         Returns:
-            List[str]: Result bitstrings. The number of bitstrings is
+            numpy.ndarray: Result bitstrings. The number of bitstrings is
             determined by 'self.num_cycles', and the number of bits in each
             bitstring is determined by the number of qubits being measured.
+
+        Raises:
+            ValueError: Unsupported 'qutip_solver'.
         """
-        # Compile instructions into pulses
-        processor = Processor(num_qubits=self.num_qubits,
-                              t1=self.t1_list,
-                              t2=self.t2_list)
-        tlist, measure_qubits = self._process_pulses(
-            processor, self.pulse_instrs)
-
-        # Pulse simulation
-        state = ket2dm(qubit_states(self.num_qubits))
-        solver_result = processor.run_state(init_state=state,
-                                            tlist=np.linspace(
-                                                0, max(tlist),
-                                                int(max(tlist)) + 1),
-                                            options=Options(max_step=1))
+        # The final state only depends on the program and the noise model,
+        # which are both covered by the program key
+        solver = self.backend_params['qutip_solver']
+        if solver not in ('sliced', 'full'):
+            raise ValueError(f"Unsupported qutip solver: {solver}")
+        state_key = digest('qutip', _STATE_STORE_VERSION, solver, self.program_key.hex())
+        stored = self.state_store.get(state_key)
+        if stored is not None:
+            res_prob, measure_qubits = stored
+        elif solver == 'sliced':
+            if 'qutip_schedule' not in self.compiled:
+                with self.trace.span('compile'):
+                    self.compiled['qutip_schedule'] = self._qutip_schedule(self.pulse_instrs)
+            schedules, measure_qubits = self.compiled['qutip_schedule']
+            with self.trace.span('solve', groups=len(schedules)):
+                res_prob = ProductDistribution([
+                    (qubits, self._run_qutip_schedule(schedule, qubits))
+                    for qubits, schedule in schedules])
+            self.state_store.put(state_key, res_prob, measure_qubits)
+        else:
+            with _backend_import():
+                from qutip import ket2dm, Options
+                from qutip_qip.device import Processor
+                from qutip_qip.qubits import qubit_states
+            # Compile instructions into pulses
+            if 'processor' not in self.compiled:
+                with self.trace.span('compile'):
+                    processor = Processor(num_qubits=self.num_qubits,
+                                          t1=self.t1_list,
+                                          t2=self.t2_list)
+                    tlist, measure_qubits = self._process_pulses(
+                        processor, self.pulse_instrs)
+                    self.compiled['processor'] = processor, tlist, measure_qubits
+            processor, tlist, measure_qubits = self.compiled['processor']
+
+            # Pulse simulation
+            with self.trace.span('solve'):
+                state = ket2dm(qubit_states(self.num_qubits))
+                solver_result = processor.run_state(init_state=state,
+                                                    tlist=np.linspace(
+                                                        0, max(tlist),
+                                                        int(max(tlist)) + 1),
+                                                    options=Options(max_step=1))
+                res_prob = np.diag(np.real(solver_result.states[-1].full()))
+            self.state_store.put(state_key, res_prob, measure_qubits)
 
         # Sample bistrings from the final probability distribution
-        res_prob = np.diag(np.real(solver_result.states[-1].full()))
-        res_bitstrings = self._sample_bitstrings(res_prob, measure_qubits)
-        res_iq = self._sample_readout_iq(res_bitstrings, measure_qubits)
+        with self.trace.span('sample'):
+            res_bitstrings = self._sample_bitstrings(res_prob, measure_qubits)
+            res_iq = self._sample_readout_iq(res_bitstrings, measure_qubits)
         return res_bitstrings, res_iq
 
     def _process_pulses(self, processor, pulse_instrs):
@@ -371,34 +898,49 @@ class PulseSimulator():
             List[double], List[int]: List of timesteps for qutip ODE solver, and
             list of measured qubits for sampling.
         """
+        with _backend_import():
+            from qutip_qip.pulse import Pulse
+        pulses, full_tlist, measure_qubits = self._qutip_pulses(pulse_instrs)
+        for ham, targets, tlist, coeff in pulses:
+            processor.add_pulse(Pulse(ham, targets, tlist, coeff))
+        return full_tlist, measure_qubits
+
+    def _qutip_pulses(self, pulse_instrs):
+        """Translate PulseInstructions into the control pulses of qutip.
+
+        Args:
+            pulse_instrs (List[PulseSimulator.PulseInstruction]): List of PulseInstructions
+            parsed from input `.qsim` file.
+
+        Returns:
+            List[Tuple[qutip.Qobj, Union[int, List[int]], numpy.ndarray, numpy.ndarray]],
+            List[double], List[int]: List of pulses as '(hamiltonian, targets,
+            tlist, coeff)', list of timesteps for qutip ODE solver, and list of
+            measured qubits for sampling.
+        """
+        with _backend_import():
+            from qutip.operators import sigmay, sigmax, sigmaz
+        pulses = []
         full_tlist = []
         measure_qubits = []
         for pulse_instr in pulse_instrs:
             if pulse_instr.pulse_type == 'gate_1q':  # 1Q drive line gates
-                theta = float(pulse_instr.params[3])
-                freq = float(pulse_instr.params[4])
-                amp = float(pulse_instr.params[5])
-                tlist = np.array(pulse_instr.tlist) + pulse_instr.delay
+                theta, freq, amp, _ = pulse_instr.params
+                tlist = np.asarray(pulse_instr.tlist) + pulse_instr.delay
                 coeff_x, coeff_y = pulse_instr.coefs
                 waveform_comp = amp * np.exp(1j * (theta + freq * tlist)) \
-                                    * (np.array(coeff_x) + 1j * np.array(coeff_y))
+                                    * (np.asarray(coeff_x) + 1j * np.asarray(coeff_y))
                 waveform_x = np.real(waveform_comp)
                 waveform_y = np.imag(waveform_comp)
-                pulsex = Pulse(sigmax(), pulse_instr.targets, tlist,
-                               waveform_x)
-                pulsey = Pulse(sigmay(), pulse_instr.targets, tlist,
-                               waveform_y)
-                processor.add_pulse(pulsex)
-                processor.add_pulse(pulsey)
+                pulses.append((sigmax(), pulse_instr.targets, tlist, waveform_x))
+                pulses.append((sigmay(), pulse_instr.targets, tlist, waveform_y))
                 full_tlist += list(tlist)
             elif pulse_instr.pulse_type == 'gate_1q_z':  # 1Q Z line gates
-                amp = float(pulse_instr.params[5])
-                tlist = np.array(pulse_instr.tlist) + pulse_instr.delay
+                amp = pulse_instr.params[2]
+                tlist = np.asarray(pulse_instr.tlist) + pulse_instr.delay
                 coeff = pulse_instr.coefs
-                waveform = np.array(coeff) * z_to_f(amp)
-                pulse = Pulse(sigmaz(), pulse_instr.targets, tlist,
-                              waveform)
-                processor.add_pulse(pulse)
+                waveform = np.asarray(coeff) * z_to_f(amp)
+                pulses.append((sigmaz(), pulse_instr.targets, tlist, waveform))
                 full_tlist += list(tlist)
             elif pulse_instr.pulse_type == 'measure':  # 1Q measurement
                 full_tlist += [pulse_instr.delay]
@@ -406,63 +948,281 @@ class PulseSimulator():
             elif pulse_instr.pulse_type == 'reset':
                 pass
             elif pulse_instr.pulse_type == 'gate_2q':  # 2Q gates
-                ham = _CPHASE_HAM if pulse_instr.index == "0" else _ISWAP_HAM
-                tlist = np.array(pulse_instr.tlist) + pulse_instr.delay
-                pulse = Pulse(ham, pulse_instr.targets, list(tlist),
-                              np.array(pulse_instr.coefs))
-                processor.add_pulse(pulse)
+                ham = _two_qubit_hamiltonian(pulse_instr.index)
+                tlist = np.asarray(pulse_instr.tlist) + pulse_instr.delay
+                pulses.append((ham, pulse_instr.targets, list(tlist),
+                               np.array(pulse_instr.coefs)))
                 full_tlist += list(tlist)
-        return full_tlist, measure_qubits
+        return pulses, full_tlist, measure_qubits
+
+    def _qutip_schedule(self, pulse_instrs):
+        """Split the simulation into independent subsystems and time segments.
+
+        Each group of qubits returned by '_qubit_components()' is scheduled
+        separately by '_qutip_component_schedule()', up to the end of the
+        whole program.
+
+        Args:
+            pulse_instrs (List[PulseSimulator.PulseInstruction]): List of PulseInstructions
+            parsed from input `.qsim` file.
+
+        Returns:
+            List[Tuple[List[int], List[tuple]]], List[int]: Qubits of each
+            group with the steps of its simulation, and list of measured qubits
+            for sampling.
+        """
+        pulses, full_tlist, measure_qubits = self._qutip_pulses(pulse_instrs)
+        end = max(full_tlist) if full_tlist else 0
+        schedules = []
+        for qubits in self._qubit_components(pulse_instrs):
+            local = {qubit: i for i, qubit in enumerate(qubits)}
+            component_pulses = []
+            for ham, targets, tlist, coeff in pulses:
+                if np.ndim(targets) == 0:
+                    if targets in local:
+                        component_pulses.append((ham, local[targets], tlist, coeff))
+                elif targets[0] in local:
+                    component_pulses.append((ham, [local[q] for q in targets],
+                                             tlist, coeff))
+            schedules.append((qubits, self._qutip_component_schedule(
+                component_pulses, qubits, end)))
+        return schedules, measure_qubits
+
+    def _qutip_component_schedule(self, pulses, qubits, end):
+        """Split the pulse timeline of a group of qubits into segments for
+        time-sliced simulation.
+
+        Overlapping pulses are merged into segments, between which all qubits
+        are idle, such that their decay is applied in closed form. Within a
+        segment, qubits coupled by 2Q pulses form subsystems. If it is cheaper
+        than solving the master equation of the whole group, the map of each
+        subsystem over the segment is computed once as a superoperator, while
+        the other qubits decay in closed form.
+
+        Args:
+            pulses (List[tuple]): Pulses acting on the group, as returned by
+            '_qutip_pulses()', with targets given as indices into 'qubits'.
+            qubits (List[int]): Qubits of the group.
+            end (double): End time of the simulation.
+
+        Returns:
+            List[tuple]: Steps of the simulation, as '('relax', duration,
+            qubits)', '('superop', matrix, qubits)' or '('evolve', hamiltonian,
+            c_ops, tlist)', where qubits are given as indices into 'qubits'.
+        """
+        with _backend_import():
+            from qutip import Options, mesolve, qeye, sprepost
+            from qutip_qip.device import Processor
+            from qutip_qip.pulse import Pulse
+        num_qubits = len(qubits)
+        t1_list = [self.t1_list[q] for q in qubits]
+        t2_list = [self.t2_list[q] for q in qubits]
+        all_qubits = list(range(num_qubits))
+
+        # Merge overlapping pulses into segments of [start, end, pulses]
+        segments = []
+        for pulse in sorted(pulses, key=lambda pulse: pulse[2][0]):
+            start, stop = pulse[2][0], pulse[2][-1]
+            if segments and start <= segments[-1][1]:
+                segments[-1][1] = max(segments[-1][1], stop)
+                segments[-1][2].append(pulse)
+            else:
+                segments.append([start, stop, [pulse]])
+
+        steps = []
+        time = 0
+        for start, stop, segment_pulses in segments:
+            if start > time:
+                steps.append(('relax', start - time, all_qubits))
+            time = stop
+            tlist = np.linspace(start, stop, max(int(stop - start), 1) + 1)
+
+            # Group the qubits acted upon into subsystems
+            subsystems = []
+            for _, targets, _, _ in segment_pulses:
+                subsystem = set(np.atleast_1d(targets).tolist())
+                for other in [s for s in subsystems if s & subsystem]:
+                    subsystems.remove(other)
+                    subsystem |= other
+                subsystems.append(subsystem)
+            if sum(16 ** len(s) for s in subsystems) >= 4 ** num_qubits:
+                processor = Processor(num_qubits=num_qubits,
+                                      t1=t1_list, t2=t2_list)
+                for ham, targets, pulse_tlist, coeff in segment_pulses:
+                    processor.add_pulse(Pulse(ham, targets, pulse_tlist, coeff))
+                hamiltonian, c_ops = processor.get_qobjevo(noisy=True)
+                steps.append(('evolve', hamiltonian, c_ops, tlist))
+                continue
+
+            for subsystem in subsystems:
+                members = sorted(subsystem)
+                processor = Processor(num_qubits=len(members),
+                                      t1=[t1_list[q] for q in members],
+                                      t2=[t2_list[q] for q in members])
+                for ham, targets, pulse_tlist, coeff in segment_pulses:
+                    targets = np.atleast_1d(targets).tolist()
+                    if targets[0] in subsystem:
+                        processor.add_pulse(Pulse(ham, [members.index(q) for q in targets],
+                                                  pulse_tlist, coeff))
+                hamiltonian, c_ops = processor.get_qobjevo(noisy=True)
+                identity = qeye([2] * len(members))
+                superop = mesolve(hamiltonian, sprepost(identity, identity), tlist,
+                                  c_ops, options=Options(max_step=1)).states[-1]
+                steps.append(('superop', superop.full(), members))
+            idle = [q for q in all_qubits if not any(q in s for s in subsystems)]
+            steps.append(('relax', stop - start, idle))
+        if end > time:
+            steps.append(('relax', end - time, all_qubits))
+        return steps
+
+    def _run_qutip_schedule(self, schedule, qubits):
+        """Simulate the steps returned by '_qutip_component_schedule()'.
+
+        Args:
+            schedule (List[tuple]): Steps of the simulation.
+            qubits (List[int]): Qubits of the simulated group.
+
+        Returns:
+            numpy.ndarray: Probability distribution of the final state of the
+            group.
+        """
+        state = DensityMatrix(len(qubits))
+        for step in schedule:
+            if step[0] == 'relax':
+                _, duration, targets = step
+                for target in targets:
+                    qubit = qubits[target]
+                    state.relax(target, duration, self.t1_list[qubit], self.t2_list[qubit])
+            elif step[0] == 'superop':
+                _, superop, targets = step
+                state.apply_superoperator(superop, targets)
+            else:
+                with _backend_import():
+                    from qutip import Options, Qobj, mesolve
+                _, hamiltonian, c_ops, tlist = step
+                dims = [[2] * len(qubits)] * 2
+                result = mesolve(hamiltonian, Qobj(state.matrix(), dims=dims), tlist,
+                                 c_ops, options=Options(max_step=1))
+                state.set_matrix(result.states[-1].full())
+        return state.probabilities()
 
     def _execute_qutip_qip(self):
         """Gate-level simulation with the 'qutip_qip' backend.
 
         Each pulse instruction is translated to a unitary gate and simulated
-        using the 'qutip_qip' backend.
+        using the 'qutip_qip' backend. By default the gates are applied by
+        'qutip_qip.circuit.QubitCircuit'; backend parameter
+        'qutip_qip_engine=statevector' selects the NumPy statevector engine in
+        'statevector.py' instead, which yields the same distribution without
+        building operators on the full Hilbert space. With 'gate_fusion=1',
+        runs of gates are first fused by 'gate_fusion.py'. The statevector
+        engine can simulate groups of qubits which are never coupled
+        separately, see '_qubit_components()'.
 
         Currently not supporting noise models.
 
         Returns:
-            List[str]: Result bitstrings. The number of bitstrings is
+            numpy.ndarray: Result bitstrings. The number of bitstrings is
             determined by 'self.num_cycles', and the number of bits in each
             bitstring is determined by the number of qubits being measured.
         """
-        qc = QubitCircuit(N=self.num_qubits)
-        measure_qubits = self._process_gates(qc, self.pulse_instrs)
-        res = np.array(
-            qc.run(state=tensor(*[basis(2, 0)] * self.num_qubits))).flatten()
-        res_bitstrings = self._sample_bitstrings(
-            np.real(res * np.conj(res)), measure_qubits)
-        res_iq = self._sample_readout_iq(res_bitstrings, measure_qubits)
+        # The simulation is noiseless, so that the final state only depends
+        # on the program
+        if 'qutip_qip' not in self.compiled:
+            with self.trace.span('compile') as trace_args:
+                gates, measure_qubits = self._gate_sequence(self.pulse_instrs)
+                trace_args['gates'] = len(gates)
+                if int(self.backend_params['gate_fusion']):
+                    fused = fuse_gates(gates)
+                    self.eliminated_gates += len(gates) - len(fused)
+                    gates = fused
+                    trace_args['fused_gates'] = len(fused)
+            engine = self.backend_params['qutip_qip_engine']
+            with self.trace.span('solve', engine=engine):
+                if engine == 'statevector':
+                    res_prob = ProductDistribution([
+                        (qubits, self._run_statevector(gates, qubits))
+                        for qubits in self._qubit_components(self.pulse_instrs)])
+                elif engine == 'circuit':
+                    with _backend_import():
+                        from qutip import basis
+                        from qutip.tensor import tensor
+                        from qutip_qip.circuit import QubitCircuit
+                    qc = QubitCircuit(N=self.num_qubits)
+                    self._process_gates(qc, gates)
+                    res = np.array(
+                        qc.run(state=tensor(*[basis(2, 0)] * self.num_qubits))).flatten()
+                    res_prob = np.real(res * np.conj(res))
+                else:
+                    raise ValueError(f"Unsupported qutip_qip engine: {engine}")
+            self.compiled['qutip_qip'] = res_prob, measure_qubits
+        res_prob, measure_qubits = self.compiled['qutip_qip']
+        with self.trace.span('sample'):
+            res_bitstrings = self._sample_bitstrings(res_prob, measure_qubits)
+            res_iq = self._sample_readout_iq(res_bitstrings, measure_qubits)
         return res_bitstrings, res_iq
 
-    def _process_gates(self, qc, pulse_instrs):
-        """Compile PulseInstructions into gate objects in qutip_qip.
+    def _gate_sequence(self, pulse_instrs):
+        """Translate PulseInstructions into gates for gate-level simulation.
 
         Args:
-            qc (qutip_qip.circuit.QubitCircuit): 'QubitCircuit' object
-            incorporating all gates.
             pulse_instrs (List[PulseSimulator.PulseInstruction]): List of PulseInstructions
             parsed from input `.qsim` file.
 
         Returns:
-            List[int]: List of measured qubits for sampling.
+            List[Tuple[Tuple[int], numpy.ndarray]], List[int]: List of gates as
+            '(targets, matrix)', and list of measured qubits for sampling.
         """
+        gates = []
         measure_qubits = []
-        qc.user_gates = {"gate_1q": single_qubit_gate,
-                         "gate_2q": two_qubit_gate}
         for pulse_instr in pulse_instrs:
             if pulse_instr.pulse_type == 'gate_1q':  # 1Q gates
-                params = [float(i) for i in pulse_instr.params[3:]
-                          ] + [int(pulse_instr.index)]
-                qc.add_gate("gate_1q", targets=pulse_instr.targets,
-                            arg_value=params)
+                params = pulse_instr.params + (int(pulse_instr.index),)
+                gates.append(((pulse_instr.targets,), single_qubit_matrix(params)))
             elif pulse_instr.pulse_type == 'measure':  # 1Q measurement
                 measure_qubits.append(pulse_instr.targets)
             elif pulse_instr.pulse_type == 'gate_2q':  # 2Q gates
-                qc.add_gate("gate_2q", targets=pulse_instr.targets, arg_value=(
-                    int(pulse_instr.index), float(pulse_instr.params[5])))
-        return measure_qubits
+                params = int(pulse_instr.index), pulse_instr.params[2]
+                gates.append((tuple(pulse_instr.targets), two_qubit_matrix(params)))
+        return gates, measure_qubits
+
+    def _process_gates(self, qc, gates):
+        """Compile gates into gate objects in qutip_qip.
+
+        Args:
+            qc (qutip_qip.circuit.QubitCircuit): 'QubitCircuit' object
+            incorporating all gates.
+            gates (List[Tuple[Tuple[int], numpy.ndarray]]): List of gates, as
+            returned by '_gate_sequence()'.
+        """
+        qc.user_gates = {"unitary": unitary_gate}
+        for targets, matrix in gates:
+            qc.add_gate("unitary", targets=list(targets), arg_value=matrix)
+
+    def _run_statevector(self, gates, qubits):
+        """Simulate gates on a group of qubits with the statevector engine.
+
+        Args:
+            gates (List[Tuple[Tuple[int], numpy.ndarray]]): List of gates, as
+            returned by '_gate_sequence()'. Gates not acting on 'qubits' are
+            skipped.
+            qubits (List[int]): Qubits of the group, which no gate couples to
+            other qubits.
+
+        Returns:
+            numpy.ndarray: Probability distribution of the final state of the
+            group.
+        """
+        local = {qubit: i for i, qubit in enumerate(qubits)}
+        state = StateVector(len(qubits))
+        for targets, matrix in gates:
+            if targets[0] not in local:
+                continue
+            if len(targets) == 1:
+                state.apply_1q(matrix, local[targets[0]])
+            else:
+                state.apply_2q(matrix, [local[target] for target in targets])
+        return state.probabilities()
 
     def _execute_stim(self):
         """Clifford-level simulation with the 'stim' backend.
@@ -470,27 +1230,118 @@ class PulseSimulator():
         Each pulse instruction is translated to a Clifford gate and simulated
         using the 'stim' backend.
 
+        With backend parameter 'stim_output=detectors', detection events and
+        flips of logical observables (relative to the noiseless circuit) are
+        sampled instead of measurements, as annotated by
+        '_annotate_stim_detectors()' and '_annotate_stim_observables()'.
+
+        If 'seed' is given, the sampler is seeded from the random generator
+        of the trigger.
+
         Currently not supporting IQ readout.
 
         Returns:
-            List[str]: Result bitstrings. The number of bitstrings is
-            determined by 'self.num_cycles', and the number of bits in each
-            bitstring is determined by the number of qubits being measured.
+            PackedBits, None: Result bitstrings, as sampled by 'stim' with 8
+            bits per byte. The number of bitstrings is determined by
+            'self.num_cycles', and the number of bits in each bitstring is
+            determined by the number of qubits being measured, or by the number
+            of detectors and observables. IQ data is 'None', which the result
+            writers treat as all zeros.
+
+        Raises:
+            ValueError: Unsupported 'stim_output', or detectors requested
+            without a QEC description.
         """
-        circuit = stim.Circuit()
-        self._process_stim_cliffords(circuit, self.pulse_instrs)
-        sampler = circuit.compile_sampler()
-        res = sampler.sample(shots=self.num_cycles)
-        return ["".join(str(int(i)) for i in j) for j in res], [[[0., 0.]] * len(j) for j in res]
+        if 'stim_circuit' not in self.compiled:
+            with _backend_import():
+                import stim
+            with self.trace.span('compile'):
+                circuit = stim.Circuit()
+                self._process_stim_cliffords(circuit, self.pulse_instrs)
+                output = self.backend_params['stim_output']
+                if output == 'measurements':
+                    num_bits = circuit.num_measurements
+                elif output == 'detectors':
+                    if self.qec_description is None:
+                        raise ValueError("Detector sampling requires a 'qec' entry "
+                                         "in the pulse configuration")
+                    num_bits = circuit.num_detectors + circuit.num_observables
+                else:
+                    raise ValueError(f"Unsupported stim output: {output}")
+                self.compiled['stim_circuit'] = circuit, num_bits
+        circuit, num_bits = self.compiled['stim_circuit']
+        if self.seed is None:
+            if 'stim_sampler' not in self.compiled:
+                with self.trace.span('compile_sampler'):
+                    self.compiled['stim_sampler'] = self._compile_stim_sampler(circuit)
+            sampler = self.compiled['stim_sampler']
+        else:
+            # Samplers cannot be reseeded, so a seeded trigger compiles its own
+            with self.trace.span('compile_sampler'):
+                sampler = self._compile_stim_sampler(circuit,
+                                                     int(self.rng.integers(2 ** 63)))
+        with self.trace.span('sample'):
+            if self.backend_params['stim_output'] == 'detectors':
+                res = sampler.sample(shots=self.num_cycles, bit_packed=True,
+                                     append_observables=True)
+            else:
+                res = sampler.sample(shots=self.num_cycles, bit_packed=True)
+        return PackedBits(res, num_bits), None
+
+    def _compile_stim_sampler(self, circuit, seed=None):
+        """Compile a measurement or detector sampler, depending on
+        'stim_output'. The reference sample of measurement samplers is computed
+        once per circuit, such that compiling a seeded sampler per trigger stays
+        cheap.
+
+        Args:
+            circuit (stim.Circuit): Circuit to sample.
+            seed (int, optional): Seed of the sampler.
+
+        Returns:
+            Union[stim.CompiledMeasurementSampler, stim.CompiledDetectorSampler]:
+            The sampler.
+        """
+        if self.backend_params['stim_output'] == 'detectors':
+            return circuit.compile_detector_sampler(seed=seed)
+        if 'stim_reference' not in self.compiled:
+            self.compiled['stim_reference'] = circuit.reference_sample()
+        return circuit.compile_sampler(seed=seed,
+                                       reference_sample=self.compiled['stim_reference'])
 
     def _process_stim_cliffords(self, circuit, pulse_instrs):
         """Compile PulseInstructions into Clifford gates in Stim.
 
+        Pauli channels are inserted according to the backend parameters:
+        'stim_depolarize1' and 'stim_depolarize2' after 1Q and 2Q gates,
+        'stim_readout_error' as 'X_ERROR' before measurements, and, if
+        'stim_idle_noise' is set, 'PAULI_CHANNEL_1' for the idle time of each
+        qubit between instructions, derived from its 't1' and 't2'.
+
         Args:
             circuit (stim.Circuit): `Clifford circuit` incorporating all Clifford gates.
             pulse_instrs (List[PulseSimulator.PulseInstruction]): List of PulseInstructions
             parsed from input `.qsim` file.
         """
+        depolarize1 = float(self.backend_params['stim_depolarize1'])
+        depolarize2 = float(self.backend_params['stim_depolarize2'])
+        readout_error = float(self.backend_params['stim_readout_error'])
+        idle_noise = int(self.backend_params['stim_idle_noise'])
+        # End of the last instruction on each qubit
+        busy_until = {}
+        # Indices of the measurement records of each qubit
+        records = {}
+
+        def idle(qubits, start, duration):
+            for qubit in qubits:
+                if idle_noise and busy_until.get(qubit, start) < start:
+                    probs = idle_pauli_probabilities(start - busy_until[qubit],
+                                                     self.t1_list[qubit],
+                                                     self.t2_list[qubit])
+                    if any(probs):
+                        circuit.append_operation("PAULI_CHANNEL_1", [qubit], probs)
+                busy_until[qubit] = max(busy_until.get(qubit, start), start + duration)
+
         for pulse_instr in pulse_instrs:
             if pulse_instr.pulse_type == "gate_1q":
                 op_dic = {
@@ -507,47 +1358,140 @@ class PulseSimulator():
                         3: 'SQRT_Y_DAG',
                     }
                 }
-                theta = np.mod(int(float(pulse_instr.params[3]) / (np.pi/2)), 4)
-                index = "1" if pulse_instr.index == '0' and float(pulse_instr.params[5]) == 0.5 else pulse_instr.index
+                theta = np.mod(int(pulse_instr.params[0] / (np.pi/2)), 4)
+                index = "1" if pulse_instr.index == '0' and pulse_instr.params[2] == 0.5 else pulse_instr.index
                 try:
                     operation = op_dic[index][theta]
-                    circuit.append_operation(operation,
-                                             [int(pulse_instr.targets)])
                 except KeyError as e:
                     raise ValueError(
                         'Non-clifford operation not supported') from e
+                targets = [int(pulse_instr.targets)]
+                idle(targets, pulse_instr.delay, pulse_instr.tlist[-1])
+                circuit.append_operation(operation, targets)
+                if depolarize1:
+                    circuit.append_operation("DEPOLARIZE1", targets, depolarize1)
             elif pulse_instr.pulse_type == 'measure':
-                circuit.append_operation("M", [int(pulse_instr.targets)])
+                targets = [int(pulse_instr.targets)]
+                idle(targets, pulse_instr.delay, 0)
+                if readout_error:
+                    circuit.append_operation("X_ERROR", targets, readout_error)
+                circuit.append_operation("M", targets)
+                if self.qec_description is not None:
+                    records.setdefault(targets[0], []).append(circuit.num_measurements - 1)
+                    self._annotate_stim_detectors(circuit, targets[0], records)
             elif pulse_instr.pulse_type == "gate_2q":
                 operation = "CZ" if pulse_instr.index == "0" else "ISWAP"
+                idle(pulse_instr.targets, pulse_instr.delay, pulse_instr.tlist[-1])
                 circuit.append_operation(operation, pulse_instr.targets)
+                if depolarize2:
+                    circuit.append_operation("DEPOLARIZE2", pulse_instr.targets, depolarize2)
+        if self.qec_description is not None:
+            self._annotate_stim_observables(circuit, records)
+
+    def _annotate_stim_detectors(self, circuit, qubit, records):
+        """Attach the detectors completed by the last measurement of a qubit.
+
+        A detector of the QEC description applies to each measurement of its
+        qubits, and compares it with the measurements of the same qubit which
+        happened 'lookback' measurements before. Measurements without enough
+        predecessors are not annotated.
+
+        Args:
+            circuit (stim.Circuit): Circuit ending with the measurement.
+            qubit (int): Measured qubit.
+            records (Dict[int, List[int]]): Indices of the measurement records
+            of each qubit so far.
+        """
+        import stim
+        history = records[qubit]
+        for detector in self.qec_description['detectors']:
+            lookback = detector['lookback']
+            if qubit not in detector['qubits'] or len(history) <= max(lookback):
+                continue
+            targets = [stim.target_rec(history[-1 - i] - circuit.num_measurements)
+                       for i in lookback]
+            coords = self.qec_description['qubit_coords'][qubit] + [len(history) - 1]
+            circuit.append_operation("DETECTOR", targets, coords)
+
+    def _annotate_stim_observables(self, circuit, records):
+        """Include the last measurement of each qubit in the support of the
+        logical observables of the QEC description, once all of them have been
+        measured.
+
+        Only the logical observables whose type matches the basis of the final
+        data measurements, e.g. the 'Z' logical of a Z-basis memory experiment,
+        are deterministic in the noiseless circuit. The others would come out
+        at random, leaving a decoder without reference, so they are skipped
+        with a warning.
+
+        Args:
+            circuit (stim.Circuit): Circuit after all instructions.
+            records (Dict[int, List[int]]): Indices of the measurement records
+            of each qubit.
+        """
+        import stim
+        # Noiseless circuit without detectors, to check each observable alone
+        noiseless = stim.Circuit()
+        for instruction in circuit.without_noise():
+            if instruction.name != "DETECTOR":
+                noiseless.append(instruction)
+        for index, observable in enumerate(self.qec_description['observables']):
+            if not all(qubit in records for qubit in observable['qubits']):
+                continue
+            targets = [stim.target_rec(records[qubit][-1] - circuit.num_measurements)
+                       for qubit in observable['qubits']]
+            check = noiseless.copy()
+            check.append_operation("OBSERVABLE_INCLUDE", targets, index)
+            try:
+                check.detector_error_model()
+            except ValueError:
+                warnings.warn(f"Logical {observable['type']} observable {index} is not "
+                              "annotated, as it does not match the basis of the final "
+                              "data measurements")
+                continue
+            circuit.append_operation("OBSERVABLE_INCLUDE", targets, index)
 
     def _sample_bitstrings(self, res_prob, measure_qubits):
         """Sample bistrings given underlying probability distribution.
 
+        The distribution is first marginalized onto the measured qubits, such
+        that the cost of sampling does not grow with the number of unmeasured
+        qubits. All shots are then drawn at once as integer indices. For a
+        'ProductDistribution', the shots of each group of qubits are drawn
+        independently.
+
         Args:
-            res_prob (List[double]): Probability distribution
+            res_prob (Union[List[double], ProductDistribution]): Probability
+            distribution
             measure_qubits (List[int]): Qubit list where the measurement is
             taking place. The final measurement result would only be on those
             qubits.
 
         Returns:
-            List[str]: Sampled bistrings on the given qubits.
+            numpy.ndarray: Sampled bits on the given qubits, as a 'uint8' array
+            of shape '(self.num_cycles, len(measure_qubits))'.
         """
-
-        # generate all binary bitstrings of length self.num_qubits
-        bitstring_list = [
-            format(i, '0' + str(self.num_qubits) + 'b')
-            for i in range(2**self.num_qubits)
-        ]
-
-        # sample all bitstrings
-        bitstring_samples = np.random.choice(bitstring_list,
-                                             self.num_cycles,
-                                             p=res_prob)
-        # project onto the actual measured qubits
-        res = [[s[i] for i in measure_qubits] for s in bitstring_samples]
-        return res
+        # Qubits may be measured more than once; sample each qubit only once
+        # and duplicate the columns afterwards
+        measured, columns = np.unique(np.array(measure_qubits, dtype=int),
+                                      return_inverse=True)
+        if not isinstance(res_prob, ProductDistribution):
+            res_prob = ProductDistribution([(range(self.num_qubits), res_prob)])
+
+        # Marginalize onto the measured qubits, where the first qubit of each
+        # group corresponds to the most significant bit of the basis state index
+        bits = np.zeros((self.num_cycles, len(measured)), dtype=np.uint8)
+        for qubits, prob in res_prob.marginals(measured.tolist()):
+            # Sample basis state indices by inverting the cumulative distribution
+            cdf = np.cumsum(np.clip(prob, 0, None))
+            samples = np.searchsorted(cdf, self.rng.random(self.num_cycles) * cdf[-1],
+                                      side='right')
+            samples = np.minimum(samples, len(prob) - 1)
+
+            # Unpack indices into bits on the measured qubits
+            shifts = len(qubits) - 1 - np.arange(len(qubits))
+            bits[:, np.searchsorted(measured, qubits)] = (samples[:, None] >> shifts) & 1
+        return bits[:, columns.ravel()]
 
     def _sample_readout_iq(self, bitstrings, measure_qubits):
         """Sample IQ quadruples given underlying probability distribution.
@@ -556,16 +1500,19 @@ class PulseSimulator():
         from Gaussian distributions indicated by previously sampled binary results.
 
         Args:
-            bitstrings (List[str]): Sampled bitstrings
+            bitstrings (numpy.ndarray): Sampled bits, as returned by
+            '_sample_bitstrings()'.
             measure_qubits (List[int]): Qubit list where the measurement is
             taking place. The final measurement result would only be on those
             qubits.
 
         Returns:
-            List[str]: Sampled IQ quadruples on the given qubits.
+            numpy.ndarray: Sampled IQ quadruples on the given qubits, of shape
+            '(self.num_cycles, len(measure_qubits), 2)'.
         """
-        return [[[np.random.normal(self.center_list[measure_qubits[i]][bitstring[i]][0]), np.random.normal(
-            self.center_list[measure_qubits[i]][bitstring[i]][1])] for i in range(len(measure_qubits))] for bitstring in bitstrings]
+        centers = self.readout_centers[np.array(measure_qubits, dtype=int),
+                                       bitstrings]
+        return self.rng.normal(centers)
 
 
 if __name__ == "__main__":
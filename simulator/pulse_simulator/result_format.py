@@ -0,0 +1,214 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Result file formats of the pulse simulator backend.
+
+Two formats are supported for the output file written after each trigger.
+
+The 'text' format (default) is human readable and convenient for debugging:
+    * `shots` lines, each containing the measured bits of one shot separated
+    by spaces;
+    * `shots * qubits` lines, each containing the I and Q value of one
+    measurement, ordered by shot and then by measured qubit.
+
+The 'binary' format avoids formatting and parsing numbers, and can be read
+with `numpy.frombuffer` or memory mapping. All fields are little-endian:
+    * A 24-byte header:
+        - `magic` (4 bytes): `b'YQSR'`;
+        - `version` (uint16): currently `1`;
+        - `iq_itemsize` (uint8): `8` for float64 and `4` for float32 IQ data,
+        or `0` if the IQ block is omitted, in which case all IQ values are 0;
+        - reserved (uint8);
+        - `shots` (uint64): number of shots;
+        - `qubits` (uint32): number of measurements per shot;
+        - `row_bytes` (uint32): `ceil(qubits / 8)`.
+    * The outcome block, `shots * row_bytes` bytes: the bits of each shot
+    packed into `row_bytes` bytes, with the first measurement of the shot in
+    the least significant bit of the first byte (`numpy.packbits` with
+    `bitorder='little'`, which is also the layout of `stim` bit-packed
+    samples).
+    * The IQ block, `shots * qubits * 2` floats of `iq_itemsize` bytes each,
+    ordered by shot, measured qubit and then I/Q.
+"""
+
+import struct
+
+import numpy as np
+
+MAGIC = b'YQSR'
+VERSION = 1
+HEADER = struct.Struct('<4sHBBQII')
+OUTPUT_FORMATS = ['text', 'binary']
+IQ_DTYPES = {'float64': np.dtype('<f8'), 'float32': np.dtype('<f4')}
+
+
+class PackedBits():
+    """Measured bits packed 8 per byte, as sampled by `stim` with
+    `bit_packed=True`.
+
+    Accepted wherever measured bits are, such that packed samples are written
+    to the 'binary' format without being unpacked.
+
+    Args:
+        packed (numpy.ndarray): Packed bits of shape '(shots, ceil(qubits / 8))',
+        with the first measurement of each shot in the least significant bit
+        of the first byte.
+        qubits (int): Number of measurements per shot.
+    """
+
+    def __init__(self, packed, qubits):
+        self.packed = packed
+        self.qubits = qubits
+
+    @property
+    def shape(self):
+        return len(self.packed), self.qubits
+
+    def unpack(self):
+        """Unpack into a 'uint8' array of shape '(shots, qubits)'."""
+        return np.unpackbits(self.packed, axis=1, count=self.qubits, bitorder='little')
+
+
+def write_results(output_file, bits, iq, output_format='text', iq_dtype='float64'):
+    """Write measurement results to a file.
+
+    Args:
+        output_file (str or file object): Destination of the results.
+        bits (numpy.ndarray or PackedBits): Measured bits of shape
+        '(shots, qubits)'.
+        iq (Optional[numpy.ndarray]): IQ data of shape '(shots, qubits, 2)'.
+        'None' stands for all-zero IQ data.
+        output_format (str, optional): 'text' or 'binary'. Defaults to 'text'.
+        iq_dtype (str, optional): 'float64' or 'float32', data type of the IQ
+        block in the 'binary' format. Defaults to 'float64'.
+
+    Raises:
+        ValueError: Unsupported output format or IQ data type.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if iq_dtype not in IQ_DTYPES:
+        raise ValueError(f"Unsupported IQ data type: {iq_dtype}")
+    if isinstance(output_file, str):
+        with open(output_file, 'wb') as f:
+            write_results(f, bits, iq, output_format, iq_dtype)
+        return
+    if output_format == 'text':
+        _write_text(output_file, bits, iq)
+    else:
+        _write_binary(output_file, bits, iq, iq_dtype)
+
+
+def _write_text(f, bits, iq):
+    if isinstance(bits, PackedBits):
+        bits = bits.unpack()
+    shots, qubits = bits.shape
+    if qubits == 0:
+        # Empty lines for the bits and for the IQ data of each shot
+        f.write(b"\n" * max(shots, 1) + b"\n" * shots)
+        return
+    # Bits are single digits, such that the lines can be laid out in place as
+    # "b b ... b\n"
+    text = np.full((shots, 2 * qubits), ord(' '), dtype=np.uint8)
+    text[:, 0::2] = np.asarray(bits, dtype=np.uint8) + ord('0')
+    text[:, -1] = ord('\n')
+    f.write(text.tobytes() if shots else b"\n")
+    if iq is None:
+        f.write(b"0.0 0.0\n" * (shots * qubits))
+    else:
+        f.write(("\n".join([str(i) + " " + str(q)
+                            for i, q in iq.reshape(-1, 2).tolist()]) + "\n").encode())
+
+
+def _write_binary(f, bits, iq, iq_dtype):
+    for part in encode_binary(bits, iq, iq_dtype):
+        f.write(part)
+
+
+def encode_binary(bits, iq, iq_dtype='float64'):
+    """Encode measurement results in the 'binary' format.
+
+    Args:
+        bits (numpy.ndarray or PackedBits): Measured bits of shape
+        '(shots, qubits)'. Packed bits are used as is.
+        iq (Optional[numpy.ndarray]): IQ data of shape '(shots, qubits, 2)'.
+        'None' stands for all-zero IQ data.
+        iq_dtype (str, optional): 'float64' or 'float32'. Defaults to 'float64'.
+
+    Returns:
+        List[bytes-like]: Parts of the encoded results, to be concatenated.
+    """
+    dtype = IQ_DTYPES[iq_dtype]
+    shots, qubits = bits.shape
+    if isinstance(bits, PackedBits):
+        packed = np.ascontiguousarray(bits.packed, dtype=np.uint8)
+    else:
+        packed = np.ascontiguousarray(np.packbits(bits, axis=1, bitorder='little'))
+    parts = [HEADER.pack(MAGIC, VERSION, 0 if iq is None else dtype.itemsize, 0,
+                         shots, qubits, packed.shape[1]), packed]
+    if iq is not None:
+        parts.append(np.ascontiguousarray(iq, dtype=dtype))
+    return parts
+
+
+def read_results(input_file):
+    """Read measurement results written in the 'binary' format.
+
+    The file is memory mapped, and only unpacked when the returned arrays are
+    accessed.
+
+    Args:
+        input_file (str): Result file in the 'binary' format.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray: Measured bits of shape '(shots, qubits)'
+        and IQ data of shape '(shots, qubits, 2)'.
+
+    Raises:
+        ValueError: The file is not in the 'binary' format.
+    """
+    return decode_binary(np.memmap(input_file, dtype=np.uint8, mode='r'))
+
+
+def decode_binary(buffer):
+    """Decode measurement results in the 'binary' format.
+
+    Args:
+        buffer (bytes-like): Encoded results. The returned IQ data is a view
+        into this buffer.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray: Measured bits of shape '(shots, qubits)'
+        and IQ data of shape '(shots, qubits, 2)'.
+
+    Raises:
+        ValueError: The buffer is not in the 'binary' format.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    magic, version, iq_itemsize, _, shots, qubits, row_bytes = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not in the binary result format")
+    offset = HEADER.size
+    packed = data[offset:offset + shots * row_bytes].reshape(shots, row_bytes)
+    bits = np.unpackbits(packed, axis=1, count=qubits, bitorder='little')
+    offset += shots * row_bytes
+    if iq_itemsize == 0:
+        iq = np.zeros((shots, qubits, 2))
+    else:
+        dtype = np.dtype(f'<f{iq_itemsize}')
+        iq = np.frombuffer(data, dtype=dtype, count=shots * qubits * 2,
+                           offset=offset).reshape(shots, qubits, 2)
+    return bits, iq
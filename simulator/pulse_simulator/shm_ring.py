@@ -0,0 +1,230 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Shared-memory ring buffers between the YQE plugin and the pulse simulator.
+
+Instead of exchanging `pulses.txt`, `output.txt` and `exit_code.txt` through
+the file system, per-trigger data can be exchanged through two memory-mapped
+rings under `/dev/shm`: the plugin writes pulse records into a request ring,
+and the simulator writes measurement results into a response ring. Each ring
+has a single producer and a single consumer. Notification is still done
+through the named pipes of `pulse_server.py`, which then only carry a short
+`shm` line per trigger.
+
+Ring layout (all fields little-endian):
+    * Header, 64 bytes:
+        - `magic` (4 bytes): `b'YQRG'`;
+        - `version` (uint32): currently `1`;
+        - `slot_count` (uint32): number of slots;
+        - `slot_size` (uint32): size of each slot in bytes, including the
+        slot header;
+        - `head` (uint64, offset 16): number of records produced so far, only
+        written by the producer;
+        - `tail` (uint64, offset 24): number of records consumed so far, only
+        written by the consumer;
+        - reserved up to offset 64.
+    * `slot_count` slots of `slot_size` bytes each. Record number `k` is
+    stored in slot `k % slot_count`, starting with its payload length
+    (uint64) followed by the payload.
+
+The producer writes the record into slot `head % slot_count` only if
+`head - tail < slot_count`, and then increments `head`. The consumer reads
+the record in slot `tail % slot_count` only if `tail < head`, and increments
+`tail` once it does not need the record anymore.
+
+Request payload:
+    * `trigger` (uint64): trigger index;
+    * `shots` (uint32): number of repetitions;
+    * `count` (uint32): number of pulse instructions;
+    * `count` pulse instructions of 48 bytes each (see `INSTRUCTION_DTYPE`),
+    with the same fields as the lines of `pulses.txt`: `delay` (int64),
+    `channel` (int32), `index` (int32) and four parameters (float64).
+
+Response payload:
+    * `trigger` (uint64): trigger index of the corresponding request;
+    * `exit_code` (uint32): `0` on success, `1` on failure;
+    * reserved (uint32);
+    * if `exit_code` is `0`, the results in the 'binary' format of
+    `result_format.py`.
+"""
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from result_format import encode_binary, decode_binary
+
+MAGIC = b'YQRG'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+HEADER_SIZE = 64
+HEAD_OFFSET = 16
+TAIL_OFFSET = 24
+COUNTER = struct.Struct('<Q')
+SLOT_HEADER = struct.Struct('<Q')
+REQUEST_HEADER = struct.Struct('<QII')
+RESPONSE_HEADER = struct.Struct('<QII')
+INSTRUCTION_DTYPE = np.dtype([('delay', '<i8'), ('channel', '<i4'),
+                              ('index', '<i4'), ('params', '<f8', (4,))])
+SHM_DIR = '/dev/shm'
+
+
+class Ring():
+    """A single-producer single-consumer ring of variable-length records in a
+    memory-mapped file.
+
+    Args:
+        path (str): Path of the ring file, typically under '/dev/shm'.
+        slot_count (int, optional): Number of slots. If given, a new ring is
+        created, replacing any existing file; otherwise an existing ring is
+        opened.
+        slot_size (int, optional): Size of each slot in bytes, only used when
+        creating a new ring. Defaults to 4 MiB.
+    """
+
+    def __init__(self, path, slot_count=None, slot_size=1 << 22):
+        self.path = path
+        if slot_count is not None:
+            with open(path, 'wb') as f:
+                f.truncate(HEADER_SIZE + slot_count * slot_size)
+        with open(path, 'r+b') as f:
+            self.buf = mmap.mmap(f.fileno(), 0)
+        if slot_count is not None:
+            HEADER.pack_into(self.buf, 0, MAGIC, VERSION, slot_count, slot_size)
+        magic, version, self.slot_count, self.slot_size = HEADER.unpack_from(self.buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a ring buffer: {path}")
+
+    def _counter(self, offset):
+        return COUNTER.unpack_from(self.buf, offset)[0]
+
+    def _slot(self, k):
+        return HEADER_SIZE + (k % self.slot_count) * self.slot_size
+
+    def put(self, parts):
+        """Produce a record.
+
+        Args:
+            parts (List[bytes-like]): Parts of the payload, concatenated in
+            the record.
+
+        Returns:
+            bool: 'False' if the ring is full.
+
+        Raises:
+            ValueError: The payload does not fit in a slot.
+        """
+        head = self._counter(HEAD_OFFSET)
+        if head - self._counter(TAIL_OFFSET) >= self.slot_count:
+            return False
+        length = sum(memoryview(part).nbytes for part in parts)
+        if SLOT_HEADER.size + length > self.slot_size:
+            raise ValueError(f"Record of {length} bytes exceeds the slot size "
+                             f"{self.slot_size} of {self.path}")
+        offset = self._slot(head)
+        SLOT_HEADER.pack_into(self.buf, offset, length)
+        offset += SLOT_HEADER.size
+        for part in parts:
+            part = memoryview(part).cast('B')
+            self.buf[offset:offset + part.nbytes] = part
+            offset += part.nbytes
+        # Publish the record only after its payload has been written
+        COUNTER.pack_into(self.buf, HEAD_OFFSET, head + 1)
+        return True
+
+    def peek(self):
+        """Access the oldest record without consuming it.
+
+        Returns:
+            Optional[memoryview]: Payload of the record, pointing directly into
+            the shared memory, or 'None' if the ring is empty. The view is
+            valid until 'release()' is called.
+        """
+        tail = self._counter(TAIL_OFFSET)
+        if tail >= self._counter(HEAD_OFFSET):
+            return None
+        offset = self._slot(tail)
+        length, = SLOT_HEADER.unpack_from(self.buf, offset)
+        offset += SLOT_HEADER.size
+        return memoryview(self.buf)[offset:offset + length]
+
+    def release(self):
+        """Consume the oldest record."""
+        COUNTER.pack_into(self.buf, TAIL_OFFSET, self._counter(TAIL_OFFSET) + 1)
+
+    def close(self):
+        self.buf.close()
+
+
+def ring_paths(name):
+    """Paths of the request and the response ring with the given name."""
+    return (os.path.join(SHM_DIR, name + '_request'),
+            os.path.join(SHM_DIR, name + '_response'))
+
+
+def encode_request(trigger, shots, instructions):
+    """Encode a request payload.
+
+    Args:
+        trigger (int): Trigger index.
+        shots (int): Number of repetitions.
+        instructions (numpy.ndarray): Pulse instructions of 'INSTRUCTION_DTYPE'.
+
+    Returns:
+        List[bytes-like]: Parts of the payload.
+    """
+    instructions = np.ascontiguousarray(instructions, dtype=INSTRUCTION_DTYPE)
+    return [REQUEST_HEADER.pack(trigger, shots, len(instructions)), instructions]
+
+
+def decode_request(payload):
+    """Decode a request payload.
+
+    Returns:
+        int, int, numpy.ndarray: Trigger index, number of repetitions, and the
+        pulse instructions as a view of 'INSTRUCTION_DTYPE' into the payload.
+    """
+    trigger, shots, count = REQUEST_HEADER.unpack_from(payload)
+    instructions = np.frombuffer(payload, dtype=INSTRUCTION_DTYPE, count=count,
+                                 offset=REQUEST_HEADER.size)
+    return trigger, shots, instructions
+
+
+def encode_response(trigger, exit_code, bits=None, iq=None, iq_dtype='float64'):
+    """Encode a response payload.
+
+    Returns:
+        List[bytes-like]: Parts of the payload.
+    """
+    parts = [RESPONSE_HEADER.pack(trigger, exit_code, 0)]
+    if exit_code == 0:
+        parts += encode_binary(bits, iq, iq_dtype)
+    return parts
+
+
+def decode_response(payload):
+    """Decode a response payload.
+
+    Returns:
+        int, int, Optional[numpy.ndarray], Optional[numpy.ndarray]: Trigger
+        index, exit code, and the measured bits and IQ data on success.
+    """
+    trigger, exit_code, _ = RESPONSE_HEADER.unpack_from(payload)
+    if exit_code != 0:
+        return trigger, exit_code, None, None
+    bits, iq = decode_binary(payload[RESPONSE_HEADER.size:])
+    return trigger, exit_code, bits, iq
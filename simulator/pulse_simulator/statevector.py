@@ -0,0 +1,69 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Statevector engine for noiseless gate-level simulation.
+
+The state of `n` qubits is kept as a NumPy array of shape `(2,) * n`, where
+axis `k` corresponds to qubit `k`. Gates are applied by contracting their
+matrices with the axes of their target qubits, such that no operator on the
+full Hilbert space is ever built.
+"""
+
+import numpy as np
+
+
+class StateVector():
+    """Pure state of a register of qubits, initialized to |0...0>.
+
+    Args:
+        num_qubits (int): Number of qubits.
+    """
+
+    def __init__(self, num_qubits):
+        self.num_qubits = num_qubits
+        self.state = np.zeros((2,) * num_qubits, dtype=complex)
+        self.state[(0,) * num_qubits] = 1
+
+    def apply_1q(self, matrix, target):
+        """Apply a single-qubit gate.
+
+        Args:
+            matrix (numpy.ndarray): 2x2 unitary matrix.
+            target (int): Target qubit.
+        """
+        res = np.tensordot(matrix, self.state, axes=([1], [target]))
+        self.state = np.moveaxis(res, 0, target)
+
+    def apply_2q(self, matrix, targets):
+        """Apply a two-qubit gate.
+
+        Args:
+            matrix (numpy.ndarray): 4x4 unitary matrix, where the first target
+            qubit corresponds to the more significant bit of the row and column
+            indices.
+            targets (List[int]): The two target qubits.
+        """
+        res = np.tensordot(matrix.reshape(2, 2, 2, 2), self.state,
+                           axes=([2, 3], list(targets)))
+        self.state = np.moveaxis(res, [0, 1], list(targets))
+
+    def probabilities(self):
+        """Probability distribution over the computational basis.
+
+        Returns:
+            numpy.ndarray: Probabilities indexed by basis states, where qubit 0
+            corresponds to the most significant bit.
+        """
+        return np.abs(self.state.ravel()) ** 2
@@ -0,0 +1,114 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Decomposition of a register into independent groups of qubits.
+
+Programs such as T1 measurements or parallel calibrations drive several
+qubits without any 2Q pulse between them. Qubits which are never coupled,
+directly or through other qubits, evolve independently from the initial
+product state, such that each connected component of the coupling graph can
+be simulated on its own, and the final distribution is the product of the
+distributions of the components.
+"""
+
+import numpy as np
+
+
+def qubit_components(num_qubits, couplings):
+    """Connected components of the coupling graph of a register.
+
+    Args:
+        num_qubits (int): Number of qubits.
+        couplings (Iterable[Iterable[int]]): Groups of qubits acted upon
+        jointly, e.g. the targets of 2Q pulses.
+
+    Returns:
+        List[List[int]]: Sorted qubits of each component, ordered by their
+        smallest qubit. Qubits not coupled to any other form a component of
+        their own.
+    """
+    parent = list(range(num_qubits))
+
+    def find(qubit):
+        while parent[qubit] != qubit:
+            parent[qubit] = parent[parent[qubit]]
+            qubit = parent[qubit]
+        return qubit
+
+    for qubits in couplings:
+        roots = [find(qubit) for qubit in qubits]
+        for root in roots[1:]:
+            parent[root] = roots[0]
+    components = {}
+    for qubit in range(num_qubits):
+        components.setdefault(find(qubit), []).append(qubit)
+    return sorted(components.values())
+
+
+class ProductDistribution():
+    """Probability distribution of a register, as a product of distributions
+    of disjoint groups of qubits.
+
+    Args:
+        factors (List[Tuple[List[int], numpy.ndarray]]): Qubits of each group,
+        and their distribution indexed by basis states, where the first qubit
+        of the group corresponds to the most significant bit.
+    """
+
+    def __init__(self, factors):
+        self.factors = [(list(qubits), np.asarray(prob)) for qubits, prob in factors]
+
+    @classmethod
+    def from_arrays(cls, prob, factor_qubits, factor_sizes):
+        """Rebuild a distribution flattened by 'to_arrays()'."""
+        bounds = np.cumsum([0] + list(factor_sizes))
+        prob_bounds = np.cumsum([0] + [2 ** size for size in factor_sizes])
+        return cls([(factor_qubits[bounds[i]:bounds[i + 1]].tolist(),
+                     prob[prob_bounds[i]:prob_bounds[i + 1]])
+                    for i in range(len(factor_sizes))])
+
+    def to_arrays(self):
+        """Flatten the distribution into arrays, e.g. to be saved by NumPy.
+
+        Returns:
+            numpy.ndarray, numpy.ndarray, numpy.ndarray: Concatenated
+            distributions, concatenated qubits, and number of qubits of each
+            group.
+        """
+        return (np.concatenate([prob for _, prob in self.factors]),
+                np.array([q for qubits, _ in self.factors for q in qubits], dtype=int),
+                np.array([len(qubits) for qubits, _ in self.factors], dtype=int))
+
+    def marginals(self, measured):
+        """Marginalize each group onto the given qubits.
+
+        Args:
+            measured (List[int]): Qubits to keep.
+
+        Returns:
+            List[Tuple[List[int], numpy.ndarray]]: Kept qubits of each group
+            with at least one of them, and their marginal distribution, where
+            the first kept qubit corresponds to the most significant bit.
+        """
+        res = []
+        for qubits, prob in self.factors:
+            kept = [axis for axis, qubit in enumerate(qubits) if qubit in measured]
+            if not kept:
+                continue
+            prob = np.reshape(np.real(prob), (2,) * len(qubits))
+            prob = np.sum(prob, axis=tuple(np.setdiff1d(np.arange(len(qubits)),
+                                                        kept)))
+            res.append(([qubits[axis] for axis in kept], prob.ravel()))
+        return res
@@ -0,0 +1,141 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Append-only overlay of the envelopes transmitted at run time.
+
+Rather than rewriting the pulse configuration file, each envelope transmitted
+by 'envelope_transmission.py' is appended as a record to an overlay file next
+to it, with the same name and the '.overlay' extension. The pulse simulator
+reads the records appended since its last read, and a record overrides the
+waveform of its (channel, index) slot, in the configuration and in the
+previous records. 'config_gen.py' removes the overlay along with the
+configuration it replaces.
+
+Record layout (all fields little-endian):
+    * Header, 20 bytes: `magic` (4 bytes, `b'YQOV'`), `channel` (uint32),
+    `index` (uint32), `length` (uint32) in samples, `kind` (1 byte, `x` for an
+    'xy_waveform' whose first and second halves are the two quadratures, `z`
+    for a 'z_waveform') and `dtype` (1 byte, `h` for int16 and `i` for int32),
+    padded to 20 bytes.
+    * `length` samples.
+
+Each record is appended with a single 'write()', such that a reader only ever
+misses records still being written, which it reads next time.
+
+Envelopes are only accepted on existing '1Q' channels. So that the channel of
+an envelope is checked without loading the whole configuration, 'config_gen.py'
+also writes a channel index next to it, with the '.channels' extension: one
+line `<channel> <type>` per channel. The pulse simulator ignores records on
+other channels, e.g. if the channel index is missing.
+
+This module only depends on the standard library, such that uploading an
+envelope does not pay for importing 'numpy'.
+"""
+
+import array
+import os
+import struct
+import sys
+
+MAGIC = b'YQOV'
+RECORD = struct.Struct('<4sIIIcc2x')
+KINDS = {b'x': 'xy_waveform', b'z': 'z_waveform'}
+INT16_RANGE = range(-0x8000, 0x8000)
+
+
+def overlay_path(config_file):
+    """Overlay file of a pulse configuration file."""
+    return os.path.splitext(config_file)[0] + '.overlay'
+
+
+def channel_index_path(config_file):
+    """Channel index file of a pulse configuration file."""
+    return os.path.splitext(config_file)[0] + '.channels'
+
+
+def write_channel_index(path, pulse_config):
+    """Write the channel index of a pulse configuration."""
+    with open(path, 'w') as f:
+        f.write("".join(f"{channel} {channel_config['type']}\n"
+                        for channel, channel_config in pulse_config['channels'].items()))
+
+
+def read_channel_index(path):
+    """Read a channel index.
+
+    Returns:
+        Optional[Dict[str, str]]: Type of each channel, or 'None' if there is
+        no channel index.
+    """
+    try:
+        with open(path, 'r') as f:
+            return dict(line.split() for line in f if line.strip())
+    except FileNotFoundError:
+        return None
+
+
+def append_record(path, channel, index, kind, samples):
+    """Append an envelope to an overlay.
+
+    Args:
+        path (str): Overlay file, created if it does not exist.
+        channel (int): Channel of the envelope.
+        index (int): Waveform index of the envelope.
+        kind (bytes): `b'x'` or `b'z'`, see the module description.
+        samples (List[int]): Samples of the envelope.
+    """
+    code = b'h' if all(x in INT16_RANGE for x in samples) else b'i'
+    data = array.array(code.decode(), samples)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    with open(path, 'ab') as f:
+        f.write(RECORD.pack(MAGIC, channel, index, len(data), kind, code) + data.tobytes())
+
+
+def read_records(path, offset=0):
+    """Read the records of an overlay from an offset on.
+
+    Args:
+        path (str): Overlay file.
+        offset (int): Offset of the first record to be read, i.e. the offset
+        returned by the previous read.
+
+    Returns:
+        List[Tuple[str, str, str, bytes, bytes]], int: Channel, waveform index,
+        waveform type, data type code and samples of each complete record, and
+        the offset of the next record.
+
+    Raises:
+        ValueError: Corrupt overlay.
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    records = []
+    pos = 0
+    while pos + RECORD.size <= len(data):
+        magic, channel, index, length, kind, code = RECORD.unpack_from(data, pos)
+        if magic != MAGIC or kind not in KINDS or code not in (b'h', b'i'):
+            raise ValueError(f"Corrupt envelope overlay at offset {offset + pos}: {path}")
+        end = pos + RECORD.size + length * (2 if code == b'h' else 4)
+        if end > len(data):
+            break
+        records.append((str(channel), str(index), KINDS[kind], code,
+                        data[pos + RECORD.size:end]))
+        pos = end
+    return records, offset + pos
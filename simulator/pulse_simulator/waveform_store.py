@@ -0,0 +1,205 @@
+# Copyright 2023 Alibaba Group
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Deduplicated waveform library for pulse configuration files.
+
+Most channels of a device play the same waveforms, such that writing the
+waveforms of each channel into the pulse configuration file makes it grow with
+the number of channels times the size of the waveforms. In the compact form
+written by 'compact_config()':
+    * each distinct waveform dictionary is stored once under
+    'waveform_sets', and channels refer to it by name in 'waveform_set'. The
+    'waveforms' of a channel only hold its own entries, which take precedence
+    over the set, e.g. envelopes uploaded at run time;
+    * each distinct envelope is stored once in a binary waveform library next
+    to the configuration file, named by 'waveform_library', and referred to
+    as '{"wfm": id}' in place of the list of samples.
+
+Library layout (all fields little-endian):
+    * Header, 32 bytes: `magic` (4 bytes, `b'YQWF'`), `version` (uint32,
+    currently `2`), `count` (uint32), reserved (uint32), and `digest` (16
+    bytes), the BLAKE2b digest of the rest of the file.
+    * `count` table entries of 16 bytes: `offset` (uint64) of the samples from
+    the start of the file, `length` (uint32) in samples, and `dtype` (1 byte,
+    `h` for int16, `i` for int32 and `d` for float64), padded to 16 bytes.
+    * Samples of each waveform, aligned to 8 bytes.
+
+Envelopes are stored as int16 whenever their samples fit, as int32 if they
+are integers which do not fit, and as float64 otherwise. The library is
+memory-mapped by 'WaveformLibrary', such that only the pages of the waveforms
+actually played are read, and cache keys depending on the library use the
+digest of its header rather than hashing it.
+"""
+
+import hashlib
+import mmap
+import numbers
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'YQWF'
+VERSION = 2
+HEADER = struct.Struct('<4sIII16s')
+ENTRY = struct.Struct('<QIc3x')
+DTYPES = {b'h': np.dtype('<i2'), b'i': np.dtype('<i4'), b'd': np.dtype('<f8')}
+
+
+def _samples(waveform):
+    """Array of an envelope in the most compact of the library data types."""
+    if all(isinstance(x, numbers.Integral) for x in waveform):
+        res = np.array(waveform, dtype=np.int64)
+        for code in (b'h', b'i'):
+            info = np.iinfo(DTYPES[code])
+            if len(res) == 0 or (res.min() >= info.min and res.max() <= info.max):
+                return code, res.astype(DTYPES[code])
+    return b'd', np.array(waveform, dtype=DTYPES[b'd'])
+
+
+def write_library(path, waveforms):
+    """Write a waveform library.
+
+    Args:
+        path (str): Library file.
+        waveforms (List[Tuple[bytes, numpy.ndarray]]): Data type code and
+        samples of each waveform, indexed by waveform ID.
+    """
+    offset = HEADER.size + ENTRY.size * len(waveforms)
+    table = []
+    data = []
+    for code, samples in waveforms:
+        padding = -offset % 8
+        offset += padding
+        table.append(ENTRY.pack(offset, len(samples), code))
+        data += [b'\0' * padding, samples.tobytes()]
+        offset += len(data[-1])
+    body = b''.join(table + data)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(waveforms), 0,
+                            hashlib.blake2b(body, digest_size=16).digest()))
+        f.write(body)
+
+
+class WaveformLibrary():
+    """Read-only, memory-mapped waveform library.
+
+    Args:
+        path (str): Library file.
+
+    Attributes:
+        digest (str): Digest of the library, changing with its content, as
+        written in its header.
+
+    Raises:
+        ValueError: Not a waveform library, or unsupported version.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER.size:
+            raise ValueError(f"Not a version {VERSION} waveform library: {path}")
+        magic, version, count, _, digest = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} waveform library: {path}")
+        self.digest = digest.hex()
+        self.table = [ENTRY.unpack_from(self.mmap, HEADER.size + ENTRY.size * i)
+                      for i in range(count)]
+
+    def __len__(self):
+        return len(self.table)
+
+    def get(self, waveform_id):
+        """Samples of a waveform, as a read-only view into the library."""
+        offset, length, code = self.table[waveform_id]
+        return np.frombuffer(self.mmap, dtype=DTYPES[code], count=length, offset=offset)
+
+    def resolve(self, entry):
+        """Replace the waveform references of a configuration entry by their
+        samples."""
+        if isinstance(entry, dict) and 'wfm' in entry:
+            return self.get(entry['wfm'])
+        if isinstance(entry, list):
+            return [self.resolve(item) for item in entry]
+        return entry
+
+
+def library_path(config_file, pulse_config):
+    """Path of the waveform library of a configuration, or 'None' if its
+    waveforms are inline."""
+    name = pulse_config.get('waveform_library')
+    if name is None:
+        return None
+    return os.path.join(os.path.dirname(os.path.abspath(config_file)), name)
+
+
+def channel_waveform(pulse_config, channel_config, index):
+    """Entry of a waveform index on a channel, which may still contain
+    waveform references.
+
+    Raises:
+        KeyError: Index not defined on the channel.
+    """
+    waveforms = channel_config.get('waveforms', {})
+    if index in waveforms or 'waveform_set' not in channel_config:
+        return waveforms[index]
+    return pulse_config['waveform_sets'][channel_config['waveform_set']][index]
+
+
+def compact_config(pulse_config, library_name):
+    """Deduplicate the waveforms of a configuration with inline waveforms.
+
+    Args:
+        pulse_config (dict): Configuration with inline waveforms, which is
+        left untouched.
+        library_name (str): File name of the library, relative to the
+        configuration file.
+
+    Returns:
+        dict, List[Tuple[bytes, numpy.ndarray]]: Compact configuration, and
+        the waveforms to be written with 'write_library()'.
+    """
+    waveforms = []
+    waveform_ids = {}
+
+    def to_refs(entry):
+        if isinstance(entry, list) and entry and all(
+                isinstance(x, numbers.Real) for x in entry):
+            code, samples = _samples(entry)
+            key = code, samples.tobytes()
+            if key not in waveform_ids:
+                waveform_ids[key] = len(waveforms)
+                waveforms.append((code, samples))
+            return {'wfm': waveform_ids[key]}
+        if isinstance(entry, list):
+            return [to_refs(item) for item in entry]
+        return entry
+
+    sets = {}
+    set_names = {}
+    channels = {}
+    for channel, channel_config in pulse_config['channels'].items():
+        channel_waveforms = {str(index): to_refs(entry)
+                             for index, entry in channel_config['waveforms'].items()}
+        key = repr(sorted(channel_waveforms.items()))
+        if key not in set_names:
+            set_names[key] = f"set{len(sets)}"
+            sets[set_names[key]] = channel_waveforms
+        channels[channel] = {**channel_config, 'waveform_set': set_names[key],
+                             'waveforms': {}}
+    res = {**pulse_config, 'channels': channels, 'waveform_sets': sets,
+           'waveform_library': library_name}
+    return res, waveforms
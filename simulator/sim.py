@@ -27,11 +27,27 @@ import argparse
 import json
 import subprocess
 import os
+import select
 import signal
-import time
+
+from file_notify import wait_for_file
+from pulse_simulator.perf_trace import PerfTrace, start_trace
 
 QUANTUM_COMMAND_DIR = '/yaqcs-arch/simulator/quantum_command.txt'
 EXIT_CODE_DIR = '/yaqcs-arch/simulator/exit_code.txt'
+PULSE_SERVER_DIR = '/yaqcs-arch/simulator/pulse_simulator/pulse_server.py'
+PULSE_CONFIG_DIR = '/yaqcs-arch/simulator/pulse_simulator/pulse.json'
+PULSE_REQUEST_DIR = '/yaqcs-arch/simulator/pulse_request.fifo'
+PULSE_RESPONSE_DIR = '/yaqcs-arch/simulator/pulse_response.fifo'
+TRIGGER_INDEX_DIR = '/yaqcs-arch/simulator/trigger_index.txt'
+PULSE_SHM_NAME = 'yaqcs_pulse'
+PULSE_SHM_DIRS = ['/dev/shm/yaqcs_pulse_request', '/dev/shm/yaqcs_pulse_response']
+# Time for the pulse simulator server to import its backend and load the
+# device configuration, in seconds
+PULSE_SERVER_TIMEOUT = 120
+# Time for the pulse simulator server to answer a request, in seconds, after
+# which the trigger fails, unless overridden by `quantum_server_timeout`
+PULSE_REQUEST_TIMEOUT = 3600
 
 
 def build_riscv_command(config, kernel, debug=False):
@@ -76,13 +92,28 @@ def build_riscv_command(config, kernel, debug=False):
         raise "Keyword missing in config file. Please revise." + e
 
 
-def build_quantum_command(config):
+def build_quantum_command(config, server_pid=None):
     """
     Build a shell command invoking the pulse-level simulator for pulse-level
     quantum-device simulation.
+
+    If `config['quantum_server']` is set, the command does not start the
+    pulse-level simulator itself, but sends a request to the persistent
+    simulator server started by `build_quantum_server_command()`, and waits
+    for its response. The paths of the request are separated by a tab, such
+    that they may contain spaces. The trigger fails with exit code 1 if the
+    server is not running, or if it does not answer within
+    `config['quantum_server_timeout']` seconds (`PULSE_REQUEST_TIMEOUT` by
+    default), instead of blocking the YQE plugin forever. Otherwise, if a
+    `seed` backend parameter is given, the command numbers the triggers
+    through a counter file, such that each simulator process samples its
+    trigger with a different generator.
+
     Args:
         config (dict): configurations containing specification of the
         pulse-level simulator.
+        server_pid (int, optional): process ID of the simulator server, checked
+        before each request.
 
     Returns:
         str: shell command invoking the pulse-level simulation.
@@ -98,16 +129,128 @@ def build_quantum_command(config):
         if quantum_backend not in SUPPORTED_QUANTUM_BACKEND:
             raise ValueError("Quantum backend {} not yet supported!\n Currently supported backend = {}".format(
                 quantum_backend, SUPPORTED_QUANTUM_BACKEND))
+        if config.get('quantum_server', False):
+            request_str = "printf \"%s\\t%s\\n\" \"$PWD/pulses.txt\" \"$PWD/output.txt\" > {} && ".format(PULSE_REQUEST_DIR) +\
+                "read code < {} && ".format(PULSE_RESPONSE_DIR) +\
+                "echo $code > exit_code.txt"
+            command_str = "timeout {} sh -c '{}' || echo 1 > exit_code.txt".format(
+                config.get('quantum_server_timeout', PULSE_REQUEST_TIMEOUT), request_str)
+            if server_pid is not None:
+                command_str = "kill -0 {} 2>/dev/null && ".format(server_pid) + command_str
+            return command_str
+        backend_params = config['quantum_backend_params']
+        seeded = any(param.startswith('seed=') for param in backend_params)
+        if seeded:
+            backend_params = backend_params + ['first_trigger=$trigger']
         command_str = "python3 " +\
             "/yaqcs-arch/simulator/pulse_simulator/pulse_simulator.py " +\
-            "/yaqcs-arch/simulator/pulse_simulator/pulse.json " +\
-            "pulses.txt output.txt {}; ".format(quantum_backend + " " + " ".join(config['quantum_backend_params'])) +\
+            PULSE_CONFIG_DIR + " " +\
+            "pulses.txt output.txt {}; ".format(quantum_backend + " " + " ".join(backend_params)) +\
             "echo $? > exit_code.txt"
+        if seeded:
+            command_str = "trigger=$(cat {} 2>/dev/null || echo 0); ".format(TRIGGER_INDEX_DIR) +\
+                "echo $((trigger + 1)) > {}; ".format(TRIGGER_INDEX_DIR) + command_str
         return command_str
     except KeyError as e:
         raise "Keyword missing in config file. Please revise." + e
 
 
+def build_traced_command(command_str, trace_file, trace_format='jsonl'):
+    """
+    Wrap the shell command of a trigger such that its wall-clock time, as
+    seen by the YQE plugin, is appended to the trace file as a
+    `quantum_command` event (see `pulse_simulator/perf_trace.py`). The
+    handoff latency of a trigger is the duration of this event minus the
+    duration of the `trigger` event recorded by the pulse simulator.
+
+    Args:
+        command_str (str): Shell command of a trigger.
+        trace_file (str): Trace file.
+        trace_format (str): 'jsonl' or 'chrome'.
+
+    Returns:
+        str: Traced shell command.
+    """
+    separator = ',' if trace_format == 'chrome' else ''
+    event = '{"name":"quantum_command","cat":"plugin","ph":"X","ts":%d,"dur":%d,' +\
+        '"pid":%d,"tid":%d,"args":{}}' + separator + '\\n'
+    return "trace_ts=$(date +%s%N); " + command_str + "; " +\
+        "trace_te=$(date +%s%N); " +\
+        "printf '{}' $((trace_ts / 1000)) $(((trace_te - trace_ts) / 1000)) $$ $$ >> {}".format(
+            event, trace_file)
+
+
+def build_quantum_server_command(config, ready_fd=None):
+    """
+    Build shell command starting the persistent pulse-level simulator server,
+    which serves the requests sent by the command built by
+    `build_quantum_command()`.
+
+    If `config['quantum_shm']` is set, the server also creates shared-memory
+    rings under `/dev/shm`, through which the YQE plugin can exchange pulse
+    instructions and measurement results without going through files.
+
+    Args:
+        config (dict): configurations containing specification of the
+        pulse-level simulator.
+        ready_fd (int, optional): File descriptor the server writes `ready` to
+        once it serves requests, see `start_quantum_server()`.
+
+    Returns:
+        List[str]: shell command starting the pulse-level simulator server.
+    """
+    shm_params = ["--shm", PULSE_SHM_NAME] if config.get('quantum_shm', False) else []
+    ready_params = ["--ready-fd", str(ready_fd)] if ready_fd is not None else []
+    return ["python3", PULSE_SERVER_DIR] + shm_params + ready_params + [
+            PULSE_CONFIG_DIR,
+            PULSE_REQUEST_DIR, PULSE_RESPONSE_DIR,
+            config['quantum_backend']] + config['quantum_backend_params']
+
+
+def start_quantum_server(config, timeout=PULSE_SERVER_TIMEOUT):
+    """
+    Start the persistent pulse-level simulator server, and wait until it
+    serves requests. Otherwise, a client would block forever on the request
+    named pipe of a server which failed to start.
+
+    Args:
+        config (dict): configurations containing specification of the
+        pulse-level simulator.
+        timeout (float): Time to wait for the server, in seconds.
+
+    Returns:
+        subprocess.Popen: the server process.
+
+    Raises:
+        RuntimeError: The server exited or did not become ready in time.
+    """
+    read_fd, write_fd = os.pipe()
+    try:
+        server = subprocess.Popen(build_quantum_server_command(config, write_fd),
+                                  pass_fds=(write_fd,))
+    finally:
+        os.close(write_fd)
+    # The pipe reaches end-of-file as soon as the server exits
+    with os.fdopen(read_fd, 'r') as f:
+        ready, _, _ = select.select([f], [], [], timeout)
+        line = f.readline() if ready else ''
+    if line.strip() != 'ready':
+        server.terminate()
+        code = server.wait()
+        raise RuntimeError("Pulse simulator server failed to start (exit code {})".format(code))
+    return server
+
+
+def make_fifos(*paths):
+    """
+    Create named pipes at the given paths, replacing stale files if any.
+    """
+    for path in paths:
+        if os.path.lexists(path):
+            os.remove(path)
+        os.mkfifo(path)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', help='config file for QCS simulator',
@@ -128,24 +271,59 @@ if __name__ == "__main__":
     # simulator through system call
     if args.quantum_backend is not None:
         config_json['quantum_backend'] = args.quantum_backend
-    quantum_command = build_quantum_command(config_json)
-    with open(QUANTUM_COMMAND_DIR, 'w') as f:
-        f.write(quantum_command)
+    # Per-stage timings of the simulator, and of the triggers as seen by the
+    # YQE plugin, are appended to a single trace file
+    trace_file = config_json.get('quantum_trace')
+    trace_format = config_json.get('quantum_trace_format', 'jsonl')
+    if trace_file is not None:
+        start_trace(trace_file, trace_format)
+        config_json['quantum_backend_params'] = config_json['quantum_backend_params'] + [
+            'trace_file=' + trace_file, 'trace_format=' + trace_format]
+    trace = PerfTrace(trace_file, trace_format, category='sim')
+    # Triggers of a seeded run are numbered from 0
+    if os.path.exists(TRIGGER_INDEX_DIR):
+        os.remove(TRIGGER_INDEX_DIR)
 
     # Build RISC-V simulation shell command
     riscv_commands = build_riscv_command(config_json, kernel, args.debug)
 
-    p = subprocess.Popen(riscv_commands)
-    if config_json['qemu_params']['machine'] != "smarth":
-        # The simulator does not terminate automatically without an OS;
-        # Need to have it killed upon the kernel program producing an
-        # exit code
-        while not os.path.exists(EXIT_CODE_DIR):
-            time.sleep(1)
-        with open(EXIT_CODE_DIR, 'r') as f:
-            exit_code = int(f.readline().split(" ")[-1])
-        subprocess.run(["rm", "-f", EXIT_CODE_DIR])
-        os.kill(p.pid, signal.SIGTERM)
-    else:
-        exit_code = p.wait()
+    server = None
+    p = None
+    try:
+        # Start the persistent pulse-level simulator server, such that
+        # triggers do not pay for interpreter startup and backend imports
+        if config_json.get('quantum_server', False):
+            make_fifos(PULSE_REQUEST_DIR, PULSE_RESPONSE_DIR)
+            server = start_quantum_server(config_json)
+        quantum_command = build_quantum_command(
+            config_json, server.pid if server is not None else None)
+        if trace_file is not None:
+            quantum_command = build_traced_command(quantum_command, trace_file, trace_format)
+        with open(QUANTUM_COMMAND_DIR, 'w') as f:
+            f.write(quantum_command)
+
+        with trace.span('riscv', kernel=kernel):
+            p = subprocess.Popen(riscv_commands)
+            if config_json['qemu_params']['machine'] != "smarth":
+                # The simulator does not terminate automatically without an OS;
+                # Need to have it killed upon the kernel program producing an
+                # exit code
+                wait_for_file(EXIT_CODE_DIR)
+                with open(EXIT_CODE_DIR, 'r') as f:
+                    exit_code = int(f.readline().split(" ")[-1])
+                subprocess.run(["rm", "-f", EXIT_CODE_DIR])
+                os.kill(p.pid, signal.SIGTERM)
+            else:
+                exit_code = p.wait()
+    finally:
+        if p is not None and p.poll() is None:
+            p.kill()
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if config_json.get('quantum_server', False):
+            for path in [PULSE_REQUEST_DIR, PULSE_RESPONSE_DIR] + PULSE_SHM_DIRS:
+                if os.path.lexists(path):
+                    os.remove(path)
+        trace.flush()
     print("RISC-V simulator completed with code {}".format(exit_code))
@@ -0,0 +1,225 @@
+# Copyright 2023 Alibaba Group
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End-to-end benchmark of the programs catalogue across backends.
+
+Each case runs a program of `programs/` through `test.sh`, like `test.py`,
+with the trace of `simulator/pulse_simulator/perf_trace.py` enabled. The
+following are derived from the trace and written to a JSON results file:
+* `triggers`: number of simulated triggers;
+* `triggers_per_s`: triggers per second of the whole RISC-V run;
+* `latency_ms`: percentiles of the latency of a trigger as seen by the YQE
+plugin, i.e. of the `quantum_command` events;
+* `simulator_cpu_s`: CPU time of the pulse simulator over all triggers;
+* `peak_rss_mb`: peak resident memory of the pulse simulator;
+* `wall_s`: wall-clock time of `test.sh`, including building the topology.
+
+Cases which cannot run with a backend (e.g. non-Clifford programs on `stim`,
+or QASM programs which have not been compiled) are recorded with their error
+instead of metrics.
+
+With `--compare BASELINE`, the results are compared with a previous results
+file, and the exit code is 1 if the throughput of any case dropped by more
+than `--tolerance`.
+
+Usage:
+    > python3 bench.py [--output FILE] [--case NAME ...] [--backend BACKEND ...]
+                       [--compare BASELINE] [--tolerance FRACTION]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROGRAMS_PATH = '/yaqcs-arch/programs'
+SIM_CONFIG = '/yaqcs-arch/simulator/sim.json'
+BACKENDS = ['qutip', 'qutip_qip', 'stim']
+QEC_SIZES = [3, 5, 7]
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+def qec_case(size, backends):
+    return {'name': f'qmemory_experiment_d{size}', 'program': 'qmemory_experiment',
+            'topology': 'qec', 'qec_size': size, 'backends': backends}
+
+
+CASES = [
+    {'name': 't1_demo', 'program': 't1_demo', 'backends': BACKENDS},
+    {'name': 'rb', 'program': 'rb', 'params': [28495, 5, 1, 2, 4, 6, 8, 10],
+     'backends': BACKENDS},
+    {'name': 'rabi_amp', 'program': 'rabi_amp', 'params': [10, 5, 20, 5],
+     'backends': ['qutip', 'qutip_qip']},
+    # Statevector simulation of the whole code is only affordable at d=3
+    qec_case(3, ['qutip_qip', 'stim']),
+] + [qec_case(size, ['stim']) for size in QEC_SIZES[1:]] + [
+    {'name': name, 'program': name, 'backends': BACKENDS}
+    for name in ['trivial', 'cnot_ladder', 'misc_circuit']
+]
+
+
+def read_trace(trace_file):
+    """Events of a trace file in either format of 'perf_trace.py'."""
+    events = []
+    with open(trace_file, 'r') as f:
+        for line in f:
+            line = line.strip().rstrip(',')
+            if line and line != '[':
+                events.append(json.loads(line))
+    return events
+
+
+def metrics(events):
+    """Benchmark metrics of a run, from its trace events."""
+    triggers = [event for event in events if event['name'] == 'trigger']
+    commands = [event for event in events if event['name'] == 'quantum_command']
+    riscv = [event for event in events if event['name'] == 'riscv']
+    # Latency as seen by the plugin, or by the simulator if not recorded
+    latencies = np.array([event['dur'] for event in commands or triggers]) / 1e3
+    run_s = riscv[0]['dur'] / 1e6 if riscv else None
+    res = {
+        'triggers': len(triggers),
+        'triggers_per_s': len(triggers) / run_s if run_s else None,
+        'latency_ms': {f'p{q}': float(np.percentile(latencies, q)) if len(latencies) else None
+                       for q in LATENCY_PERCENTILES},
+        'simulator_cpu_s': sum(event['args'].get('cpu_us', 0) for event in triggers) / 1e6,
+        'peak_rss_mb': max([event['args'].get('max_rss_kb', 0) for event in triggers],
+                           default=0) / 1024,
+    }
+    return res
+
+
+def prepare(case, tmp):
+    """Build the topology and the program of a case, and write its parameters."""
+    topology = case.get('topology', 'default')
+    make_vars = [f"QEC_SIZE={case['qec_size']}"] if 'qec_size' in case else []
+    if 'qec_size' in case:
+        # The program includes 'qec.h', which depends on the code size
+        subprocess.run(['make', '-B', 'qec'] + make_vars, cwd=PROGRAMS_PATH, check=True,
+                       capture_output=True)
+    subprocess.run(['make', f'{topology}_topology'] + make_vars, cwd=PROGRAMS_PATH,
+                   check=True, capture_output=True)
+    if not os.path.exists(os.path.join(PROGRAMS_PATH, case['program'])):
+        raise FileNotFoundError(f"Program {case['program']} has not been built")
+    params = case.get('params')
+    if params is not None:
+        with open(os.path.join(PROGRAMS_PATH, 'params.txt'), 'w') as f:
+            f.write(str(len(params)) + '\n')
+            f.write('\n'.join(str(i) for i in params))
+    return os.path.join(tmp, 'trace.jsonl')
+
+
+def run_case(case, backend, config, tmp):
+    """Run a case with a backend.
+
+    Returns:
+        dict: Metrics of the run, or the error preventing it.
+    """
+    res = {'case': case['name'], 'backend': backend}
+    start = time.perf_counter()
+    try:
+        trace_file = prepare(case, tmp)
+        config_file = os.path.join(tmp, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump({**config, 'quantum_backend': backend,
+                       'quantum_trace': trace_file, 'quantum_trace_format': 'jsonl'}, f)
+        run = subprocess.run(['bash', 'test.sh', '-c', config_file, case['program']],
+                             cwd=PROGRAMS_PATH, capture_output=True, text=True, check=False)
+        res['wall_s'] = time.perf_counter() - start
+        events = read_trace(trace_file)
+        res.update(metrics(events))
+        if run.returncode != 0 or res['triggers'] == 0:
+            res['error'] = f"test.sh exited with {run.returncode}:\n{run.stderr[-2000:]}"
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        res['wall_s'] = time.perf_counter() - start
+        res['error'] = str(e)
+    return res
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of throughput relative to a baseline.
+
+    Returns:
+        List[str]: Cases whose throughput dropped by more than 'tolerance'.
+    """
+    previous = {(res['case'], res['backend']): res for res in baseline['results']}
+    regressions = []
+    for res in results:
+        old = previous.get((res['case'], res['backend']))
+        if old is None or not old.get('triggers_per_s') or not res.get('triggers_per_s'):
+            continue
+        ratio = res['triggers_per_s'] / old['triggers_per_s']
+        label = f"{res['case']}/{res['backend']}"
+        print(f"{label:32s} throughput x{ratio:5.2f}")
+        if ratio < 1 - tolerance:
+            regressions.append(label)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', default='bench_results.json',
+                        help='results file')
+    parser.add_argument('--case', action='append', default=None,
+                        help='run only the given case, can be repeated')
+    parser.add_argument('--backend', action='append', default=None,
+                        help='run only the given backend, can be repeated')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results file to compare the throughput with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative throughput drop reported as a regression')
+    args = parser.parse_args()
+
+    with open(SIM_CONFIG, 'r') as fin:
+        sim_config = json.load(fin)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for case in CASES:
+            if args.case is not None and case['name'] not in args.case:
+                continue
+            for backend in case['backends']:
+                if args.backend is not None and backend not in args.backend:
+                    continue
+                res = run_case(case, backend, sim_config, tmp)
+                results.append(res)
+                if 'error' in res:
+                    print(f"{case['name']:28s} {backend:10s} failed: "
+                          f"{res['error'].splitlines()[0] if res['error'] else ''}")
+                else:
+                    print(f"{case['name']:28s} {backend:10s} "
+                          f"{res['triggers']:5d} triggers  "
+                          f"{res['triggers_per_s'] or 0:8.2f}/s  "
+                          f"p50={res['latency_ms']['p50']:8.2f}ms  "
+                          f"cpu={res['simulator_cpu_s']:7.2f}s  "
+                          f"rss={res['peak_rss_mb']:7.1f}MB")
+    with open(args.output, 'w') as f:
+        json.dump({'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                            'host': platform.node(),
+                            'python': platform.python_version(),
+                            'cpus': os.cpu_count(),
+                            'config': sim_config},
+                   'results': results}, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Throughput regressions: " + ", ".join(regressions))
+            sys.exit(1)
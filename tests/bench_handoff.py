@@ -0,0 +1,115 @@
+# Copyright 2023 Alibaba Group
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the latency of observing a completed simulation.
+
+Compares the handoff paths between a producer (the pulse simulator or the QEMU
+plugin) and a waiting consumer:
+* `poll`: checking for the file with `time.sleep(1)` in between, as `sim.py`
+used to do;
+* `inotify`: `wait_for_file()` from `simulator/file_notify.py`;
+* `fifo`: blocking read on a named pipe, as used by the pulse simulator server.
+
+Latency is measured from the moment the producer has finished writing to the
+moment the consumer wakes up.
+
+Usage:
+    > python3 bench_handoff.py [--repeat N] [--poll-repeat N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulator'))
+from file_notify import wait_for_file  # noqa: E402
+
+
+def poll_wait(path):
+    while not os.path.exists(path):
+        time.sleep(1)
+
+
+def bench_file(wait, path, repeat):
+    latencies = []
+    for _ in range(repeat):
+        written = []
+
+        def produce():
+            time.sleep(random.uniform(0, 0.01))
+            # Taken before the file is created, since polling may already
+            # find it then, such that the latency is never underestimated
+            written.append(time.perf_counter())
+            with open(path, 'w') as f:
+                f.write('0\n')
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        wait(path)
+        woken = time.perf_counter()
+        producer.join()
+        latencies.append(woken - written[0])
+        os.remove(path)
+    return latencies
+
+
+def bench_fifo(path, repeat):
+    os.mkfifo(path)
+    latencies = []
+    for _ in range(repeat):
+        written = []
+
+        def produce():
+            time.sleep(random.uniform(0, 0.01))
+            # Opening blocks until the reader has opened the FIFO, so the
+            # timestamp is taken right before the write that wakes it
+            with open(path, 'w') as f:
+                written.append(time.perf_counter())
+                f.write('0\n')
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        with open(path, 'r') as f:
+            f.readline()
+        woken = time.perf_counter()
+        producer.join()
+        latencies.append(woken - written[0])
+    os.remove(path)
+    return latencies
+
+
+def report(name, latencies):
+    us = np.array(latencies) * 1e6
+    print(f"{name:8s} n={len(us):4d}  median={np.median(us):12.1f}us  "
+          f"p99={np.percentile(us, 99):12.1f}us  max={np.max(us):12.1f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='number of handoffs for event-driven paths')
+    parser.add_argument('--poll-repeat', type=int, default=5,
+                        help='number of handoffs for the 1s polling path')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'exit_code.txt')
+        report('poll', bench_file(poll_wait, path, args.poll_repeat))
+        report('inotify', bench_file(wait_for_file, path, args.repeat))
+        report('fifo', bench_fifo(os.path.join(tmp, 'response.fifo'), args.repeat))
@@ -0,0 +1,153 @@
+# Copyright 2023 Alibaba Group
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the memory footprint of parsed pulse instructions.
+
+A program of X gates, CZ gates and measurements spread over the qubits and
+couplers of `topology.json` is parsed by `PulseSimulator._parse_instr()`, and
+the memory held by the resulting instructions is measured with `tracemalloc`.
+The waveform table shared by all instructions is built by a first, untimed
+parse, such that only the per-instruction footprint is counted. The same
+program is also parsed into `LegacyInstruction`, a replica of the previous
+representation (a `__dict__` per instruction, the split line as `params`, and
+per-instruction copies of the timesteps and of the rescaled coefficients as
+lists), and the following are reported for both:
+* `bytes/instr`: memory held per instruction;
+* `parse`: wall-clock time of the parse.
+
+Usage:
+    > python3 bench_memory.py [--lines N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+PULSE_SIMULATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                   'simulator', 'pulse_simulator')
+sys.path.insert(0, PULSE_SIMULATOR_DIR)
+
+from pulse_simulator import PulseSimulator  # noqa: E402  pylint: disable=wrong-import-position
+
+_DEFAULT_AMP = np.pi / 200
+_DEFAULT_RANGE = 0x4000
+
+
+class LegacyInstruction():
+    """Previous representation of a pulse instruction."""
+
+    def __init__(self, pulse_type, targets, index, tlist=None, coefs=None, params=None,
+                 delay=None):
+        self.pulse_type = pulse_type
+        self.targets = targets
+        self.index = index
+        self.tlist = tlist
+        self.coefs = coefs
+        self.params = params
+        self.delay = delay
+
+
+def legacy_parse(pulse_config, lines):
+    """Parse the instructions of 'write_program()' as the previous parser did."""
+    res = []
+    for instr in lines:
+        params = instr.split(" ")
+        delay = int(params[0])
+        channel_config = pulse_config["channels"][params[1]]
+        index = params[2]
+        if channel_config["type"] == '2Q':
+            coefs = channel_config['waveforms'][index][0]
+            tlist = np.linspace(0, len(coefs) - 1, len(coefs))
+            res.append(LegacyInstruction('gate_2q', channel_config["target"], index, tlist,
+                                         coefs, params, delay=delay))
+        elif index == '128':
+            res.append(LegacyInstruction('measure', channel_config["target"], index,
+                                         delay=delay))
+        else:
+            coefs_x, coefs_y = channel_config['waveforms'][index][1]
+            tlist = np.linspace(0, len(coefs_x) - 1, len(coefs_x))
+            coefs = [list(np.array(coefs_x) * _DEFAULT_AMP / _DEFAULT_RANGE),
+                     list(np.array(coefs_y) * _DEFAULT_AMP / _DEFAULT_RANGE)]
+            res.append(LegacyInstruction('gate_1q', channel_config["target"], index, tlist,
+                                         coefs, params, delay=delay))
+    return res
+
+
+def write_program(pulse_config, num_lines):
+    """Instructions cycling through X gates, CZ gates and measurements."""
+    channels = list(pulse_config["channels"])
+    sq_channels = [channel for channel in channels
+                   if pulse_config["channels"][channel]["type"] == '1Q']
+    tq_channels = [channel for channel in channels
+                   if pulse_config["channels"][channel]["type"] == '2Q'] or sq_channels
+    lines = []
+    for i in range(num_lines):
+        if i % 3 == 0:
+            lines.append(f"{100 * i} {sq_channels[i % len(sq_channels)]} 0 0 0 1 0")
+        elif i % 3 == 1:
+            lines.append(f"{100 * i} {tq_channels[i % len(tq_channels)]} 0 0 0 1 0")
+        else:
+            lines.append(f"{100 * i} {sq_channels[i % len(sq_channels)]} 128 0 0 0 0")
+    return lines
+
+
+def measure(parse):
+    """Memory held by the result of 'parse()', and the wall-clock time of the
+    parse."""
+    tracemalloc.start()
+    start_size, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    res = parse()
+    wall = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (size - start_size) / len(res), wall
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, default=30000,
+                        help='number of pulse instructions')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = os.path.join(tmp, 'pulse.json')
+        inline_file = os.path.join(tmp, 'inline.json')
+        for path, flags in ((config_file, []), (inline_file, ['--inline-waveforms'])):
+            subprocess.run([sys.executable, os.path.join(PULSE_SIMULATOR_DIR, 'config_gen.py'),
+                            os.path.join(PULSE_SIMULATOR_DIR, 'topology.json'), path] + flags,
+                           check=True)
+        simulator = PulseSimulator(config_file, None, None, 'qutip')
+        lines = write_program(simulator.pulse_config, args.lines)
+        instr_list = [str(1)] + lines
+        with open(inline_file, 'r') as f:
+            inline_config = json.load(f)
+
+        # Fill the shared waveform table
+        simulator._parse_instr(instr_list)  # pylint: disable=protected-access
+        simulator.pulse_instrs = None
+        results = {
+            'legacy': measure(lambda: legacy_parse(inline_config, lines)),
+            'current': measure(lambda: simulator._parse_instr(instr_list)),  # pylint: disable=protected-access
+        }
+    for name, (per_instr, wall) in results.items():
+        print(f"{name:8s} {per_instr:9.1f} bytes/instr  parse={wall * 1e3:8.1f}ms")
+    print(f"footprint x{results['current'][0] / results['legacy'][0]:5.3f}")
@@ -0,0 +1,130 @@
+# Copyright 2023 Alibaba Group
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the cold start of the pulse simulator for each backend.
+
+Without the pulse simulator server, `pulse_simulator.py` is started once per
+trigger, such that its start-up time is paid on every trigger. For each
+backend configuration, a one-gate program is simulated in a fresh interpreter
+started with
+`python -X importtime`, and the following are reported:
+* `wall`: wall-clock time of the whole process;
+* `import`: cumulative time of the top-level imports, as reported by
+`-X importtime`, together with the heaviest ones.
+
+The 'qutip_qip' backend is timed with both engines, as the default 'circuit'
+engine imports qutip while the 'statevector' engine does not. The median
+wall-clock time is checked against a budget per configuration, and the exit
+code is 1 if any budget is exceeded.
+
+Usage:
+    > python3 bench_startup.py [--repeat N] [--budget CONFIGURATION=SECONDS ...]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PULSE_SIMULATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                   'simulator', 'pulse_simulator')
+# Backend and backend parameters of each benchmarked configuration
+CONFIGURATIONS = {
+    'stim': ['stim'],
+    'qutip_qip': ['qutip_qip', 'qutip_qip_engine=statevector'],
+    'qutip_qip_circuit': ['qutip_qip', 'qutip_qip_engine=circuit'],
+    'qutip': ['qutip'],
+}
+# Budgets for the median wall-clock time of a cold start, in seconds
+BUDGETS = {'stim': 0.5, 'qutip_qip': 0.5, 'qutip_qip_circuit': 2.5, 'qutip': 3.5}
+# X gate followed by a measurement on qubit 0
+PROGRAM = "100\n0 0 0 0 0 1 0\n100 0 128 0 0 0 0\n"
+
+
+def parse_importtime(stderr):
+    """Cumulative import times of top-level imports in microseconds, by module."""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented
+        if cumulative.strip().isdigit() and not name[1:].startswith(' '):
+            imports[name.strip()] = int(cumulative)
+    return imports
+
+
+def cold_start(configuration, config_file, input_file, output_file):
+    start = time.perf_counter()
+    res = subprocess.run([sys.executable, '-X', 'importtime',
+                          os.path.join(PULSE_SIMULATOR_DIR, 'pulse_simulator.py'),
+                          config_file, input_file, output_file]
+                         + CONFIGURATIONS[configuration],
+                         capture_output=True, text=True, check=False)
+    wall = time.perf_counter() - start
+    if res.returncode != 0:
+        raise RuntimeError(f"{configuration} failed:\n{res.stderr[-2000:]}")
+    return wall, parse_importtime(res.stderr)
+
+
+def bench(configuration, tmp, repeat):
+    config_file = os.path.join(tmp, 'pulse.json')
+    input_file = os.path.join(tmp, 'pulses.txt')
+    output_file = os.path.join(tmp, 'output.txt')
+    walls = []
+    imports = {}
+    for _ in range(repeat):
+        wall, imports = cold_start(configuration, config_file, input_file, output_file)
+        walls.append(wall)
+    return np.median(walls), imports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of cold starts per configuration')
+    parser.add_argument('--budget', action='append', default=[],
+                        metavar='CONFIGURATION=SECONDS',
+                        help='override the budget of a configuration, among '
+                        + ', '.join(CONFIGURATIONS))
+    args = parser.parse_args()
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        configuration, seconds = item.split('=', 1)
+        if configuration not in CONFIGURATIONS:
+            parser.error(f"unknown configuration '{configuration}'")
+        budgets[configuration] = float(seconds)
+
+    exceeded = []
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run([sys.executable, os.path.join(PULSE_SIMULATOR_DIR, 'config_gen.py'),
+                        os.path.join(PULSE_SIMULATOR_DIR, 'topology.json'),
+                        os.path.join(tmp, 'pulse.json')], check=True)
+        with open(os.path.join(tmp, 'pulses.txt'), 'w') as f:
+            f.write(PROGRAM)
+        for configuration, budget in budgets.items():
+            wall, imports = bench(configuration, tmp, args.repeat)
+            heaviest = sorted(imports.items(), key=lambda item: -item[1])[:3]
+            print(f"{configuration:17s} wall={wall * 1e3:8.1f}ms  budget={budget * 1e3:8.1f}ms  "
+                  f"import={sum(imports.values()) / 1e3:8.1f}ms  heaviest: " +
+                  ", ".join(f"{name} {us / 1e3:.1f}ms" for name, us in heaviest))
+            if wall > budget:
+                exceeded.append(configuration)
+    if exceeded:
+        print("Over budget: " + ", ".join(exceeded))
+        sys.exit(1)
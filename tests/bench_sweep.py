@@ -0,0 +1,127 @@
+# Copyright 2023 Alibaba Group
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark batched triggers on the pulse simulator server.
+
+The triggers of a T1 sweep, an X gate followed by a measurement after an
+increasing delay, are sent to the server as a single batch, as a client not
+branching on measurement results may do. For each number of worker processes,
+the following are reported:
+* `wall`: wall-clock time from sending the batch until the last response;
+* `speedup`: relative to simulating the batch in the server process.
+
+The server is seeded, such that the outputs must not depend on the number of
+workers; the exit code is 1 if they do.
+
+Usage:
+    > python3 bench_sweep.py [--points N] [--backend BACKEND] [--workers N ...]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PULSE_SIMULATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                   'simulator', 'pulse_simulator')
+# X gate on qubit 0, and a measurement after the given delay
+PROGRAM = "1000\n0 0 0 0 0 1 0\n{} 0 128 0 0 0 0\n"
+
+
+def write_sweep(tmp, points):
+    """Write the input files of the sweep, and return the request lines."""
+    requests = []
+    for point in range(points):
+        input_file = os.path.join(tmp, f'pulses_{point}.txt')
+        with open(input_file, 'w') as f:
+            f.write(PROGRAM.format(100 + 80 * point))
+        requests.append(f"{input_file} {os.path.join(tmp, f'output_{point}.txt')}")
+    return requests
+
+
+def run_batch(tmp, backend, workers, requests, warmup):
+    """Start a server, send the requests as one batch, and wait for all of the
+    responses. A first batch of 'warmup' requests starts the workers, and is
+    not timed.
+
+    Returns:
+        float, List[bytes]: Wall-clock time of the batch, and the outputs.
+    """
+    request_fifo = os.path.join(tmp, 'request.fifo')
+    response_fifo = os.path.join(tmp, 'response.fifo')
+    for path in (request_fifo, response_fifo):
+        if os.path.lexists(path):
+            os.remove(path)
+        os.mkfifo(path)
+    server = subprocess.Popen([sys.executable, os.path.join(PULSE_SIMULATOR_DIR, 'pulse_server.py'),
+                               '--workers', str(workers),
+                               os.path.join(tmp, 'pulse.json'), request_fifo, response_fifo,
+                               backend, 'seed=0'])
+    try:
+        # Trigger indices continue across batches, so 'warmup' must not
+        # depend on 'workers' for the outputs to be comparable
+        for batch in (requests[:warmup], requests):
+            start = time.perf_counter()
+            with open(request_fifo, 'w') as f:
+                f.write(''.join(request + '\n' for request in batch))
+            codes = []
+            while len(codes) < len(batch):
+                with open(response_fifo, 'r') as f:
+                    codes += f.read().split()
+            wall = time.perf_counter() - start
+        if any(code != '0' for code in codes):
+            raise RuntimeError(f"Simulation failed with {workers} workers")
+    finally:
+        server.terminate()
+        server.wait()
+    outputs = []
+    for request in requests:
+        with open(request.split()[1], 'rb') as f:
+            outputs.append(f.read())
+    return wall, outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--points', type=int, default=50,
+                        help='number of points of the sweep')
+    parser.add_argument('--backend', default='qutip',
+                        help='backend used in simulation')
+    parser.add_argument('--workers', type=int, action='append', default=None,
+                        help='number of worker processes, can be repeated')
+    args = parser.parse_args()
+    worker_counts = args.workers or sorted({0, 2, os.cpu_count() or 1})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run([sys.executable, os.path.join(PULSE_SIMULATOR_DIR, 'config_gen.py'),
+                        os.path.join(PULSE_SIMULATOR_DIR, 'topology.json'),
+                        os.path.join(tmp, 'pulse.json')], check=True)
+        requests = write_sweep(tmp, args.points)
+        baseline = None
+        reference = None
+        mismatches = []
+        for workers in worker_counts:
+            wall, outputs = run_batch(tmp, args.backend, workers, requests,
+                                      max(worker_counts))
+            baseline = baseline or wall
+            reference = reference or outputs
+            if outputs != reference:
+                mismatches.append(workers)
+            print(f"workers={workers:3d}  wall={wall * 1e3:9.1f}ms  "
+                  f"speedup={baseline / wall:5.2f}x")
+    if mismatches:
+        print("Outputs differ with workers: " + ", ".join(map(str, mismatches)))
+        sys.exit(1)
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import unittest
 from contextlib import contextmanager
 import subprocess as sp
@@ -21,6 +22,8 @@ from scipy.stats import binomtest
 import json
 
 PROGRAMS_PATH = '/yaqcs-arch/programs'
+# Seed of the simulations, e.g. to reproduce a failing statistical check
+SEED = os.environ.get('YAQCS_TEST_SEED')
 
 
 class TestPrograms(unittest.TestCase):
@@ -38,9 +41,14 @@ class TestPrograms(unittest.TestCase):
             with open(PROGRAMS_PATH + '/params.txt', 'w') as f:
                 f.write(str(len(params)) + '\n')
                 f.write('\n'.join([str(i) for i in params]))
-        if backend is not None:
+        if backend is not None or SEED is not None:
+            config = dict(self.config)
+            if backend is not None:
+                config['quantum_backend'] = backend
+            if SEED is not None:
+                config['quantum_backend_params'] = config['quantum_backend_params'] + [f'seed={SEED}']
             with open(PROGRAMS_PATH + '/config.json', 'w') as fout:
-                json.dump({**self.config, 'quantum_backend': backend}, fout)
+                json.dump(config, fout)
             cmd.extend(['-c', 'config.json'])
         cmd.append(program)
         print(cmd)
@@ -0,0 +1,1263 @@
+# Copyright 2023 Alibaba Group
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests of the pulse simulator modules, which, unlike 'test.py', run
+without QEMU nor the compiled programs.
+
+Usage:
+    > python3 -m unittest test_pulse_simulator
+"""
+
+import functools
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import warnings
+from unittest import mock
+
+import numpy as np
+
+PULSE_SIMULATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                   'simulator', 'pulse_simulator')
+QEC_GEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'programs', 'util', 'qec_gen.py')
+SIMULATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulator')
+sys.path.insert(0, PULSE_SIMULATOR_DIR)
+# Appended, as the 'simulator/pulse_simulator/' directory would shadow the module
+sys.path.append(SIMULATOR_DIR)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+import bench  # noqa: E402
+import file_notify  # noqa: E402
+import perf_trace  # noqa: E402
+import pulse_server  # noqa: E402
+import result_format  # noqa: E402
+import waveform_overlay  # noqa: E402
+from instruction_table import pair_edges, parse_lines  # noqa: E402
+from program_cache import ProgramCache, StateStore, digest  # noqa: E402
+from pulse_simulator import PulseSimulator, _STATE_STORE_VERSION  # noqa: E402
+from shm_ring import Ring, encode_request  # noqa: E402
+from subsystems import ProductDistribution  # noqa: E402
+from waveform_store import (WaveformLibrary, channel_waveform, compact_config,  # noqa: E402
+                            library_path, write_library)
+
+# 'sim.py' imports 'perf_trace.py' from the 'pulse_simulator' package, which
+# the module of the same name shadows here
+with mock.patch.dict(sys.modules), mock.patch.object(sys, 'path', [SIMULATOR_DIR] + sys.path):
+    del sys.modules['pulse_simulator']
+    import sim  # noqa: E402
+
+NUM_QUBITS = 5
+
+
+def _generate_config(directory, *flags, topology_file=None):
+    """Generate the pulse configuration of a topology, `topology.json` by
+    default, into a directory."""
+    config_file = os.path.join(directory, 'pulse.json')
+    if topology_file is None:
+        topology_file = os.path.join(PULSE_SIMULATOR_DIR, 'topology.json')
+    subprocess.run([sys.executable, os.path.join(PULSE_SIMULATOR_DIR, 'config_gen.py'),
+                    topology_file, config_file] + list(flags), check=True)
+    return config_file
+
+
+def _read_text(data, shots, qubits):
+    """Bits and IQ data of results written in the 'text' format."""
+    lines = data.decode().split('\n')
+    bits = np.array([[int(b) for b in line.split()] for line in lines[:shots]],
+                    dtype=np.uint8).reshape(shots, qubits)
+    iq = np.array([[float(x) for x in line.split()]
+                   for line in lines[shots:shots + shots * qubits]]).reshape(shots, qubits, 2)
+    return bits, iq
+
+
+def _random_program(rng, num_ops=8):
+    """Lines of a random program of `topology.json`, mixing shaped pulses, 2Q
+    couplings and square pulses on the XY and Z lines, separated by idle
+    segments, followed by the measurement of all qubits."""
+    lines = []
+    time = 0
+    for _ in range(num_ops):
+        kind = rng.integers(4)
+        qubit = int(rng.integers(NUM_QUBITS))
+        phase, amp = rng.uniform(0, 2 * np.pi), rng.uniform(0.2, 1)
+        if kind == 0:
+            lines.append(f"{time} {qubit} {rng.integers(2)} {phase:.3f} 0 {amp:.3f} 0")
+            time += 100
+        elif kind == 1:
+            # Coupler between 'qubit' and its successor on the ring
+            lines.append(f"{time} {1024 + qubit} 0 0 0 {amp:.3f} 0")
+            time += 100
+        else:
+            up, down = (2, 3) if kind == 2 else (64, 65)
+            width = int(rng.integers(20, 60))
+            lines.append(f"{time} {qubit} {up} {phase:.3f} 0 {amp:.3f} 0")
+            lines.append(f"{time + width} {qubit} {down} 0 0 0 0")
+            time += width
+        time += int(rng.integers(0, 300))
+    return lines + [f"{time} {qubit} 128 0 0 0 0" for qubit in range(NUM_QUBITS)]
+
+
+def _joint_distribution(prob):
+    """Distribution of the whole register, the first qubit corresponding to
+    the most significant bit."""
+    if not isinstance(prob, ProductDistribution):
+        return np.real(np.asarray(prob)).ravel()
+    res = np.ones(())
+    qubits = []
+    for factor_qubits, factor_prob in prob.factors:
+        res = np.multiply.outer(res, np.real(factor_prob).reshape((2,) * len(factor_qubits)))
+        qubits += factor_qubits
+    return np.transpose(res, np.argsort(qubits)).ravel()
+
+
+class TestResultFormat(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def encode(self, bits, iq, output_format, iq_dtype='float64'):
+        f = io.BytesIO()
+        result_format.write_results(f, bits, iq, output_format, iq_dtype)
+        return f.getvalue()
+
+    def check_formats(self, bits, iq, iq_dtype='float64'):
+        shots, qubits = bits.shape
+        text_bits, text_iq = _read_text(self.encode(bits, iq, 'text'), shots, qubits)
+        binary = self.encode(bits, iq, 'binary', iq_dtype)
+        self.assertEqual(binary, b''.join(bytes(part) for part in
+                                          result_format.encode_binary(bits, iq, iq_dtype)))
+        binary_bits, binary_iq = result_format.decode_binary(binary)
+        np.testing.assert_array_equal(binary_bits, text_bits)
+        self.assertEqual(binary_iq.dtype, result_format.IQ_DTYPES[iq_dtype]
+                         if iq is not None else np.float64)
+        np.testing.assert_allclose(binary_iq, text_iq, rtol=1e-6 if iq_dtype == 'float32' else 0)
+
+    def test_bits_and_iq(self):
+        for qubits in (1, 8, 11):
+            bits = self.rng.integers(0, 2, size=(17, qubits), dtype=np.uint8)
+            iq = self.rng.normal(size=(17, qubits, 2))
+            for iq_dtype in result_format.IQ_DTYPES:
+                with self.subTest(qubits=qubits, iq_dtype=iq_dtype):
+                    self.check_formats(bits, iq, iq_dtype)
+            with self.subTest(qubits=qubits, iq=None):
+                self.check_formats(bits, None)
+
+    def test_packed_bits(self):
+        for qubits in (1, 8, 11):
+            bits = self.rng.integers(0, 2, size=(17, qubits), dtype=np.uint8)
+            packed = result_format.PackedBits(np.packbits(bits, axis=1, bitorder='little'),
+                                              qubits)
+            np.testing.assert_array_equal(packed.unpack(), bits)
+            with self.subTest(qubits=qubits):
+                self.check_formats(packed, None)
+                # Packed and unpacked bits are encoded alike
+                self.assertEqual(self.encode(packed, None, 'binary'),
+                                 self.encode(bits, None, 'binary'))
+                self.assertEqual(self.encode(packed, None, 'text'),
+                                 self.encode(bits, None, 'text'))
+
+    def test_read_results(self):
+        bits = self.rng.integers(0, 2, size=(5, 3), dtype=np.uint8)
+        iq = self.rng.normal(size=(5, 3, 2))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'results.bin')
+            result_format.write_results(path, bits, iq, 'binary')
+            res_bits, res_iq = result_format.read_results(path)
+            np.testing.assert_array_equal(res_bits, bits)
+            np.testing.assert_array_equal(res_iq, iq)
+            del res_bits, res_iq
+
+    def test_stim_end_to_end(self):
+        # Superposition of all the qubits, measured twice such that the bits
+        # of a shot span two bytes
+        lines = [f"0 {qubit} 1 {np.pi / 2} 0 1 0" for qubit in range(NUM_QUBITS)]
+        lines += [f"{time} {qubit} 128 0 0 0 0"
+                  for time in (100, 200) for qubit in range(NUM_QUBITS)]
+        shots = 300
+        with tempfile.TemporaryDirectory() as tmp:
+            config_file = _generate_config(tmp)
+            input_file = os.path.join(tmp, 'pulses.txt')
+            with open(input_file, 'w') as f:
+                f.write(f"{shots}\n" + "\n".join(lines))
+            results = {}
+            for output_format in result_format.OUTPUT_FORMATS:
+                output_file = os.path.join(tmp, f'output.{output_format}')
+                subprocess.run([sys.executable,
+                                os.path.join(PULSE_SIMULATOR_DIR, 'pulse_simulator.py'),
+                                config_file, input_file, output_file, 'stim', 'seed=7',
+                                f'output_format={output_format}'], check=True)
+                with open(output_file, 'rb') as f:
+                    results[output_format] = f.read()
+        bits, iq = result_format.decode_binary(results['binary'])
+        text_bits, text_iq = _read_text(results['text'], shots, 2 * NUM_QUBITS)
+        self.assertTrue(0 < bits.mean() < 1)
+        np.testing.assert_array_equal(bits, text_bits)
+        np.testing.assert_array_equal(iq, text_iq)
+
+    def test_not_binary(self):
+        with self.assertRaises(ValueError):
+            result_format.decode_binary(self.encode(np.zeros((24, 1), dtype=np.uint8),
+                                                    None, 'text'))
+        with self.assertRaises(ValueError):
+            self.encode(np.zeros((1, 1), dtype=np.uint8), None, 'csv')
+
+
+def _instruction_tuples(instructions):
+    return [(delay, channel, index, tuple(params.tolist()))
+            for delay, channel, index, params in instructions.tolist()]
+
+
+class TestQuantumServer(unittest.TestCase):
+    """Server mode of 'sim.py': the server start-up, and the shell command of
+    each trigger, run from a directory with spaces in its path."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.trigger_dir = os.path.join(self.tmp.name, 'trigger dir')
+        os.mkdir(self.trigger_dir)
+        request_fifo, response_fifo = (os.path.join(self.tmp.name, name)
+                                       for name in ('request.fifo', 'response.fifo'))
+        sim.make_fifos(request_fifo, response_fifo)
+        for name, value in (('PULSE_SERVER_DIR', os.path.join(PULSE_SIMULATOR_DIR,
+                                                              'pulse_server.py')),
+                            ('PULSE_CONFIG_DIR', _generate_config(self.tmp.name)),
+                            ('PULSE_REQUEST_DIR', request_fifo),
+                            ('PULSE_RESPONSE_DIR', response_fifo)):
+            patcher = mock.patch.object(sim, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.config = {'quantum_backend': 'stim', 'quantum_backend_params': [],
+                       'quantum_server': True}
+
+    def run_trigger(self, server_pid=None, lines=("0 0 0 0 0 1 0", "100 0 128 0 0 0 0")):
+        """Run the command of a trigger, and return its exit code."""
+        with open(os.path.join(self.trigger_dir, 'pulses.txt'), 'w') as f:
+            f.write("10\n" + "\n".join(lines))
+        subprocess.run(['sh', '-c', sim.build_quantum_command(self.config, server_pid)],
+                       cwd=self.trigger_dir, check=True, timeout=60)
+        with open(os.path.join(self.trigger_dir, 'exit_code.txt'), 'r') as f:
+            return int(f.read())
+
+    def test_triggers(self):
+        server = sim.start_quantum_server(self.config, timeout=60)
+        self.addCleanup(server.wait)
+        self.addCleanup(server.terminate)
+        self.assertEqual(self.run_trigger(server.pid), 0)
+        with open(os.path.join(self.trigger_dir, 'output.txt'), 'r') as f:
+            self.assertEqual(f.read().split('\n')[:10], ['1'] * 10)
+        # A failing trigger, on a missing channel, does not bring down the server
+        self.assertEqual(self.run_trigger(server.pid, ["0 99 0 0 0 1 0"]), 1)
+        self.assertEqual(self.run_trigger(server.pid), 0)
+        server.terminate()
+        server.wait()
+        # Triggers fail once the server is gone
+        self.assertEqual(self.run_trigger(server.pid), 1)
+
+    def test_server_failure(self):
+        self.config['quantum_backend_params'] = ['unknown=1']
+        with self.assertRaises(RuntimeError):
+            sim.start_quantum_server(self.config, timeout=60)
+
+    def test_request_timeout(self):
+        # Without a server reading the requests
+        self.config['quantum_server_timeout'] = 0.5
+        start = time.monotonic()
+        self.assertEqual(self.run_trigger(), 1)
+        self.assertLess(time.monotonic() - start, 30)
+
+
+class TestFileNotify(unittest.TestCase):
+    """Waiting for files with inotify, and with the polling fallback."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'exit_code.txt')
+
+    def write_later(self, delay, move=False):
+        """Write the file from another thread after a delay, in place or by
+        moving it into place."""
+        def write():
+            time.sleep(delay)
+            # Unrelated files do not end the wait
+            with open(os.path.join(self.tmp.name, 'other.txt'), 'w') as f:
+                f.write('0')
+            tmp_path = self.path + '.tmp' if move else self.path
+            with open(tmp_path, 'w') as f:
+                f.write('0')
+            if move:
+                os.replace(tmp_path, self.path)
+        thread = threading.Thread(target=write)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def check_wait(self):
+        with self.subTest(case='existing'):
+            with open(self.path, 'w') as f:
+                f.write('0')
+            self.assertTrue(file_notify.wait_for_file(self.path, timeout=0))
+            os.remove(self.path)
+        for move in (False, True):
+            with self.subTest(case='created', move=move):
+                self.write_later(0.1, move)
+                start = time.monotonic()
+                self.assertTrue(file_notify.wait_for_file(self.path, timeout=10))
+                self.assertLess(time.monotonic() - start, 5)
+                with open(self.path, 'r') as f:
+                    self.assertEqual(f.read(), '0')
+                os.remove(self.path)
+        with self.subTest(case='timeout'):
+            start = time.monotonic()
+            self.assertFalse(file_notify.wait_for_file(self.path, timeout=0.2))
+            self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_inotify(self):
+        if file_notify._libc is None:
+            self.skipTest("inotify is not available")
+        self.check_wait()
+
+    def test_polling(self):
+        with mock.patch.object(file_notify, '_libc', None), \
+                mock.patch.object(file_notify, '_inotify', None):
+            self.check_wait()
+
+
+class TestPerfTrace(unittest.TestCase):
+    """Trace files written by several recorders are valid in both formats."""
+
+    def write_trace(self, path, trace_format):
+        perf_trace.start_trace(path, trace_format)
+        # Two recorders appending to the same file, as two processes do
+        first = perf_trace.PerfTrace(path, trace_format)
+        second = perf_trace.PerfTrace(path, trace_format, category='sim')
+        with first.span('trigger', trigger=0) as args:
+            with first.span('parse'):
+                pass
+            args['program_cache_hit'] = False
+        first.flush()
+        with second.span('quantum_command'):
+            pass
+        second.flush()
+        # Nothing recorded since the last flush
+        first.flush()
+        # Disabled recorders write nothing
+        untraced = perf_trace.PerfTrace()
+        with untraced.span('trigger'):
+            pass
+        untraced.flush()
+        self.assertFalse(untraced.enabled)
+
+    def test_formats(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for trace_format in perf_trace.TRACE_FORMATS:
+                with self.subTest(trace_format=trace_format):
+                    path = os.path.join(tmp, f'trace.{trace_format}')
+                    self.write_trace(path, trace_format)
+                    with open(path, 'r') as f:
+                        text = f.read()
+                    if trace_format == 'jsonl':
+                        events = [json.loads(line) for line in text.splitlines()]
+                    else:
+                        # The closing bracket is left out of the file
+                        self.assertTrue(text.startswith('[\n') and text.endswith(',\n'))
+                        events = json.loads(text.rstrip(',\n') + ']')
+                    self.assertEqual(bench.read_trace(path), events)
+                    self.assertEqual([event['name'] for event in events],
+                                     ['parse', 'trigger', 'quantum_command'])
+                    self.assertEqual([event['cat'] for event in events],
+                                     ['simulator', 'simulator', 'sim'])
+                    parse, trigger, _ = events
+                    self.assertEqual(trigger['args'],
+                                     {'trigger': 0, 'program_cache_hit': False})
+                    for event in events:
+                        self.assertEqual(event['ph'], 'X')
+                        self.assertEqual(event['pid'], os.getpid())
+                        self.assertGreaterEqual(event['dur'], 0)
+                    # The stage of the parse is within the trigger
+                    self.assertLessEqual(trigger['ts'], parse['ts'])
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            perf_trace.PerfTrace(None, 'csv')
+
+
+class TestInstructionTable(unittest.TestCase):
+    def test_parse_lines(self):
+        res = parse_lines(["0 3 1 0.5 0.25 1 0", "", "100 1024 0 0 0 0.5 -2"])
+        self.assertEqual(_instruction_tuples(res), [(0, 3, 1, (0.5, 0.25, 1, 0)),
+                                        (100, 1024, 0, (0, 0, 0.5, -2))])
+
+    def test_missing_parameters(self):
+        res = parse_lines(["0 3 128", "5 1 2 0.5 0 1", "7 1 3 0 0 0 0"])
+        self.assertEqual(_instruction_tuples(res), [(0, 3, 128, (0, 0, 0, 0)), (5, 1, 2, (0.5, 0, 1, 0)),
+                                        (7, 1, 3, (0, 0, 0, 0))])
+        self.assertEqual(len(parse_lines([])), 0)
+
+    def test_misaligned_lines(self):
+        # As many fields as well-formed lines in total, but not line by line
+        with self.assertRaisesRegex(ValueError, "Malformed"):
+            parse_lines(["0 3 1 0 0 1 0 0 0", "0 3 1 0 0"])
+        with self.assertRaisesRegex(ValueError, "Malformed"):
+            parse_lines(["0 3 1 0 0 1 0 0", "0 3 1 0 0 1"])
+        with self.assertRaisesRegex(ValueError, "Malformed"):
+            parse_lines(["0 3"])
+
+    def test_integer_fields(self):
+        for line in ("0 1.5 1 0 0 1 0", "0 1 1.0 0 0 1 0", "1e2 1 1 0 0 1 0",
+                     "0 x 1 0 0 1 0", "0 1 1 0 y 1 0"):
+            with self.subTest(line=line), self.assertRaisesRegex(ValueError, "Malformed"):
+                parse_lines([line])
+        # Large integers are not rounded through floats
+        self.assertEqual(parse_lines(["9007199254740993 0 0"])['delay'][0], 2 ** 53 + 1)
+
+    def test_pair_edges(self):
+        # Qubit 0 is raised twice, qubit 1 once, overlapping with qubit 0
+        is_up = np.array([True, True, False, False, True, False])
+        targets = np.array([0, 1, 0, 1, 0, 0])
+        rising, falling = pair_edges(is_up, targets)
+        self.assertEqual(rising.tolist(), [0, 1, 4])
+        self.assertEqual(falling.tolist(), [2, 3, 5])
+        empty = pair_edges(np.zeros(0, dtype=bool), np.zeros(0, dtype=int))
+        self.assertEqual([len(edges) for edges in empty], [0, 0])
+
+    def test_unmatched_rising_edge(self):
+        rising, falling = pair_edges(np.array([True, False, True]), np.array([2, 2, 2]))
+        self.assertEqual((rising.tolist(), falling.tolist()), ([0], [1]))
+
+    def test_pair_edges_errors(self):
+        with self.assertRaisesRegex(IndexError, "already raised"):
+            pair_edges(np.array([True, True, True, False]), np.array([0, 1, 0, 1]))
+        with self.assertRaisesRegex(IndexError, "before raising edge"):
+            pair_edges(np.array([True, False, False]), np.array([0, 0, 0]))
+        # The first faulty edge is reported
+        with self.assertRaisesRegex(IndexError, "before raising edge"):
+            pair_edges(np.array([True, False, True]), np.array([0, 1, 0]))
+
+
+class TestParseInstr(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.config_file = _generate_config(tmp.name)
+        self.simulator = PulseSimulator(self.config_file, None, None, 'qutip')
+
+    def parse(self, lines):
+        return self.simulator._parse_instr(["1"] + lines)  # pylint: disable=protected-access
+
+    def test_shared_waveforms(self):
+        first, second = self.parse(["0 0 0 0 0 1 0", "100 0 0 0.5 0 1 0"])
+        self.assertIs(first.coefs, second.coefs)
+        self.assertIs(first.tlist, second.tlist)
+        for array in (first.tlist,) + first.coefs:
+            self.assertFalse(array.flags.writeable)
+        self.assertEqual(first.tlist.tolist(), list(range(101)))
+        # An envelope transmitted at run time replaces the shared arrays
+        waveform_overlay.append_record(waveform_overlay.overlay_path(self.config_file),
+                                       0, 0, b'x', [0x4000, 0x4000, 0, 0])
+        self.assertTrue(self.simulator.reload_config_if_changed())
+        instr, = self.parse(["0 0 0 0 0 1 0"])
+        np.testing.assert_allclose(instr.coefs[0], [np.pi / 200] * 2)
+        np.testing.assert_array_equal(instr.coefs[1], [0, 0])
+        self.assertEqual(instr.tlist.tolist(), [0, 1])
+
+    def test_instructions(self):
+        instrs = self.parse(["0 1 0 0.5 0 1 0", "10 1024 1 0 0 0.5 0", "20 2 2 0.25 0 0.5 0",
+                             "60 2 3 0 0 0 0", "70 3 64 0 0 0.3 0", "90 3 65 0 0 0 0",
+                             "100 4 128 0 0 0 0"])
+        self.assertEqual([(instr.pulse_type, instr.targets, instr.index, instr.delay)
+                          for instr in instrs],
+                         [('gate_1q', 1, '0', 0), ('gate_2q', [0, 1], '1', 10),
+                          ('gate_1q', 2, '2', 20), ('gate_1q_z', 3, '64', 70),
+                          ('measure', 4, '128', 100)])
+        self.assertEqual([instr.params for instr in instrs[:4]],
+                         [(0.5, 0, 1, 0), (0, 0, 0.5, 0), (0.25, 0, 0.5, 40), (0, 0, 0.3, 20)])
+        # Square pulses last from their rising to their falling edge
+        self.assertEqual([len(instrs[2].tlist), len(instrs[2].coefs[0]), len(instrs[3].coefs)],
+                         [41, 41, 21])
+        self.assertFalse(hasattr(instrs[0], '__dict__'))
+
+
+class TestShmRequest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.config_file = _generate_config(self.tmp)
+
+    def test_same_results_as_file(self):
+        lines = ["0 0 0 0 0 1 0", "0 1 0 0 0 0.5 0", "100 0 128 0 0 0 0", "100 1 128 0 0 0 0"]
+        input_file = os.path.join(self.tmp, 'pulses.txt')
+        with open(input_file, 'w') as f:
+            f.write("20\n" + "\n".join(lines))
+        simulator = PulseSimulator(self.config_file, None, None, 'qutip', 'seed=3')
+        simulator.load_input(input_file, os.path.join(self.tmp, 'output.txt'))
+        expected = simulator.simulate(0)
+
+        ring = Ring(os.path.join(self.tmp, 'ring'), 2, 1 << 16)
+        self.addCleanup(ring.close)
+        self.assertTrue(ring.put(encode_request(0, 20, parse_lines(lines))))
+        pulse_server._simulator = simulator  # pylint: disable=protected-access
+        trigger, (shots, instructions) = pulse_server.read_shm_request(ring)
+        self.assertEqual((trigger, shots), (0, 20))
+        # The request is copied out of its slot, which the client may reuse
+        self.assertTrue(instructions.flags.owndata)
+        res = pulse_server.simulate_instructions(shots, instructions, trigger)
+        np.testing.assert_array_equal(res[0], expected[0])
+
+
+class TestServerBatch(unittest.TestCase):
+    """A batch of requests is answered in request order, with or without
+    worker processes."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config_file = _generate_config(self.tmp.name)
+        lines = [f"0 {qubit} 1 {np.pi / 2} 0 1 0" for qubit in range(NUM_QUBITS)]
+        lines += [f"100 {qubit} 128 0 0 0 0" for qubit in range(NUM_QUBITS)]
+        # The first trigger takes the longest, such that the others complete
+        # first with workers
+        self.requests = []
+        for i, shots in enumerate((100000, 10, 10, 10, 10, 10)):
+            input_file = os.path.join(self.tmp.name, f'pulses{i}.txt')
+            # Every other request fails, on a missing input file
+            if i % 2 == 0:
+                with open(input_file, 'w') as f:
+                    f.write(f"{shots}\n" + "\n".join(lines))
+            self.requests.append(f"{input_file}\t{input_file}.out")
+
+    def serve_batch(self, workers):
+        """Send all the requests at once, and return their exit codes in the
+        order of the responses, and the outputs of the successful ones."""
+        request_fifo, response_fifo = (os.path.join(self.tmp.name, name)
+                                       for name in ('request.fifo', 'response.fifo'))
+        sim.make_fifos(request_fifo, response_fifo)
+        read_fd, write_fd = os.pipe()
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(PULSE_SIMULATOR_DIR, 'pulse_server.py'),
+             '--workers', str(workers), '--ready-fd', str(write_fd), self.config_file,
+             request_fifo, response_fifo, 'stim', 'seed=5'], pass_fds=(write_fd,))
+        os.close(write_fd)
+        try:
+            with os.fdopen(read_fd, 'r') as f:
+                self.assertEqual(f.readline(), 'ready\n')
+            with open(request_fifo, 'w') as f:
+                f.write("".join(request + "\n" for request in self.requests))
+            codes = []
+            while len(codes) < len(self.requests):
+                # Responses written while the FIFO is open are read at once
+                with open(response_fifo, 'r') as f:
+                    codes += [int(code) for code in f.read().split()]
+        finally:
+            server.terminate()
+            server.wait()
+        outputs = []
+        for request in self.requests[::2]:
+            with open(request.split('\t')[1], 'r') as f:
+                outputs.append(f.read())
+        return codes, outputs
+
+    def test_request_order(self):
+        codes, outputs = self.serve_batch(0)
+        self.assertEqual(codes, [0, 1] * 3)
+        self.assertEqual(self.serve_batch(2), (codes, outputs))
+
+
+class TestProgramCache(unittest.TestCase):
+    """Compiled programs are reused for identical programs, and recompiled
+    when the program or the configuration it depends on changes."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config_file = _generate_config(self.tmp.name)
+        self.input_file = os.path.join(self.tmp.name, 'pulses.txt')
+        self.simulator = PulseSimulator(self.config_file, None, None, 'stim')
+
+    def simulate(self, lines):
+        """Simulate a program, and return its compiled entry and whether it was
+        found in the cache."""
+        with open(self.input_file, 'w') as f:
+            f.write("10\n" + "\n".join(lines))
+        self.simulator.load_input(self.input_file, os.path.join(self.tmp.name, 'output.txt'))
+        hits = self.simulator.program_cache.hits
+        self.simulator.simulate()
+        return self.simulator.compiled, self.simulator.program_cache.hits > hits
+
+    def edit_config(self, edit):
+        with open(self.config_file, 'r') as f:
+            config = json.load(f)
+        edit(config)
+        with open(self.config_file, 'w') as f:
+            json.dump(config, f)
+        # Make sure that the modification time changes
+        stat = os.stat(self.config_file)
+        os.utime(self.config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertTrue(self.simulator.reload_config_if_changed())
+
+    def test_lru(self):
+        cache = ProgramCache(2)
+        entry, hit = cache.lookup(b'a')
+        self.assertFalse(hit)
+        entry['artifact'] = 1
+        self.assertEqual(cache.lookup(b'a'), ({'artifact': 1}, True))
+        cache.lookup(b'b')
+        cache.lookup(b'a')
+        # 'b' is the least recently used entry
+        cache.lookup(b'c')
+        self.assertEqual(list(cache.entries), [b'a', b'c'])
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        # A size of 0 disables caching
+        cache = ProgramCache(0)
+        cache.lookup(b'a')
+        self.assertEqual(cache.lookup(b'a'), ({}, False))
+        self.assertEqual(len(cache), 0)
+
+    def test_program_changes(self):
+        lines = ["0 0 0 0 0 1 0", "100 0 128 0 0 0 0"]
+        compiled, hit = self.simulate(lines)
+        self.assertFalse(hit)
+        self.assertIn('stim_circuit', compiled)
+        # Identical program, with its compiled circuit
+        self.assertEqual(self.simulate(lines), (compiled, True))
+        # Different phase
+        self.assertFalse(self.simulate(["0 0 0 3.1416 0 1 0", lines[1]])[1])
+        # Empty lines do not change the program
+        self.assertTrue(self.simulate(lines + [""])[1])
+
+    def test_config_changes(self):
+        lines = ["0 0 0 0 0 1 0", "100 0 128 0 0 0 0"]
+        self.simulate(lines)
+
+        def edit_channel(channel):
+            def edit(config):
+                config['channels'][channel]['waveforms'] = {'extra': {}}
+            return edit
+
+        # Channels which the program does not use
+        self.edit_config(edit_channel('1'))
+        self.assertTrue(self.simulate(lines)[1])
+        self.edit_config(edit_channel('0'))
+        self.assertFalse(self.simulate(lines)[1])
+        self.assertTrue(self.simulate(lines)[1])
+
+        def edit_noise(config):
+            config['qubits']['3']['noise']['t1'] *= 2
+        self.edit_config(edit_noise)
+        self.assertFalse(self.simulate(lines)[1])
+
+
+class TestStateStore(unittest.TestCase):
+    """Final-state distributions are memoized, and shared across instances
+    through their directory."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.directory = os.path.join(self.tmp.name, 'states')
+
+    def test_persistence(self):
+        rng = np.random.default_rng(0)
+        prob = rng.dirichlet(np.ones(8))
+        product = ProductDistribution([([0, 2], rng.dirichlet(np.ones(4))),
+                                       ([1], rng.dirichlet(np.ones(2)))])
+        store = StateStore(4, self.directory)
+        store.put(b'joint', prob, [2, 0])
+        store.put(b'product', product, [1])
+        # Read back by another instance, as by a later run
+        store = StateStore(4, self.directory)
+        self.assertIsNone(store.get(b'missing'))
+        stored, measure_qubits = store.get(b'joint')
+        np.testing.assert_array_equal(stored, prob)
+        np.testing.assert_array_equal(measure_qubits, [2, 0])
+        stored, measure_qubits = store.get(b'product')
+        self.assertEqual(len(stored.factors), 2)
+        for (qubits, factor), (stored_qubits, stored_factor) in zip(product.factors,
+                                                                    stored.factors):
+            self.assertEqual(list(stored_qubits), qubits)
+            np.testing.assert_array_equal(stored_factor, factor)
+        np.testing.assert_array_equal(measure_qubits, [1])
+        self.assertEqual((store.hits, store.misses), (2, 1))
+
+    def test_bounds(self):
+        store = StateStore(2, self.directory)
+        for i, key in enumerate((b'a', b'b', b'c')):
+            store.put(key, np.ones(2) / 2, [0])
+            # Distinct modification times, which order the files on disk
+            path = store._path(key)
+            os.utime(path, ns=(0, (i + 1) * 10 ** 9))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(key.hex() + '.npz' for key in (b'b', b'c')))
+        self.assertIsNone(StateStore(2, self.directory).get(b'a'))
+        # A size of 0 disables the store
+        store = StateStore(0, self.directory)
+        store.put(b'd', np.ones(2) / 2, [0])
+        self.assertIsNone(store.get(b'b'))
+
+    def test_simulator(self):
+        config_file = _generate_config(self.tmp.name)
+        input_file = os.path.join(self.tmp.name, 'pulses.txt')
+        with open(input_file, 'w') as f:
+            f.write("10\n0 0 0 0 0 0.5 0\n100 0 128 0 0 0 0")
+
+        def simulate():
+            simulator = PulseSimulator(config_file, None, None, 'qutip', 'qutip_solver=sliced',
+                                       f'state_cache_dir={self.directory}')
+            simulator.load_input(input_file, os.path.join(self.tmp.name, 'output.txt'))
+            with mock.patch.object(simulator, '_run_qutip_schedule',
+                                   wraps=simulator._run_qutip_schedule) as solve:
+                simulator.simulate()
+            return simulator.state_store.hits, solve.call_count
+
+        self.assertEqual(simulate(), (0, 1))
+        # Another simulator instance reuses the persisted final state
+        self.assertEqual(simulate(), (1, 0))
+        # Changing the noise model of the device invalidates it
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        config['qubits']['0']['noise']['t1'] *= 2
+        with open(config_file, 'w') as f:
+            json.dump(config, f)
+        self.assertEqual(simulate(), (0, 1))
+        self.assertEqual(simulate(), (1, 0))
+
+
+class TestSimulationPaths(unittest.TestCase):
+    """Each optimized simulation path yields the same final distribution as
+    the path it replaces."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.config_file = _generate_config(cls.tmp.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def final_distribution(self, backend, lines, *backend_params):
+        input_file = os.path.join(self.tmp.name, 'pulses.txt')
+        with open(input_file, 'w') as f:
+            f.write("1\n" + "\n".join(lines))
+        simulator = PulseSimulator(self.config_file, None, None, backend, *backend_params)
+        simulator.load_input(input_file, os.path.join(self.tmp.name, 'output.txt'))
+        simulator.simulate(0)
+        if backend == 'qutip_qip':
+            prob, _ = simulator.compiled['qutip_qip']
+        else:
+            prob, _ = simulator.state_store.get(digest(
+                'qutip', _STATE_STORE_VERSION, simulator.backend_params['qutip_solver'],
+                simulator.program_key.hex()))
+        return _joint_distribution(prob)
+
+    def assert_same_distribution(self, backend, params, reference_params, programs=4,
+                                 atol=1e-12):
+        rng = np.random.default_rng(0)
+        for i in range(programs):
+            lines = _random_program(rng)
+            with self.subTest(program=i):
+                np.testing.assert_allclose(
+                    self.final_distribution(backend, lines, *params),
+                    self.final_distribution(backend, lines, *reference_params), atol=atol)
+
+    def test_statevector_engine(self):
+        self.assert_same_distribution(
+            'qutip_qip', ['qutip_qip_engine=statevector', 'gate_fusion=0',
+                          'subsystem_decomposition=0'],
+            ['qutip_qip_engine=circuit', 'gate_fusion=0'])
+
+    def test_gate_fusion(self):
+        for engine in ('circuit', 'statevector'):
+            with self.subTest(engine=engine):
+                self.assert_same_distribution(
+                    'qutip_qip', [f'qutip_qip_engine={engine}', 'gate_fusion=1'],
+                    [f'qutip_qip_engine={engine}', 'gate_fusion=0'])
+
+    @staticmethod
+    def tight_tolerances():
+        """Solve the master equation with tight tolerances, such that the
+        integration error of qutip's default tolerances, up to ~1e-3 over a
+        whole program, does not hide differences between the paths."""
+        import qutip  # pylint: disable=import-outside-toplevel
+        options = functools.partial(qutip.Options, atol=1e-12, rtol=1e-10, nsteps=10 ** 7)
+        return mock.patch.object(qutip, 'Options', options)
+
+    def test_sliced_solver(self):
+        with self.tight_tolerances():
+            self.assert_same_distribution(
+                'qutip', ['qutip_solver=sliced', 'subsystem_decomposition=0'],
+                ['qutip_solver=full'], programs=3, atol=1e-6)
+
+    def test_subsystem_decomposition(self):
+        with self.subTest(backend='qutip'), self.tight_tolerances():
+            self.assert_same_distribution(
+                'qutip', ['qutip_solver=sliced', 'subsystem_decomposition=1'],
+                ['qutip_solver=sliced', 'subsystem_decomposition=0'], atol=1e-6)
+        with self.subTest(backend='qutip_qip'):
+            self.assert_same_distribution(
+                'qutip_qip', ['qutip_qip_engine=statevector', 'subsystem_decomposition=1'],
+                ['qutip_qip_engine=statevector', 'subsystem_decomposition=0'])
+
+
+class TestSeeding(unittest.TestCase):
+    """Seeded runs sample the same bitstrings for the same trigger, whichever
+    simulator instance samples it."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.config_file = _generate_config(cls.tmp.name)
+        cls.input_file = os.path.join(cls.tmp.name, 'pulses.txt')
+        # Superposition of all the qubits, then their measurement
+        lines = [f"0 {qubit} 1 {np.pi / 2} 0 1 0" for qubit in range(NUM_QUBITS)]
+        lines += [f"100 {qubit} 128 0 0 0 0" for qubit in range(NUM_QUBITS)]
+        with open(cls.input_file, 'w') as f:
+            f.write("200\n" + "\n".join(lines))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def sample(self, backend, triggers, *backend_params):
+        """Bitstrings of the last of the given triggers, simulated in a row by
+        a new simulator instance."""
+        simulator = PulseSimulator(self.config_file, None, None, backend, 'seed=1234',
+                                   *backend_params)
+        simulator.load_input(self.input_file, os.path.join(self.tmp.name, 'output.txt'))
+        for trigger in triggers:
+            bits, _ = simulator.simulate(trigger)
+        return bits.unpack() if isinstance(bits, result_format.PackedBits) else bits
+
+    def test_trigger_seeding(self):
+        for backend, params in (('stim', []), ('qutip_qip', ['qutip_qip_engine=statevector'])):
+            with self.subTest(backend=backend):
+                bits = self.sample(backend, [3], *params)
+                np.testing.assert_array_equal(self.sample(backend, [3], *params), bits)
+                self.assertFalse(np.array_equal(self.sample(backend, [4], *params), bits))
+                # Trigger 3 following trigger 2, numbered from 'first_trigger'
+                np.testing.assert_array_equal(
+                    self.sample(backend, [None, None], 'first_trigger=2', *params), bits)
+
+
+class TestSampling(unittest.TestCase):
+    """Sampling of the measured bits from the final distribution."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.config_file = _generate_config(cls.tmp.name)
+        # Distinct readout centers for each qubit and outcome
+        with open(cls.config_file, 'r') as f:
+            config = json.load(f)
+        for i, qubit in enumerate(config['qubits'].values()):
+            qubit['readout_center'] = {'0': [i, 10 + i], '1': [-i - 1, -10 - i]}
+        with open(cls.config_file, 'w') as f:
+            json.dump(config, f)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.simulator = PulseSimulator(self.config_file, None, None, 'qutip_qip')
+        self.simulator.rng = np.random.default_rng(0)
+        self.simulator.num_cycles = 20000
+        self.prob = np.random.default_rng(1).dirichlet(np.ones(2 ** NUM_QUBITS))
+
+    def marginal(self, qubits):
+        """Exact distribution of the given qubits, the first one being the
+        most significant bit."""
+        prob = self.prob.reshape((2,) * NUM_QUBITS)
+        prob = np.sum(prob, axis=tuple(set(range(NUM_QUBITS)) - set(qubits)))
+        return np.transpose(prob, np.argsort(np.argsort(qubits))).ravel()
+
+    def assert_marginal(self, bits, qubits):
+        """Check the frequencies of the sampled bits against the exact
+        distribution, within 5 standard deviations."""
+        indices = bits @ (1 << np.arange(len(qubits))[::-1])
+        freq = np.bincount(indices, minlength=2 ** len(qubits)) / len(bits)
+        prob = self.marginal(qubits)
+        np.testing.assert_array_less(np.abs(freq - prob),
+                                     5 * np.sqrt(prob * (1 - prob) / len(bits)) + 1e-12)
+
+    def test_marginal(self):
+        for qubits in ([0], [4, 1], [2, 0, 3], list(range(NUM_QUBITS))):
+            with self.subTest(qubits=qubits):
+                bits = self.simulator._sample_bitstrings(self.prob, qubits)
+                self.assertEqual(bits.shape, (20000, len(qubits)))
+                self.assertEqual(bits.dtype, np.uint8)
+                self.assert_marginal(bits, qubits)
+
+    def test_product_distribution(self):
+        # Qubits 0 and 3 independent from qubits 1, 2 and 4
+        prob = self.prob.reshape((2,) * NUM_QUBITS)
+        factors = [([0, 3], np.sum(prob, axis=(1, 2, 4)).ravel()),
+                   ([1, 2, 4], np.sum(prob, axis=(0, 3)).ravel())]
+        self.prob = _joint_distribution(ProductDistribution(factors))
+        bits = self.simulator._sample_bitstrings(ProductDistribution(factors), [4, 0, 3])
+        self.assert_marginal(bits, [4, 0, 3])
+
+    def test_repeated_qubit(self):
+        bits = self.simulator._sample_bitstrings(self.prob, [3, 1, 3])
+        # The same outcome is reported for both measurements of qubit 3
+        np.testing.assert_array_equal(bits[:, 0], bits[:, 2])
+        self.assert_marginal(bits[:, :2], [3, 1])
+
+    def test_no_measured_qubit(self):
+        bits = self.simulator._sample_bitstrings(self.prob, [])
+        self.assertEqual(bits.shape, (20000, 0))
+
+    def test_readout_iq(self):
+        measure_qubits = [3, 1, 3, 0]
+        bits = self.simulator._sample_bitstrings(self.prob, measure_qubits)
+        # Gaussian draws of zero width land on the centers
+        rng = self.simulator.rng
+        self.simulator.rng = mock.Mock(wraps=rng, normal=lambda loc: rng.normal(loc, 0))
+        iq = self.simulator._sample_readout_iq(bits, measure_qubits)
+        self.assertEqual(iq.shape, (20000, len(measure_qubits), 2))
+        for column, qubit in enumerate(measure_qubits):
+            for outcome, center in (0, [qubit, 10 + qubit]), (1, [-qubit - 1, -10 - qubit]):
+                selected = bits[:, column] == outcome
+                self.assertTrue(selected.any())
+                np.testing.assert_array_equal(
+                    iq[selected, column], np.broadcast_to(center, (selected.sum(), 2)))
+
+
+def _memory_program(macros, rounds):
+    """Lines of a Z-basis memory experiment of the rotated surface code,
+    following 'programs/cpp/qec/qmemory_experiment.cpp', with the macros of the
+    header generated by 'qec_gen.py', followed by the measurement of all data
+    qubits."""
+    lines = []
+    time = 0
+
+    def pulses(channels, index, phase, duration):
+        nonlocal time
+        lines.extend(f"{time} {channel} {index} {phase} 0 1 0" for channel in channels)
+        time += duration
+
+    def group(name):
+        return range(macros[f'{name}_START'], macros[f'{name}_END'])
+
+    def sqrt_y(first, last, duration):
+        pulses(range(macros[f'{first}_START'], macros[f'{last}_END']), 1, np.pi / 2, duration)
+
+    def cz(slot):
+        pulses([0x400 + channel for channel in group(f'SLOT_{slot}')], 0, 0, 40)
+
+    for _ in range(rounds):
+        sqrt_y('D1', 'X2', 20)
+        for slot in range(4):
+            cz(slot)
+        sqrt_y('D1', 'Z2', 20)
+        pulses(range(macros['X1_START'], macros['X2_END']), 128, 0, 0)
+        for slot in range(4, 8):
+            cz(slot)
+        sqrt_y('Z1', 'Z2', 20)
+        pulses(range(macros['Z1_START'], macros['Z2_END']), 128, 0, 420)
+    pulses(range(macros['D1_START'], macros['D4_END']), 128, 0, 0)
+    return lines
+
+
+class TestStimCircuit(unittest.TestCase):
+    """Circuits compiled by the 'stim' backend, with their error model,
+    detectors and logical observables."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def simulate(self, config_file, lines, shots=1, *backend_params):
+        input_file = os.path.join(self.tmp.name, 'pulses.txt')
+        with open(input_file, 'w') as f:
+            f.write(f"{shots}\n" + "\n".join(lines))
+        simulator = PulseSimulator(config_file, None, None, 'stim', *backend_params)
+        simulator.load_input(input_file, os.path.join(self.tmp.name, 'output.txt'))
+        bits, _ = simulator.simulate(0)
+        return bits.unpack(), simulator.compiled['stim_circuit'][0]
+
+    def test_error_model(self):
+        import stim
+        config_file = _generate_config(self.tmp.name)
+        # X gate, CZ and measurements, with idle time on qubit 0 before the CZ
+        lines = ["0 0 0 0 0 1 0", "1000 1024 0 0 0 1 0",
+                 "1100 0 128 0 0 0 0", "1100 1 128 0 0 0 0"]
+        _, circuit = self.simulate(config_file, lines)
+        self.assertEqual(circuit, stim.Circuit("X 0\nCZ 0 1\nM 0 1"))
+        _, circuit = self.simulate(config_file, lines, 1, 'stim_depolarize1=0.01',
+                                   'stim_depolarize2=0.02', 'stim_readout_error=0.03')
+        self.assertEqual(circuit, stim.Circuit("""
+            X 0
+            DEPOLARIZE1(0.01) 0
+            CZ 0 1
+            DEPOLARIZE2(0.02) 0 1
+            X_ERROR(0.03) 0
+            M 0
+            X_ERROR(0.03) 1
+            M 1
+        """))
+        _, circuit = self.simulate(config_file, lines, 1, 'stim_idle_noise=1')
+        self.assertEqual([instruction.name for instruction in circuit],
+                         ["X", "PAULI_CHANNEL_1", "CZ", "M"])
+
+    def test_noiseless_memory_experiment(self):
+        topology_file, header_file, qec_file = (
+            os.path.join(self.tmp.name, name)
+            for name in ('topology.json', 'qec.h', 'qec.json'))
+        subprocess.run([sys.executable, QEC_GEN, '3', topology_file, header_file, qec_file],
+                       check=True, capture_output=True)
+        with open(header_file, 'r') as f:
+            macros = {name: int(value) for _, name, value in
+                      (line.split() for line in f if line.startswith('#define'))}
+        config_file = _generate_config(self.tmp.name, '--detectors', qec_file,
+                                       topology_file=topology_file)
+        rounds = 5
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            bits, circuit = self.simulate(config_file, _memory_program(macros, rounds), 200,
+                                          'stim_output=detectors')
+        # The X logical is random after the final Z-basis data measurements
+        self.assertEqual(len(caught), 1)
+        self.assertIn("Logical X observable 1", str(caught[0].message))
+        num_stabilizers = macros['N_QUBITS'] - macros['N_DATA_QUBITS']
+        self.assertEqual(circuit.num_detectors, num_stabilizers * (rounds - 2))
+        self.assertEqual(circuit.num_observables, 1)
+        self.assertEqual(bits.shape, (200, circuit.num_detectors + 1))
+        self.assertFalse(bits.any())
+
+    def test_record_targets(self):
+        qec_file = os.path.join(self.tmp.name, 'qec.json')
+        with open(qec_file, 'w') as f:
+            json.dump({'qubit_coords': [[i, 0] for i in range(NUM_QUBITS)],
+                       'detectors': [{'type': 'Z', 'qubits': [1, 2], 'lookback': [0, 2]}],
+                       'observables': [{'type': 'Z', 'qubits': [0, 2]}]}, f)
+        config_file = _generate_config(self.tmp.name, '--detectors', qec_file)
+        # Ancillas 1 and 2 measured in alternation, then the data qubit 0
+        lines = [f"{100 * i} {1 + i % 2} 128 0 0 0 0" for i in range(6)] + ["600 0 128 0 0 0 0"]
+        _, circuit = self.simulate(config_file, lines, 1, 'stim_output=detectors')
+        import stim
+        expected = stim.Circuit("""
+            M 1 2 1 2
+            M 1
+            DETECTOR(1, 0, 2) rec[-1] rec[-5]
+            M 2
+            DETECTOR(2, 0, 2) rec[-1] rec[-5]
+            M 0
+            OBSERVABLE_INCLUDE(0) rec[-1] rec[-2]
+        """)
+        self.assertEqual(circuit, expected)
+
+
+class TestWaveformLibrary(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        with open(_generate_config(self.tmp, '--inline-waveforms'), 'r') as f:
+            self.inline_config = json.load(f)
+        # Envelopes of each data type, shared by two channels
+        self.inline_config['channels']['0']['waveforms']['5'] = \
+            ['xy_waveform', [[1, -2, 0x7fff], [0x8000, -0x8001, 3]]]
+        self.inline_config['channels']['1']['waveforms']['5'] = \
+            ['xy_waveform', [[0.5, 1.25], [-1.5, 2.0]]]
+
+    def write(self, name='pulse.wfm'):
+        config, waveforms = compact_config(self.inline_config, name)
+        write_library(os.path.join(self.tmp, name), waveforms)
+        library = WaveformLibrary(library_path(os.path.join(self.tmp, 'pulse.json'), config))
+        self.addCleanup(library.mmap.close)
+        return config, library
+
+    def assert_same_entry(self, resolved, entry):
+        if isinstance(resolved, np.ndarray):
+            np.testing.assert_array_equal(resolved, entry)
+        elif isinstance(resolved, list):
+            self.assertEqual(len(resolved), len(entry))
+            for resolved_item, item in zip(resolved, entry):
+                self.assert_same_entry(resolved_item, item)
+        else:
+            self.assertEqual(resolved, entry)
+
+    def test_round_trip(self):
+        config, library = self.write()
+        for channel, channel_config in self.inline_config['channels'].items():
+            for index, entry in channel_config['waveforms'].items():
+                with self.subTest(channel=channel, index=index):
+                    resolved = library.resolve(channel_waveform(
+                        config, config['channels'][channel], index))
+                    self.assert_same_entry(resolved, entry)
+        # Envelopes are stored in the most compact data type
+        for channel, codes in (('0', ['h', 'i']), ('1', ['d', 'd'])):
+            _, envelopes = library.resolve(channel_waveform(
+                config, config['channels'][channel], '5'))
+            self.assertEqual([envelope.dtype.char for envelope in envelopes], codes)
+            self.assertFalse(envelopes[0].flags.writeable)
+
+    def test_deduplication(self):
+        config, library = self.write()
+        self.assertLess(len(config['waveform_sets']), len(config['channels']))
+        self.assertEqual(len({library.get(i).tobytes() for i in range(len(library))}),
+                         len(library))
+
+    def test_digest(self):
+        _, library = self.write()
+        _, same = self.write('same.wfm')
+        self.assertEqual(library.digest, same.digest)
+        self.inline_config['channels']['0']['waveforms']['5'][1][0][0] = 2
+        _, other = self.write('other.wfm')
+        self.assertNotEqual(library.digest, other.digest)
+
+    def test_simulator(self):
+        # Both forms of the configuration are simulated alike
+        compact_dir = os.path.join(self.tmp, 'compact')
+        os.mkdir(compact_dir)
+        lines = _random_program(np.random.default_rng(0))
+        input_file = os.path.join(self.tmp, 'pulses.txt')
+        with open(input_file, 'w') as f:
+            f.write("50\n" + "\n".join(lines))
+        results = []
+        for config_file in (_generate_config(compact_dir),
+                            os.path.join(self.tmp, 'pulse.json')):
+            simulator = PulseSimulator(config_file, None, None, 'qutip_qip', 'seed=1')
+            simulator.load_input(input_file, os.path.join(self.tmp, 'output.txt'))
+            results.append(simulator.simulate(0)[0])
+            self.assertEqual(simulator.waveform_library is not None,
+                             config_file.startswith(compact_dir))
+        np.testing.assert_array_equal(*results)
+
+    def test_not_a_library(self):
+        path = os.path.join(self.tmp, 'pulse.json')
+        with self.assertRaises(ValueError):
+            WaveformLibrary(path)
+
+
+class TestWaveformOverlay(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.path = os.path.join(self.tmp, 'pulse.overlay')
+
+    def test_round_trip(self):
+        waveform_overlay.append_record(self.path, 3, 5, b'x', [1, -2, 3, 0x7fff])
+        # Samples which do not fit int16 are stored as int32
+        waveform_overlay.append_record(self.path, 4, 70, b'z', [0x8000, -0x8001])
+        records, offset = waveform_overlay.read_records(self.path)
+        self.assertEqual(offset, os.path.getsize(self.path))
+        self.assertEqual([record[:4] for record in records],
+                         [('3', '5', 'xy_waveform', b'h'), ('4', '70', 'z_waveform', b'i')])
+        np.testing.assert_array_equal(np.frombuffer(records[0][4], dtype='<i2'),
+                                      [1, -2, 3, 0x7fff])
+        np.testing.assert_array_equal(np.frombuffer(records[1][4], dtype='<i4'),
+                                      [0x8000, -0x8001])
+
+    def test_incremental_read(self):
+        self.assertEqual(waveform_overlay.read_records(self.path), ([], 0))
+        waveform_overlay.append_record(self.path, 0, 5, b'x', [1, 2])
+        records, offset = waveform_overlay.read_records(self.path)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(waveform_overlay.read_records(self.path, offset), ([], offset))
+        waveform_overlay.append_record(self.path, 1, 6, b'x', [3, 4])
+        records, offset = waveform_overlay.read_records(self.path, offset)
+        self.assertEqual([record[:2] for record in records], [('1', '6')])
+        self.assertEqual(offset, os.path.getsize(self.path))
+
+    def test_partial_record(self):
+        waveform_overlay.append_record(self.path, 0, 5, b'x', [1, 2])
+        complete = os.path.getsize(self.path)
+        waveform_overlay.append_record(self.path, 1, 6, b'x', [3, 4, 5, 6])
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # A record still being written is left for the next read
+        for size in (complete + 4, len(data) - 1):
+            with open(self.path, 'wb') as f:
+                f.write(data[:size])
+            records, offset = waveform_overlay.read_records(self.path)
+            self.assertEqual((len(records), offset), (1, complete))
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        records, offset = waveform_overlay.read_records(self.path, complete)
+        self.assertEqual((len(records), offset), (1, len(data)))
+
+    def test_corrupt(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            waveform_overlay.read_records(self.path)
+
+    def test_channel_index(self):
+        config_file = _generate_config(self.tmp)
+        index_file = waveform_overlay.channel_index_path(config_file)
+        with open(config_file, 'r') as f:
+            channels = json.load(f)['channels']
+        self.assertEqual(waveform_overlay.read_channel_index(index_file),
+                         {channel: config['type'] for channel, config in channels.items()})
+        self.assertIsNone(waveform_overlay.read_channel_index(index_file + '.missing'))
+
+    def test_transmission(self):
+        config_file = _generate_config(self.tmp)
+        input_file = os.path.join(self.tmp, 'envelope.txt')
+
+        def transmit(channel, index, envelope, length=None):
+            if length is None:
+                length = len(envelope)
+            with open(input_file, 'w') as f:
+                f.write(f"{channel} {index} {length}\n"
+                        + "\n".join(map(str, envelope)))
+            return subprocess.run(
+                [sys.executable, os.path.join(PULSE_SIMULATOR_DIR, 'envelope_transmission.py'),
+                 input_file, config_file], capture_output=True, check=False).returncode
+
+        def check_rejected():
+            self.assertEqual(transmit(1024, 5, [1, 2]), 1)
+            self.assertEqual(transmit(99, 5, [1, 2]), 1)
+            self.assertEqual(transmit(0, 0, [1, 2]), 1)
+            self.assertEqual(transmit(0, 5, [1, 2], length=4), 1)
+            self.assertEqual(transmit(0, 5, [1, 2, 3, 4], length=2), 1)
+
+        simulator = PulseSimulator(config_file, None, None, 'qutip')
+        self.assertEqual(transmit(0, 5, [1, 2, 3, 4]), 0)
+        with self.subTest(channel_index=True):
+            check_rejected()
+        # Without a channel index, the configuration itself is checked
+        os.remove(waveform_overlay.channel_index_path(config_file))
+        with self.subTest(channel_index=False):
+            check_rejected()
+        self.assertEqual(transmit(1, 6, [5, 6]), 0)
+        self.assertTrue(simulator.reload_config_if_changed())
+        self.assertEqual(list(simulator.waveform_overlay), [('0', '5'), ('1', '6')])
+        _, (coefs_x, coefs_y) = simulator.waveform_overlay[('0', '5')]
+        np.testing.assert_array_equal(coefs_x, [1, 2])
+        np.testing.assert_array_equal(coefs_y, [3, 4])
+        # The simulator ignores records on unsupported channels, written
+        # without checking them
+        waveform_overlay.append_record(waveform_overlay.overlay_path(config_file),
+                                       1024, 5, b'x', [1, 2])
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertTrue(simulator.reload_config_if_changed())
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(list(simulator.waveform_overlay), [('0', '5'), ('1', '6')])
+
+
+if __name__ == '__main__':
+    unittest.main()